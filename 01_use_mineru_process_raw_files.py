@@ -1,30 +1,205 @@
 import os
-import json
 import shutil
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from kb_catalog import FileCatalog, STAGE_UPLOAD
 
-def process_knowledge_base(metadata_path, raw_dir, processed_dir, api_token, api_url):
+
+def copy_markdown_file(file_info, raw_dir, processed_dir):
+    """
+    将原始目录中的 Markdown 文件复制到处理后目录的对应位置。
+
+    :param file_info: 清单中的文件信息字典。
+    :param raw_dir: 原始文件目录。
+    :param processed_dir: 处理后文件存放的目录。
+    :return: 复制后的目标路径。
+    """
+    src_path = file_info["absolute_path"]
+    # 计算目标路径
+    relative_to_raw = os.path.relpath(src_path, raw_dir)
+    dest_path = os.path.join(processed_dir, relative_to_raw)
+
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    shutil.copy2(src_path, dest_path)
+    print(f"  - 已复制: {file_info['file_name']} -> {dest_path}")
+    return dest_path
+
+
+def build_header(api_token):
+    """
+    构造 MinerU API 请求头。
+    """
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_token}",
+    }
+
+
+def create_session(pool_size):
+    """
+    创建带连接池的 requests.Session，连接池大小与上传并发数一致，避免每次请求都新建连接。
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def split_into_batches(file_infos, batch_size):
+    """
+    将待上传文件按 batch_size 分批，并保证同一批内 data_id 不重复。
+
+    内容完全相同的文件共享同一个 data_id，若放在同一批中将无法区分它们的解析结果，
+    因此重复的文件会被顺延到后续批次。
+    """
+    batches = []
+    remaining = list(file_infos)
+    while remaining:
+        batch, seen, deferred = [], set(), []
+        for file_info in remaining:
+            if len(batch) < batch_size and file_info["data_id"] not in seen:
+                batch.append(file_info)
+                seen.add(file_info["data_id"])
+            else:
+                deferred.append(file_info)
+        batches.append(batch)
+        remaining = deferred
+    return batches
+
+
+def _put_file(session, upload_url, file_info):
+    """
+    将单个文件 PUT 到预签名上传地址。
+    """
+    with open(file_info["absolute_path"], "rb") as f:
+        res_upload = session.put(upload_url, data=f)
+    return res_upload.status_code
+
+
+def upload_files_batched(
+    file_infos, api_url, header, batch_size=50, upload_workers=8, on_uploaded=None
+):
+    """
+    批量上传文件到 MinerU：每 batch_size 个文件只申请一次上传链接，
+    再用有界线程池通过共享连接池并发上传各个文件。
+
+    :param file_infos: 清单中的文件信息字典列表。
+    :param api_url: MinerU API的端点。
+    :param header: 请求头，见 build_header。
+    :param batch_size: 每个批处理请求包含的文件数（MinerU 单批上限为 200）。
+    :param upload_workers: 并发上传的线程数。
+    :param on_uploaded: 回调 (file_info, batch_id)，每个文件上传成功后在工作线程中立即调用。
+    :return: {relative_path: batch_id}，只包含上传成功的文件。
+    """
+    uploaded = {}
+
+    def upload_one(session, upload_url, file_info, batch_id):
+        try:
+            status_code = _put_file(session, upload_url, file_info)
+        except (OSError, requests.exceptions.RequestException) as e:
+            print(f"  - 上传失败: {file_info['file_name']} ({e})")
+            return
+        if status_code != 200:
+            print(f"  - 上传失败: {file_info['file_name']} (状态码: {status_code})")
+            return
+        print(f"  - 上传成功: {file_info['file_name']}")
+        uploaded[file_info["relative_path"]] = batch_id
+        if on_uploaded:
+            on_uploaded(file_info, batch_id)
+
+    batches = split_into_batches(file_infos, batch_size)
+    futures = []
+    with create_session(upload_workers) as session, ThreadPoolExecutor(
+        max_workers=upload_workers
+    ) as executor:
+        for batch_num, batch in enumerate(batches, start=1):
+            print(
+                f"\n- [批次 {batch_num}/{len(batches)}] 正在为 {len(batch)} 个文件请求上传链接..."
+            )
+            data = {
+                "enable_formula": True,
+                "language": "ch",
+                "enable_table": True,
+                "files": [
+                    {
+                        "name": file_info["file_name"],
+                        "is_ocr": True,
+                        "data_id": file_info["data_id"],
+                    }
+                    for file_info in batch
+                ],
+            }
+
+            try:
+                response = session.post(api_url, headers=header, json=data)
+                response.raise_for_status()
+                result = response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"  - 网络请求错误: {e}")
+                continue
+
+            try:
+                if result.get("code") != 0:
+                    print(f"  - API请求失败: {result.get('msg', '未知错误')}")
+                    continue
+                batch_id = result["data"]["batch_id"]
+                file_urls = result["data"]["file_urls"]
+            except (KeyError, TypeError) as e:
+                print(f"  - 解析API响应失败: {e}")
+                continue
+
+            if len(file_urls) != len(batch):
+                print(
+                    f"  - API返回的上传链接数量 ({len(file_urls)}) 与文件数 ({len(batch)}) 不一致，跳过该批次。"
+                )
+                continue
+            print(f"  - 获取链接成功。批处理ID: {batch_id}")
+
+            # 上传任务提交后立即去申请下一批的链接，上传与申请链接并行进行
+            for upload_url, file_info in zip(file_urls, batch):
+                futures.append(
+                    executor.submit(
+                        upload_one, session, upload_url, file_info, batch_id
+                    )
+                )
+
+        wait(futures)
+
+    return uploaded
+
+
+def process_knowledge_base(
+    catalog,
+    raw_dir,
+    processed_dir,
+    api_token,
+    api_url,
+    batch_size=50,
+    upload_workers=8,
+):
     """
-    处理原始文件，将md文件复制，将非md文件上传并更新元数据。
+    处理原始文件，将md文件复制，将非md文件上传并在清单数据库中记录batch_id。
 
-    :param metadata_path: metadata.json 文件的路径。
+    :param catalog: FileCatalog 清单数据库实例（由 00 号脚本生成）。
     :param raw_dir: 原始文件目录 (e.g., 'knowledge_base/01_raw_files')。
     :param processed_dir: 处理后文件存放的目录 (e.g., 'knowledge_base/02_raw_md_files')。
     :param api_token: 用于API认证的token。
     :param api_url: MinerU API的端点。
+    :param batch_size: 每个批处理请求包含的文件数，为 1 时等同于逐个上传。
+    :param upload_workers: 并发上传的线程数。
     """
-    # --- 1. 加载元数据 ---
-    try:
-        with open(metadata_path, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
-        print(f"成功加载元数据: {metadata_path}")
-    except (FileNotFoundError, json.JSONDecodeError) as e:
+    # --- 1. 加载清单 ---
+    files = catalog.iter_files()
+    if not files:
         print(
-            f"错误: 无法加载或解析元数据文件 {metadata_path}。请先运行 'create_metadata.py'。原因: {e}"
+            f"错误: 清单数据库 {catalog.db_path} 中没有任何文件。请先运行 '00_create_metadata_for_raw_files.py'。"
         )
         return
+    print(f"成功加载清单: {catalog.db_path} (共 {len(files)} 个文件)")
 
     # --- 2. 复制目录结构，包括空文件夹 ---
     print("\n--- 正在复制目录结构 ---")
@@ -41,17 +216,22 @@ def process_knowledge_base(metadata_path, raw_dir, processed_dir, api_token, api
     md_files_to_copy = []
     files_to_upload = []
 
-    for file_uuid, file_info in metadata.items():
-        file_path = file_info.get("absolute_path")
-        if not file_path or not os.path.exists(file_path):
-            print(f"警告: 跳过文件 (UUID: {file_uuid})，路径不存在: {file_path}")
+    for file_info in files:
+        file_path = file_info["absolute_path"]
+        if not os.path.exists(file_path):
+            print(
+                f"警告: 跳过文件 {file_info['relative_path']}，路径不存在: {file_path}"
+            )
+            continue
+
+        progress = catalog.get_progress(file_info["relative_path"], STAGE_UPLOAD)
+        if progress and progress["state"] == "done":
+            # 内容未变化且已处理过的文件直接跳过
             continue
 
         if file_path.endswith(".md"):
             md_files_to_copy.append(file_info)
         else:
-            # 为待上传文件添加UUID，以便后续更新元数据
-            file_info["uuid"] = file_uuid
             files_to_upload.append(file_info)
 
     # --- 4. 复制Markdown文件 ---
@@ -60,77 +240,38 @@ def process_knowledge_base(metadata_path, raw_dir, processed_dir, api_token, api
         print("没有找到需要直接复制的Markdown文件。")
     else:
         for file_info in md_files_to_copy:
-            src_path = file_info["absolute_path"]
-            # 计算目标路径
-            relative_to_raw = os.path.relpath(src_path, raw_dir)
-            dest_path = os.path.join(processed_dir, relative_to_raw)
-
-            # 直接复制文件，因为目录已提前创建
-            shutil.copy2(src_path, dest_path)
-            print(f"  - 已复制: {file_info['file_name']} -> {dest_path}")
+            # 目录已提前创建，直接复制文件
+            copy_markdown_file(file_info, raw_dir, processed_dir)
+            catalog.record_progress(
+                file_info["relative_path"],
+                STAGE_UPLOAD,
+                fingerprint=file_info["content_hash"],
+                detail="copied",
+            )
 
     # --- 5. 上传非Markdown文件 ---
     print("\n--- 开始处理非Markdown文件 (上传) ---")
     if not files_to_upload:
         print("没有找到需要上传的非Markdown文件。")
     else:
-        header = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_token}",
-        }
-
-        # 遍历每个文件，单独上传并记录batch_id
-        for file_info in files_to_upload:
-            file_uuid = file_info["uuid"]
-            print(f"\n- 开始处理文件: {file_info['file_name']}")
-
-            # 1. 为单个文件构造API请求体
-            data = {
-                "enable_formula": True,
-                "language": "ch",
-                "enable_table": True,
-                "files": [
-                    {
-                        "name": file_info["file_name"],
-                        "is_ocr": True,
-                        "data_id": file_uuid,
-                    }
-                ],
-            }
+        header = build_header(api_token)
 
-            try:
-                # 2. 获取上传URL
-                print(f"  - 正在请求上传链接...")
-                response = requests.post(api_url, headers=header, json=data)
-                response.raise_for_status()
-                result = response.json()
-
-                if result.get("code") == 0 and result["data"]["file_urls"]:
-                    batch_id = result["data"]["batch_id"]
-                    upload_url = result["data"]["file_urls"][0]
-                    print(f"  - 获取链接成功。批处理ID: {batch_id}")
-
-                    # 3. 上传文件
-                    with open(file_info["absolute_path"], "rb") as f:
-                        res_upload = requests.put(upload_url, data=f)
-
-                    if res_upload.status_code == 200:
-                        print(f"  - 上传成功。")
-                        # 4. 记录batch_id到元数据
-                        metadata[file_uuid]["batch_id"] = batch_id
-                    else:
-                        print(f"  - 上传失败 (状态码: {res_upload.status_code})")
-                else:
-                    print(f"  - API请求失败: {result.get('msg', '未知错误')}")
-            except requests.exceptions.RequestException as e:
-                print(f"  - 网络请求错误: {e}")
-            except (KeyError, IndexError) as e:
-                print(f"  - 解析API响应失败: {e}")
+        # 每个文件上传成功后立即将batch_id记录到清单，中途中断也不会丢失
+        uploaded = upload_files_batched(
+            files_to_upload,
+            api_url,
+            header,
+            batch_size=batch_size,
+            upload_workers=upload_workers,
+            on_uploaded=lambda file_info, batch_id: catalog.set_batch_id(
+                file_info["relative_path"], batch_id
+            ),
+        )
+        print(
+            f"\n上传完成：成功 {len(uploaded)} 个，失败 {len(files_to_upload) - len(uploaded)} 个。"
+        )
 
-    # --- 6. 保存更新后的元数据 ---
-    with open(metadata_path, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=4, ensure_ascii=False)
-    print(f"\n处理完成。元数据已更新并保存至: {metadata_path}")
+    print(f"\n处理完成。处理进度已记录至: {catalog.db_path}")
 
 
 if __name__ == "__main__":
@@ -143,20 +284,25 @@ if __name__ == "__main__":
     PROCESSED_FILES_DIR = os.path.join(
         PROJECT_ROOT, "knowledge_base", "02_raw_md_files"
     )
-    METADATA_PATH = os.path.join(PROJECT_ROOT, "knowledge_base", "metadata.json")
 
     # --- 从环境变量中获取API凭证 ---
     MINERU_API_TOKEN = os.getenv("MINERU_API_TOKEN")
     MINERU_API_URL = os.getenv("MINERU_API_URL")
+    # 每批申请上传链接的文件数，以及并发上传的线程数
+    MINERU_UPLOAD_BATCH_SIZE = int(os.getenv("MINERU_UPLOAD_BATCH_SIZE", "50"))
+    MINERU_UPLOAD_WORKERS = int(os.getenv("MINERU_UPLOAD_WORKERS", "8"))
 
     if not MINERU_API_TOKEN or not MINERU_API_URL:
         print("错误：请在 .env 文件中设置 MINERU_API_TOKEN 和 MINERU_API_URL。")
         exit()
 
-    process_knowledge_base(
-        METADATA_PATH,
-        RAW_FILES_DIR,
-        PROCESSED_FILES_DIR,
-        MINERU_API_TOKEN,
-        MINERU_API_URL,
-    )
+    with FileCatalog.open_default(PROJECT_ROOT) as catalog:
+        process_knowledge_base(
+            catalog,
+            RAW_FILES_DIR,
+            PROCESSED_FILES_DIR,
+            MINERU_API_TOKEN,
+            MINERU_API_URL,
+            batch_size=MINERU_UPLOAD_BATCH_SIZE,
+            upload_workers=MINERU_UPLOAD_WORKERS,
+        )
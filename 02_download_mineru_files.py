@@ -1,69 +1,394 @@
 import requests
 import json
+import sys
 from tqdm import tqdm
 import os
 import zipfile
-import time
-import shutil
+import random
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from kb_catalog import FileCatalog, STAGE_DOWNLOAD
 
-def download_and_move_file(url, file_info, raw_files_base_dir, processed_files_dir):
+# 下载时每次读写的字节数
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def get_zip_path(file_info, raw_files_base_dir, processed_files_dir):
+    """
+    计算某个原始文件对应的 MinerU 结果 zip 在 processed_files_dir 下的最终路径：
+    目录结构与原始文件相同，文件名为“原始文件名（去掉扩展名）.zip”。
+    """
+    # 1. 计算相对于 '01_raw_files' 的路径
+    relative_path_from_raw = os.path.relpath(
+        file_info["absolute_path"], raw_files_base_dir
+    )
+    # 2. 构建在 '02_raw_md_files' 中的最终完整路径
+    new_filename = os.path.splitext(file_info["file_name"])[0] + ".zip"
+    return os.path.join(
+        processed_files_dir, os.path.dirname(relative_path_from_raw), new_filename
+    )
+
+
+def verify_zip_file(file_path, expected_size=None):
+    """
+    校验下载的 zip 文件：大小与服务器声明的一致，且所有成员的 CRC32 校验通过。
+
+    :return: 校验失败的原因；校验通过时返回 None。
+    """
+    actual_size = os.path.getsize(file_path)
+    if expected_size is not None and actual_size != expected_size:
+        return f"文件大小不一致 (期望 {expected_size}，实际 {actual_size})"
+    try:
+        with zipfile.ZipFile(file_path, "r") as zip_ref:
+            bad_member = zip_ref.testzip()
+    except zipfile.BadZipFile as e:
+        return f"不是有效的 zip 文件: {e}"
+    if bad_member is not None:
+        return f"zip 成员 {bad_member} 校验失败"
+    return None
+
+
+def _read_validator(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_validator(path, response_headers):
+    """
+    保存响应的强 ETag（弱 ETag 不能用于 If-Range）或 Last-Modified；都没有时删除旧记录。
     """
-    从URL下载文件，重命名为"原始文件名.zip"，并移动到processed_files_dir下的对应目录。
+    etag = response_headers.get("ETag")
+    validator = (
+        etag if etag and not etag.startswith("W/") else None
+    ) or response_headers.get("Last-Modified")
+    if validator:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(validator)
+    else:
+        _remove_if_exists(path)
+
+
+def _remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def download_and_move_file(
+    url,
+    file_info,
+    raw_files_base_dir,
+    processed_files_dir,
+    session=None,
+    chunk_size=DOWNLOAD_CHUNK_SIZE,
+):
+    """
+    从URL下载文件，保存为"原始文件名.zip"到processed_files_dir下的对应目录。
+
+    文件先下载到目标目录中的 ".part" 临时文件，中断后再次调用会通过 HTTP Range 续传；
+    续传时附带首次响应的 ETag / Last-Modified 作为 If-Range，服务器上的文件已变化时会返回完整内容，
+    不会把新文件的字节接到旧的临时文件后面。下载完成并通过大小和 zip CRC 校验后，
+    再原子地重命名为最终文件名。
+
     :param url: 文件的下载链接
     :param file_info: 包含原始文件信息的元数据字典
     :param raw_files_base_dir: 原始文件根目录 (e.g., '.../01_raw_files')
     :param processed_files_dir: 处理后文件存放的根目录 (e.g., '.../02_raw_md_files')
+    :param session: 可选的 requests.Session，用于复用连接
+    :param chunk_size: 每次读写的字节数
+    :return: 成功时返回最终文件路径，失败时返回 None
     """
-    try:
-        # 从 URL 中提取文件名
-        local_filename = url.split("/")[-1]
-        # 临时下载路径
-        temp_download_path = local_filename
+    final_path = get_zip_path(file_info, raw_files_base_dir, processed_files_dir)
+    # 临时文件与目标文件在同一目录，保证最后的重命名是同一文件系统内的原子操作
+    temp_download_path = final_path + ".part"
+    # 临时文件对应的 ETag / Last-Modified，续传时用于 If-Range
+    validator_path = temp_download_path + ".validator"
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    http = session or requests
 
-        print(f"准备下载文件: {local_filename}")
+    try:
+        offset = (
+            os.path.getsize(temp_download_path)
+            if os.path.exists(temp_download_path)
+            else 0
+        )
+        validator = _read_validator(validator_path) if offset else None
+        if offset and not validator:
+            # 无法确认临时文件来自同一个 zip，不能续传
+            offset = 0
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+        print(f"准备下载文件: {os.path.basename(final_path)}")
+        if offset:
+            print(f"  - 发现未完成的下载，从第 {offset} 字节处续传。")
 
         # 使用 stream=True 进行流式下载
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()  # 如果请求失败 (如 404), 会抛出异常
-            total_size = int(r.headers.get("content-length", 0))
-
-            # 使用 tqdm 创建进度条
-            with open(temp_download_path, "wb") as f, tqdm(
-                desc=local_filename,
-                total=total_size,
-                unit="iB",
-                unit_scale=True,
-                unit_divisor=1024,
-            ) as bar:
-                for chunk in r.iter_content(chunk_size=8192):
-                    size = f.write(chunk)
-                    bar.update(size)
-        print(f"文件下载成功，已临时保存至: {temp_download_path}")
-
-        # --- 计算目标路径并移动文件 ---
-        # 1. 新的文件名 = 原始文件名 + .zip
-        new_filename = "".join(file_info["file_name"].split(".")[:-1]) + ".zip"
-
-        # 2. 计算相对于 '01_raw_files' 的路径
-        relative_path_from_raw = os.path.relpath(
-            file_info["absolute_path"], raw_files_base_dir
+        with http.get(url, stream=True, headers=headers, timeout=60) as r:
+            if r.status_code == 416:
+                # 请求的范围超出文件大小，说明临时文件已经完整
+                expected_size = offset
+                mode = None
+            else:
+                r.raise_for_status()  # 如果请求失败 (如 404), 会抛出异常
+                if r.status_code == 206:
+                    mode = "ab"
+                else:
+                    # 服务器不支持 Range，或文件已变化 (If-Range 不匹配)，只能从头下载
+                    offset = 0
+                    mode = "wb"
+                    _write_validator(validator_path, r.headers)
+                content_length = r.headers.get("content-length")
+                expected_size = offset + int(content_length) if content_length else None
+
+            if mode:
+                # 使用 tqdm 创建进度条
+                with open(temp_download_path, mode) as f, tqdm(
+                    desc=os.path.basename(final_path),
+                    total=expected_size,
+                    initial=offset,
+                    unit="iB",
+                    unit_scale=True,
+                    unit_divisor=1024,
+                ) as bar:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        size = f.write(chunk)
+                        bar.update(size)
+
+        # --- 校验并原子地重命名 ---
+        error = verify_zip_file(temp_download_path, expected_size)
+        if error:
+            print(f"下载的文件校验失败: {error}，已删除临时文件。")
+            os.remove(temp_download_path)
+            _remove_if_exists(validator_path)
+            return None
+
+        os.replace(temp_download_path, final_path)
+        _remove_if_exists(validator_path)
+        print(f"文件下载并校验成功，已保存到: {final_path}")
+        return final_path
+
+    except (requests.exceptions.RequestException, OSError) as e:
+        print(f"下载失败: {e}。已下载的部分会在下次运行时续传。")
+        return None
+
+
+async def poll_batch(
+    session,
+    poll_url_base,
+    header,
+    batch_id,
+    tasks,
+    on_done,
+    on_failed,
+    initial_interval=5,
+    max_interval=60,
+):
+    """
+    轮询单个批处理任务，直到其中所有文件都完成或失败。
+
+    每轮只对该 batch 发一次请求，并把结果分发给其中的每个 data_id；
+    本轮没有新文件完成时按 1.5 倍退避轮询间隔，有进展时重置，并叠加随机抖动避免各任务同时请求。
+
+    :param session: 共享的 requests.Session。
+    :param poll_url_base: 轮询结果的URL前缀。
+    :param header: 请求头。
+    :param batch_id: 批处理ID。
+    :param tasks: 以 data_id 为键、清单文件信息字典为值的该批次待处理文件。
+    :param on_done: 回调 (file_info, task_result)，文件解析完成时调用。
+    :param on_failed: 回调 (file_info, task_result)，文件解析失败时调用。
+    :param initial_interval: 初始轮询间隔（秒）。
+    :param max_interval: 最大轮询间隔（秒）。
+    """
+    url = f"{poll_url_base}/{batch_id}"
+    remaining = dict(tasks)
+    interval = initial_interval
+
+    while remaining:
+        progressed = False
+        try:
+            res = await asyncio.to_thread(session.get, url, headers=header, timeout=30)
+            if not res.ok:
+                print(
+                    f"  - 查询批处理 {batch_id} 失败，状态码: {res.status_code}。稍后重试。"
+                )
+            else:
+                result_data = res.json()
+                data = result_data.get("data")
+                extract_result = []
+                if result_data.get("code", 0) != 0 or not isinstance(data, dict):
+                    # 业务错误（如 data 为 null）按无进展处理，退避后重试
+                    print(
+                        f"  - 查询批处理 {batch_id} 返回错误: "
+                        f"code={result_data.get('code')}, msg={result_data.get('msg')}。稍后重试。"
+                    )
+                else:
+                    extract_result = data.get("extract_result") or []
+
+                for item in extract_result:
+                    data_id = item.get("data_id")
+                    if data_id not in remaining:
+                        continue
+                    state = item.get("state")
+                    if state == "done":
+                        print(
+                            f"  - '{remaining[data_id]['file_name']}' 处理完成，准备下载。"
+                        )
+                        on_done(remaining.pop(data_id), item)
+                        progressed = True
+                    elif state in ["failed", "error"]:
+                        print(
+                            f"  - '{remaining[data_id]['file_name']}' 处理失败，已从任务队列中移除。"
+                        )
+                        on_failed(remaining.pop(data_id), item)
+                        progressed = True
+        except requests.exceptions.RequestException as e:
+            print(f"  - 查询批处理 {batch_id} 时网络请求错误: {e}。稍后重试。")
+        except json.JSONDecodeError:
+            print(f"  - 解析批处理 {batch_id} 的响应失败 (非JSON格式)。稍后重试。")
+
+        if not remaining:
+            break
+        interval = initial_interval if progressed else min(interval * 1.5, max_interval)
+        await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+
+
+async def poll_and_download(
+    catalog,
+    file_infos,
+    poll_url_base,
+    api_token,
+    raw_files_base_dir,
+    processed_files_dir,
+    initial_interval=5,
+    max_interval=60,
+    download_workers=4,
+    chunk_size=DOWNLOAD_CHUNK_SIZE,
+):
+    """
+    按 batch_id 分组并发轮询所有批处理任务，完成的文件立即交给下载线程池，轮询与下载并行进行。
+
+    参数含义见 wait_and_download_files。
+    """
+    header = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_token}",
+    }
+
+    # --- 1. 按 batch_id 分组 ---
+    batches = defaultdict(dict)
+    for info in file_infos:
+        batches[info["batch_id"]][info["data_id"]] = info
+    print(f"共 {len(file_infos)} 个文件，分属 {len(batches)} 个批处理任务。")
+
+    loop = asyncio.get_running_loop()
+    download_futures = []
+
+    def download(file_info, task_result):
+        final_path = download_and_move_file(
+            task_result["full_zip_url"],
+            file_info,
+            raw_files_base_dir,
+            processed_files_dir,
+            session=download_session,
+            chunk_size=chunk_size,
+        )
+        if final_path:
+            catalog.record_progress(
+                file_info["relative_path"],
+                STAGE_DOWNLOAD,
+                fingerprint=file_info["content_hash"],
+                detail=catalog.to_relative(final_path),
+            )
+
+    def on_failed(file_info, task_result):
+        catalog.record_progress(
+            file_info["relative_path"],
+            STAGE_DOWNLOAD,
+            state="failed",
+            detail=task_result.get("err_msg"),
         )
 
-        # 3. 构建在 '02_raw_md_files' 中的最终完整路径
-        final_dir = os.path.join(
-            processed_files_dir, os.path.dirname(relative_path_from_raw)
+    # --- 2. 每个批处理一个轮询协程，下载交给线程池 ---
+    download_session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=download_workers, pool_maxsize=download_workers
+    )
+    download_session.mount("https://", adapter)
+    download_session.mount("http://", adapter)
+
+    with requests.Session() as session, download_session, ThreadPoolExecutor(
+        max_workers=download_workers
+    ) as executor:
+
+        def on_done(file_info, task_result):
+            download_futures.append(
+                loop.run_in_executor(executor, download, file_info, task_result)
+            )
+
+        await asyncio.gather(
+            *(
+                poll_batch(
+                    session,
+                    poll_url_base,
+                    header,
+                    batch_id,
+                    tasks,
+                    on_done,
+                    on_failed,
+                    initial_interval,
+                    max_interval,
+                )
+                for batch_id, tasks in batches.items()
+            )
         )
-        final_path = os.path.join(final_dir, new_filename)
+        await asyncio.gather(*download_futures)
 
-        # 4. 确保目标目录存在，然后移动并重命名文件
-        os.makedirs(final_dir, exist_ok=True)
-        shutil.move(temp_download_path, final_path)
-        print(f"文件已重命名并移动到: {final_path}")
 
-    except requests.exceptions.RequestException as e:
-        print(f"下载失败: {e}")
+def wait_and_download_files(
+    catalog,
+    file_infos,
+    poll_url_base,
+    api_token,
+    raw_files_base_dir,
+    processed_files_dir,
+    initial_interval=5,
+    max_interval=60,
+    download_workers=4,
+    chunk_size=DOWNLOAD_CHUNK_SIZE,
+):
+    """
+    轮询 MinerU 批处理任务，任务完成后下载结果并在清单中记录进度，直到所有任务结束。
+
+    :param catalog: FileCatalog 清单数据库实例。
+    :param file_infos: 已提交到 MinerU（带有 batch_id）的清单文件信息字典列表。
+    :param poll_url_base: 轮询结果的URL前缀。
+    :param api_token: 用于API认证的token。
+    :param raw_files_base_dir: 原始文件根目录。
+    :param processed_files_dir: 处理后文件存放的根目录。
+    :param initial_interval: 每个批处理的初始轮询间隔（秒）。
+    :param max_interval: 退避后的最大轮询间隔（秒）。
+    :param download_workers: 并发下载的线程数。
+    :param chunk_size: 下载时每次读写的字节数。
+    """
+    asyncio.run(
+        poll_and_download(
+            catalog,
+            file_infos,
+            poll_url_base,
+            api_token,
+            raw_files_base_dir,
+            processed_files_dir,
+            initial_interval,
+            max_interval,
+            download_workers,
+            chunk_size,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -72,7 +397,6 @@ if __name__ == "__main__":
 
     # --- 配置 ---
     PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-    METADATA_PATH = os.path.join(PROJECT_ROOT, "knowledge_base", "metadata.json")
     RAW_FILES_DIR = os.path.join(PROJECT_ROOT, "knowledge_base", "01_raw_files")
     PROCESSED_FILES_DIR = os.path.join(
         PROJECT_ROOT, "knowledge_base", "02_raw_md_files"
@@ -84,105 +408,60 @@ if __name__ == "__main__":
     MINERU_POLL_URL_BASE = os.getenv(
         "MINERU_POLL_URL", "https://mineru.net/api/v4/extract-results/batch"
     )
+    # 并发下载的线程数
+    MINERU_DOWNLOAD_WORKERS = int(os.getenv("MINERU_DOWNLOAD_WORKERS", "4"))
+    # 下载时每次读写的字节数
+    MINERU_DOWNLOAD_CHUNK_SIZE = int(
+        os.getenv("MINERU_DOWNLOAD_CHUNK_SIZE", str(DOWNLOAD_CHUNK_SIZE))
+    )
 
     if not MINERU_API_TOKEN:
         print("错误：请在 .env 文件中设置 MINERU_API_TOKEN。")
-        exit()
-
-    # --- 1. 从元数据中收集所有需要处理的批处理任务 ---
-    pending_tasks = {}
-    with open(METADATA_PATH, "r", encoding="utf-8") as f:
-        metadata = json.load(f)
-        for file_uuid, info in metadata.items():
-            if "batch_id" in info:
-                # 检查文件是否已经被处理过
-                expected_zip_filename = info["file_name"] + ".zip"
-                relative_path_from_raw = os.path.relpath(
-                    info["absolute_path"], RAW_FILES_DIR
-                )
-                final_zip_path = os.path.join(
-                    PROCESSED_FILES_DIR,
-                    os.path.dirname(relative_path_from_raw),
-                    expected_zip_filename,
-                )
-
-                if not os.path.exists(final_zip_path):
-                    pending_tasks[file_uuid] = info["batch_id"]
-                else:
-                    print(f"文件 '{info['file_name']}' 已处理，跳过。")
+        sys.exit(1)
 
-    if not pending_tasks:
-        print("\n所有文件均已处理完毕，无需下载。")
-        exit()
-
-    header = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {MINERU_API_TOKEN}",
-    }
+    # --- 1. 从清单中收集所有需要处理的批处理任务 ---
+    catalog = FileCatalog.open_default(PROJECT_ROOT)
+    try:
+        file_infos = []
+        for info in catalog.iter_files():
+            if not info["batch_id"]:
+                continue
+            progress = catalog.get_progress(info["relative_path"], STAGE_DOWNLOAD)
+            if progress and progress["state"] == "failed":
+                print(f"文件 '{info['file_name']}' 在 MinerU 端处理失败，跳过。")
+                continue
 
-    # --- 2. 轮询处理每一个批处理任务 ---
-    while pending_tasks:
-        print(f"\n--- 开始新一轮查询，剩余 {len(pending_tasks)} 个任务 ---")
-        # 使用 list(pending_tasks.items()) 来创建一个副本，以便在循环中安全地修改字典
-        for file_uuid, batch_id in list(pending_tasks.items()):
-            url = f"{MINERU_POLL_URL_BASE}/{batch_id}"
-            original_file_info = metadata.get(file_uuid)
-            print(
-                f"  - 正在查询 '{original_file_info['file_name']}' (Batch ID: {batch_id})..."
+            # 只有清单记录了当前内容的下载结果、且 zip 仍在时才跳过
+            # （与 download_and_move_file 使用同一套命名规则）；
+            # 源文件变化后留下的旧 zip 没有对应的记录，重新下载，下载成功后原子地替换旧文件
+            final_zip_path = get_zip_path(info, RAW_FILES_DIR, PROCESSED_FILES_DIR)
+            downloaded = (
+                progress
+                and progress["state"] == "done"
+                and progress["fingerprint"] == info["content_hash"]
             )
+            if downloaded and os.path.exists(final_zip_path):
+                print(f"文件 '{info['file_name']}' 已下载，跳过。")
+                continue
+            if os.path.exists(final_zip_path):
+                print(
+                    f"文件 '{info['file_name']}' 的 zip 不是当前内容的结果，重新下载。"
+                )
+            file_infos.append(info)
 
-            try:
-                res = requests.get(url, headers=header)
-                if not res.ok:
-                    print(f"    查询失败，状态码: {res.status_code}。将在下一轮重试。")
-                    continue
-
-                result_data = res.json()
-
-                # 提取与当前文件UUID匹配的结果
-                task_result = None
-                if (
-                    result_data.get("msg") == "ok"
-                    and "data" in result_data
-                    and "extract_result" in result_data["data"]
-                ):
-                    for item in result_data["data"]["extract_result"]:
-                        if item.get("data_id") == file_uuid:
-                            task_result = item
-                            break
-
-                if not task_result:
-                    print(
-                        f"    在批处理 {batch_id} 的返回结果中未找到文件 {file_uuid} 的信息。"
-                    )
-                    continue
-
-                state = task_result.get("state")
-                if state == "done":
-                    print(f"    状态: {state}。处理完成，准备下载。")
-                    download_url = task_result["full_zip_url"]
-                    download_and_move_file(
-                        download_url,
-                        original_file_info,
-                        RAW_FILES_DIR,
-                        PROCESSED_FILES_DIR,
-                    )
-                    del pending_tasks[file_uuid]  # 从待办事项中移除
-                elif state in ["failed", "error"]:
-                    print(f"    状态: {state}。处理失败，已从任务队列中移除。")
-                    del pending_tasks[file_uuid]
-                else:
-                    print(f"    状态: {state}。仍在处理中...")
-
-            except requests.exceptions.RequestException as e:
-                print(f"    网络请求错误: {e}。将在下一轮重试。")
-            except json.JSONDecodeError:
-                print(f"    解析服务器响应失败 (非JSON格式)。将在下一轮重试。")
-
-        # 一轮查询结束后，如果仍有待办任务，则等待
-        if pending_tasks:
-            print(f"\n本轮查询结束。仍有 {len(pending_tasks)} 个任务在处理中。")
-            print("将在10秒后开始下一轮查询...")
-            time.sleep(10)
-
-    print("\n所有任务均已处理完毕。")
+        if not file_infos:
+            print("\n所有文件均已处理完毕，无需下载。")
+        else:
+            wait_and_download_files(
+                catalog,
+                file_infos,
+                MINERU_POLL_URL_BASE,
+                MINERU_API_TOKEN,
+                RAW_FILES_DIR,
+                PROCESSED_FILES_DIR,
+                download_workers=MINERU_DOWNLOAD_WORKERS,
+                chunk_size=MINERU_DOWNLOAD_CHUNK_SIZE,
+            )
+            print("\n所有任务均已处理完毕。")
+    finally:
+        catalog.close()
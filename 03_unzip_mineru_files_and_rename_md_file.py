@@ -1,12 +1,125 @@
 import os
-import zipfile
+import re
 import shutil
+import zipfile
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+
+from kb_catalog import FileCatalog, STAGE_UNZIP, stat_fingerprint
+
+# full.md 中图片引用的两种写法：Markdown 图片语法和 HTML <img> 标签
+IMAGE_REF_PATTERN = re.compile(
+    r"!\[[^\]]*\]\(\s*<?([^)\s>]+)>?[^)]*\)|<img[^>]+src=[\"']([^\"']+)[\"']"
+)
+
+
+def _select_members(zip_ref, full_md_name):
+    """
+    根据 zip 的中央目录挑选流水线需要的成员：*_content_list.json 和 full.md 中引用的图片。
+    """
+    names = set(zip_ref.namelist())
+    md_dir = posixpath.dirname(full_md_name)
+
+    selected = [name for name in names if name.endswith("_content_list.json")]
+
+    md_text = zip_ref.read(full_md_name).decode("utf-8", errors="ignore")
+    for match in IMAGE_REF_PATTERN.finditer(md_text):
+        ref = match.group(1) or match.group(2)
+        member = posixpath.normpath(posixpath.join(md_dir, ref))
+        if member in names:
+            selected.append(member)
+    return sorted(set(selected))
+
+
+def _extract_member(zip_ref, member, target_dir):
+    """
+    将单个 zip 成员流式写入 target_dir，拒绝指向目录外部的路径。
+    """
+    destination = os.path.normpath(os.path.join(target_dir, *member.split("/")))
+    if not destination.startswith(os.path.normpath(target_dir) + os.sep):
+        raise ValueError(f"zip 成员路径非法: {member}")
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    with zip_ref.open(member) as src, open(destination, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
 
 
-def unzip_and_process_files():
+def extract_zip_file(zip_path, selective=True):
+    """
+    解压单个 MinerU 结果 zip，把其中的 full.md 写为 zip 同级的“同名.md”。
+
+    选择性模式下只读取 zip 的中央目录，并流式写出流水线需要的成员
+    （full.md、*_content_list.json 以及 full.md 引用的图片）到 zip 同名文件夹中；
+    非选择性模式下与旧版一致，解压全部内容。
+
+    :param zip_path: zip 文件路径。
+    :param selective: 是否只解压需要的成员。
+    :return: 生成的 .md 文件路径；未找到 full.md 时返回 None。
+    :raises zipfile.BadZipFile: zip 文件无效时抛出。
+    """
+    root = os.path.dirname(zip_path)
+    dir_name = os.path.splitext(os.path.basename(zip_path))[0]
+    # 在 zip 文件所在的目录创建同名文件夹
+    target_dir = os.path.join(root, dir_name)
+    destination_md_path = os.path.join(root, dir_name + ".md")
+
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        # 查找 full.md（可能位于 zip 的子目录中）
+        full_md_name = next(
+            (
+                name
+                for name in zip_ref.namelist()
+                if posixpath.basename(name) == "full.md"
+            ),
+            None,
+        )
+        if not full_md_name:
+            print(f"在 {zip_path} 中未找到 'full.md'")
+            return None
+
+        if selective:
+            members = _select_members(zip_ref, full_md_name)
+        else:
+            members = [
+                name
+                for name in zip_ref.namelist()
+                if name != full_md_name and not name.endswith("/")
+            ]
+        for member in members:
+            _extract_member(zip_ref, member, target_dir)
+
+        # full.md 先写临时文件再原子重命名，避免中断后留下不完整的 .md
+        temp_md_path = destination_md_path + ".part"
+        with zip_ref.open(full_md_name) as src, open(temp_md_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(temp_md_path, destination_md_path)
+
+    print(f"已解压 {zip_path}（{len(members)} 个附属文件）并生成 {destination_md_path}")
+    return destination_md_path
+
+
+def _extract_safely(zip_path, selective):
+    """
+    进程池中执行的包装函数：把异常转换为错误信息返回，避免单个坏文件中断整个进程池。
+    """
+    try:
+        return zip_path, extract_zip_file(zip_path, selective), None
+    except zipfile.BadZipFile:
+        return zip_path, None, f"{os.path.basename(zip_path)} 不是一个有效的 zip 文件。"
+    except Exception as e:
+        return zip_path, None, f"处理 {os.path.basename(zip_path)} 时发生错误：{e}"
+
+
+def unzip_and_process_files(workers=None, selective=True, force=False):
     """
     遍历 knowledge_base/02_raw_md_files 目录及其所有子目录中的zip文件，
     就地解压，处理 full.md 但不清理文件夹。
+
+    清单中已记录解压完成、且 zip 大小和修改时间都没有变化的文件会被跳过；
+    其余 zip 分发到进程池中并行解压。
+
+    :param workers: 进程池大小，默认为 CPU 核数。
+    :param selective: 是否只解压流水线需要的成员。
+    :param force: 忽略已有记录，重新解压所有 zip。
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -34,48 +147,70 @@ def unzip_and_process_files():
         return
 
     print(f"开始递归处理目录：{processed_files_path}")
+    catalog = FileCatalog.open_default(os.path.dirname(knowledge_base_dir))
+    # 一次性读取所有解压记录，避免逐个查询
+    unzip_progress = {} if force else catalog.get_stage_progress(STAGE_UNZIP)
 
-    zip_files_found = False
+    # --- 1. 收集需要解压的 zip ---
+    zip_files_found = 0
+    pending = {}
     # 使用 os.walk 遍历所有子目录
-    for root, _, files in os.walk(processed_files_path):
+    for root, dirs, files in os.walk(processed_files_path):
+        zip_stems = {
+            os.path.splitext(item)[0] for item in files if item.endswith(".zip")
+        }
+        # 与 zip 同名的文件夹是解压产物，不必再深入遍历
+        dirs[:] = [d for d in dirs if d not in zip_stems]
+
         for item in files:
-            if item.endswith(".zip"):
-                zip_files_found = True
-                item_path = os.path.join(root, item)
-                dir_name = os.path.splitext(item)[0]
-                # 在 zip 文件所在的目录创建同名文件夹
-                target_dir = os.path.join(root, dir_name)
-
-                os.makedirs(target_dir, exist_ok=True)
-
-                try:
-                    with zipfile.ZipFile(item_path, "r") as zip_ref:
-                        zip_ref.extractall(target_dir)
-                    print(f"已解压 {item_path} 到 {target_dir}")
-
-                    # 查找 full.md
-                    full_md_path_in_subdir = None
-                    for sub_root, _, sub_files in os.walk(target_dir):
-                        if "full.md" in sub_files:
-                            full_md_path_in_subdir = os.path.join(sub_root, "full.md")
-                            break
-
-                    if full_md_path_in_subdir:
-                        # 移动并重命名 full.md 到 zip 文件所在的目录
-                        new_md_name = dir_name + ".md"
-                        destination_md_path = os.path.join(root, new_md_name)
-                        shutil.move(full_md_path_in_subdir, destination_md_path)
-                        print(f"已移动并重命名 'full.md' 到 {destination_md_path}")
-                    else:
-                        print(f"在 {target_dir} 的子目录中未找到 'full.md'")
-
-                except zipfile.BadZipFile:
-                    print(f"错误：{item} 不是一个有效的 zip 文件。")
-                except Exception as e:
-                    print(f"处理 {item} 时发生错误：{e}")
+            if not item.endswith(".zip"):
+                continue
+            zip_files_found += 1
+            item_path = os.path.join(root, item)
+            raw_stem = os.path.relpath(
+                os.path.splitext(item_path)[0], processed_files_path
+            ).replace("\\", "/")
+            fingerprint = stat_fingerprint(item_path)
+
+            progress = unzip_progress.get(raw_stem)
+            if (
+                progress
+                and progress["state"] == "done"
+                and progress["fingerprint"] == fingerprint
+                and os.path.exists(os.path.splitext(item_path)[0] + ".md")
+            ):
+                continue
+            pending[item_path] = (raw_stem, fingerprint)
 
     if not zip_files_found:
+        catalog.close()
         print("在目录及其子目录中未找到任何 zip 文件。")
+        return
+
+    print(f"共找到 {zip_files_found} 个 zip 文件，其中 {len(pending)} 个需要解压。")
+
+    # --- 2. 用进程池并行解压 ---
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                _extract_safely, list(pending), [selective] * len(pending)
+            )
+            for zip_path, destination_md_path, error in results:
+                raw_stem, fingerprint = pending[zip_path]
+                if error:
+                    print(f"错误：{error}")
+                    catalog.record_progress_by_stem(
+                        raw_stem, STAGE_UNZIP, state="failed", detail=error
+                    )
+                elif destination_md_path:
+                    catalog.record_progress_by_stem(
+                        raw_stem,
+                        STAGE_UNZIP,
+                        fingerprint=fingerprint,
+                        detail=os.path.basename(destination_md_path),
+                    )
+
+    catalog.close()
 
 
 if __name__ == "__main__":
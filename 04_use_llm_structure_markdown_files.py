@@ -1,25 +1,35 @@
 import os
+import re
 import shutil
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 # 确保已安装所需库: pip install langchain-community python-dotenv langchain-core
 from langchain_community.chat_models import ChatZhipuAI
 from langchain_core.messages import HumanMessage, SystemMessage
 
+from kb_catalog import FileCatalog, STAGE_STRUCTURE, hash_file
+from llm_utils import RateLimiter, call_with_retry, estimate_tokens
+from llm_cache import LLMCache, make_cache_key, format_stats, DEFAULT_MAX_BYTES
+from md_rule_structurer import (
+    DEFAULT_CONFIDENCE_THRESHOLD,
+    detect_heading_level,
+    rule_structure,
+    strip_heading_marks,
+)
+
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
+LLM_MODEL = "glm-4.5-air"
+LLM_TEMPERATURE = 0.0
 
-def process_md_with_langchain(content: str) -> str:
-    """
-    使用智谱AI大模型处理单个Markdown文件的内容。
-    """
-    if not os.getenv("ZHIPUAI_API_KEY"):
-        return "[AI处理失败：环境变量 ZHIPUAI_API_KEY 未设置]"
+# 估算 token 数超过该值的文档按章节切分为多个窗口并行整理
+WINDOW_MAX_TOKENS = 6000
 
-    # 定义一个系统提示，用于指导AI模型如何执行任务
-    system_prompt = """
+# 定义一个系统提示，用于指导AI模型如何执行任务
+SYSTEM_PROMPT = """
     # Markdown文件清理与标题层级修复
 
     ## 任务描述
@@ -60,31 +70,302 @@ def process_md_with_langchain(content: str) -> str:
     请按照以上要求处理提供的Markdown文档，确保输出是纯粹的、不被代码块包裹的Markdown文本。
     """
 
-    messages = [SystemMessage(content=system_prompt), HumanMessage(content=content)]
+_llm = None
+_cache = None
+_llm_lock = threading.Lock()
 
-    try:
-        # 初始化AI模型
-        llm = ChatZhipuAI(
-            model="glm-4.5-air",
-            temperature=0.0,
+
+def get_llm():
+    """
+    返回进程内共享的 ChatZhipuAI 客户端，首次调用时创建，之后所有线程复用同一个实例。
+    """
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            _llm = ChatZhipuAI(model=LLM_MODEL, temperature=LLM_TEMPERATURE)
+        return _llm
+
+
+def get_cache():
+    """
+    返回进程内共享的响应缓存 (knowledge_base/llm_cache.sqlite3)，
+    容量上限可通过 LLM_CACHE_MAX_MB 环境变量设置。
+    """
+    global _cache
+    with _llm_lock:
+        if _cache is None:
+            max_mb = os.getenv("LLM_CACHE_MAX_MB")
+            _cache = LLMCache.open_default(
+                os.path.dirname(os.path.abspath(__file__)),
+                max_bytes=(
+                    int(float(max_mb) * 1024 * 1024) if max_mb else DEFAULT_MAX_BYTES
+                ),
+            )
+        return _cache
+
+
+def _invoke_llm(content: str) -> str:
+    """
+    调用大模型整理一段 Markdown 内容，出错时直接抛出异常（供重试逻辑使用）。
+    """
+    if not os.getenv("ZHIPUAI_API_KEY"):
+        raise RuntimeError("环境变量 ZHIPUAI_API_KEY 未设置")
+
+    messages = [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=content)]
+    response = get_llm().invoke(messages)
+
+    # 双重保险：以防万一模型还是添加了代码块，我们手动移除它
+    processed_content = response.content.strip()
+    if processed_content.startswith("```markdown"):
+        processed_content = processed_content[len("```markdown") :].strip()
+    if processed_content.endswith("```"):
+        processed_content = processed_content[: -len("```")].strip()
+
+    return processed_content
+
+
+def structure_content(content: str, max_attempts=1, limiter=None, use_cache=True):
+    """
+    整理一段 Markdown 内容：先按 (模型, 温度, 系统提示, 内容) 查询响应缓存，
+    未命中时才调用大模型（按 max_attempts 重试），成功的结果写回缓存。
+
+    :param content: 待整理的 Markdown 文本。
+    :param max_attempts: 调用大模型的最大尝试次数。
+    :param limiter: 可选的 RateLimiter。
+    :param use_cache: 是否读写响应缓存。
+    :return: 整理后的 Markdown 文本。
+    :raises Exception: 所有尝试都失败时抛出最后一次的异常。
+    """
+    key = make_cache_key(LLM_MODEL, LLM_TEMPERATURE, SYSTEM_PROMPT, content)
+    if use_cache:
+        cached = get_cache().get(key)
+        if cached is not None:
+            return cached
+
+    # 输出与输入长度相近，按输入的两倍估算本次请求消耗的 token
+    processed_content = call_with_retry(
+        lambda: _invoke_llm(content),
+        max_attempts=max_attempts,
+        limiter=limiter,
+        tokens=2 * estimate_tokens(content),
+    )
+    if use_cache:
+        get_cache().put(key, LLM_MODEL, processed_content)
+    return processed_content
+
+
+def _is_section_boundary(line):
+    """
+    章节切分点：Markdown 标题行，或一、二级序号标题行。
+    """
+    if line.lstrip().startswith("#"):
+        return True
+    level = detect_heading_level(line)
+    return level is not None and level <= 2
+
+
+def _split_paragraphs(section):
+    """
+    将过长的章节按空行拆分为段落，段落之间的空行保留在前一段末尾。
+    """
+    return [part for part in re.split(r"(?<=\n\n)", section) if part]
+
+
+def split_into_windows(content, max_tokens=WINDOW_MAX_TOKENS):
+    """
+    按章节边界把长文档切分为若干窗口，每个窗口的估算 token 数尽量不超过 max_tokens。
+
+    相邻的小章节合并到同一窗口；单个章节超长时再按段落拆分，单个段落超长时原样保留。
+
+    :param content: 原始 Markdown 文本。
+    :param max_tokens: 每个窗口的 token 预算。
+    :return: [(窗口文本, 窗口开始前各级标题的列表)]，拼接所有窗口文本即为原文。
+    """
+    sections, current = [], []
+    for line in content.splitlines(keepends=True):
+        if current and _is_section_boundary(line):
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+
+    pieces = []
+    for section in sections:
+        if estimate_tokens(section) > max_tokens:
+            pieces.extend(_split_paragraphs(section))
+        else:
+            pieces.append(section)
+
+    windows, current, current_tokens = [], [], 0
+    for piece in pieces:
+        piece_tokens = estimate_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            windows.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        windows.append("".join(current))
+
+    # 记录每个窗口开始前最近的各级标题，作为该窗口的层级上下文
+    result, trail = [], {}
+    for window in windows:
+        result.append((window, [trail[level] for level in sorted(trail)]))
+        for line in window.splitlines():
+            level = detect_heading_level(line)
+            if level is None and line.lstrip().startswith("#"):
+                # 没有序号的 Markdown 标题视为最高一级的章节标题
+                level = 0
+            if level is not None:
+                trail = {k: v for k, v in trail.items() if k < level}
+                trail[level] = strip_heading_marks(line)
+    return result
+
+
+def _build_window_message(window, heading_trail, index, total):
+    """
+    为单个窗口构造输入：说明它在全文中的位置和此前的标题层级，再附上窗口正文。
+    """
+    lines = [
+        f"【说明】以下是一篇长文档的第 {index}/{total} 部分，请只输出本部分整理后的内容，"
+        "不要补充其他部分，也不要添加任何说明。"
+    ]
+    if heading_trail:
+        lines.append("本部分之前最近的各级标题依次为（请据此确定本部分标题的层级）：")
+        lines.extend(f"- {heading}" for heading in heading_trail)
+    lines.append("【正文】")
+    lines.append(window)
+    return "\n".join(lines)
+
+
+def structure_document(
+    content: str,
+    max_attempts=1,
+    limiter=None,
+    use_cache=True,
+    window_tokens=WINDOW_MAX_TOKENS,
+    window_workers=4,
+):
+    """
+    整理一篇 Markdown 文档。短文档一次请求完成；长文档按章节切分为窗口，
+    并行整理后按原顺序拼接，耗时接近最长的单个窗口，而不是整篇文档。
+
+    :param content: 待整理的 Markdown 文本。
+    :param max_attempts: 每个请求的最大尝试次数。
+    :param limiter: 可选的 RateLimiter。
+    :param use_cache: 是否读写响应缓存（按窗口缓存）。
+    :param window_tokens: 单个窗口的 token 预算，文档不超过该值时不切分。
+    :param window_workers: 同一文档内并行处理的窗口数。
+    :return: 整理后的 Markdown 文本。
+    :raises Exception: 任一窗口在所有尝试后仍失败时抛出。
+    """
+    if estimate_tokens(content) <= window_tokens:
+        return structure_content(
+            content, max_attempts=max_attempts, limiter=limiter, use_cache=use_cache
         )
-        response = llm.invoke(messages)
 
-        # 双重保险：以防万一模型还是添加了代码块，我们手动移除它
-        processed_content = response.content.strip()
-        if processed_content.startswith("```markdown"):
-            processed_content = processed_content[len("```markdown") :].strip()
-        if processed_content.endswith("```"):
-            processed_content = processed_content[: -len("```")].strip()
+    windows = split_into_windows(content, window_tokens)
+    print(f"  -> 长文档，按章节切分为 {len(windows)} 个窗口并行处理。")
+    messages = [
+        _build_window_message(window, trail, index, len(windows))
+        for index, (window, trail) in enumerate(windows, start=1)
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, window_workers)) as executor:
+        results = executor.map(
+            lambda message: structure_content(
+                message, max_attempts=max_attempts, limiter=limiter, use_cache=use_cache
+            ),
+            messages,
+        )
+        return "\n\n".join(result.strip() for result in results)
 
-        return processed_content
+
+def process_md_with_langchain(content: str) -> str:
+    """
+    使用智谱AI大模型处理单个Markdown文件的内容，相同输入直接返回缓存的结果。
+    """
+    try:
+        return structure_document(content)
     except Exception as e:
         return f"[AI处理时发生错误：{e}]"
 
 
-def setup_and_process_files():
+def structure_md_file(
+    source_file_path,
+    destination_file_path,
+    max_attempts=5,
+    limiter=None,
+    window_tokens=WINDOW_MAX_TOKENS,
+    rule_threshold=DEFAULT_CONFIDENCE_THRESHOLD,
+):
+    """
+    整理单个 Markdown 文件并写入目标路径。
+
+    先用本地规则整理，置信度达到 rule_threshold 时直接采用，不调用大模型；
+    否则调用大模型，失败时按指数退避重试，重试耗尽后直接复制源文件。
+    内容和提示词都未变化的文件直接使用缓存的结果，长文档按章节窗口并行处理。
+
+    :param source_file_path: 源 Markdown 文件路径。
+    :param destination_file_path: 整理后文件的保存路径。
+    :param max_attempts: 最大尝试次数。
+    :param limiter: 可选的 RateLimiter，多个线程共享时可将请求速率控制在配额以内。
+    :param window_tokens: 超过该 token 数的文档按章节切分为窗口并行处理。
+    :param rule_threshold: 直接采用规则整理结果的置信度阈值，大于 1 时总是调用大模型。
+    :return: (是否成功, 最后一次错误信息)
+    :raises OSError: 读取源文件失败时抛出。
+    """
+    with open(source_file_path, "r", encoding="utf-8") as f:
+        original_content = f.read()
+
+    os.makedirs(os.path.dirname(destination_file_path), exist_ok=True)
+    rule_content, confidence, _ = rule_structure(original_content)
+    if confidence >= rule_threshold:
+        with open(destination_file_path, "w", encoding="utf-8") as f:
+            f.write(rule_content)
+        print(
+            f"  -> 规则整理置信度 {confidence:.2f}，已保存到: {destination_file_path}"
+        )
+        return True, ""
+    print(f"  -> 规则整理置信度 {confidence:.2f}，交给大模型处理。")
+
+    try:
+        processed_content = structure_document(
+            original_content,
+            max_attempts=max_attempts,
+            limiter=limiter,
+            window_tokens=window_tokens,
+        )
+    except Exception as e:
+        last_error = f"[AI处理时发生错误：{e}]"
+        print(f"  -> {max_attempts}次尝试后处理失败，将直接复制源文件: {e}")
+        shutil.copy2(source_file_path, destination_file_path)
+        return False, last_error
+
+    with open(destination_file_path, "w", encoding="utf-8") as f:
+        f.write(processed_content)
+    print(f"  -> 已保存到: {destination_file_path}")
+    return True, ""
+
+
+def setup_and_process_files(
+    workers=4,
+    requests_per_minute=None,
+    tokens_per_minute=None,
+    window_tokens=WINDOW_MAX_TOKENS,
+    rule_threshold=DEFAULT_CONFIDENCE_THRESHOLD,
+):
     """
     主函数，负责整个流程，包含重试和失败回退逻辑。
+
+    多个文件在线程池中并发处理，共享同一个大模型客户端和限流器，
+    使吞吐量受限于服务商的配额而不是单个请求的延迟。
+
+    :param workers: 同时在途的请求数，为 1 时按顺序逐个处理。
+    :param requests_per_minute: 每分钟请求数上限，None 表示不限制。
+    :param tokens_per_minute: 每分钟 token 数上限，None 表示不限制。
+    :param window_tokens: 长文档切分窗口的 token 预算。
+    :param rule_threshold: 直接采用规则整理结果的置信度阈值。
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
     knowledge_base_dir = os.path.join(script_dir, "knowledge_base")
@@ -101,25 +382,37 @@ def setup_and_process_files():
     )
     print("目录结构复制完成。")
 
+    catalog = FileCatalog.open_default(script_dir)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
     print("开始遍历和处理 Markdown 文件...")
     permanently_failed_files = []
-    file_count = 0
-
+    source_files = []
     for root, _, files in os.walk(source_dir):
         for file in files:
-            if not file.endswith(".md"):
-                continue
+            if file.endswith(".md"):
+                source_files.append(os.path.join(root, file))
+    file_count = len(source_files)
+
+    def process_one(source_file_path):
+        relative_path = os.path.relpath(source_file_path, source_dir)
+        destination_file_path = os.path.join(target_dir, relative_path)
+        print(f"\n正在处理文件: {source_file_path}")
+        return structure_md_file(
+            source_file_path,
+            destination_file_path,
+            limiter=limiter,
+            window_tokens=window_tokens,
+            rule_threshold=rule_threshold,
+        )
 
-            file_count += 1
-            source_file_path = os.path.join(root, file)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(process_one, path): path for path in source_files}
+        for future in as_completed(futures):
+            source_file_path = futures[future]
             relative_path = os.path.relpath(source_file_path, source_dir)
-            destination_file_path = os.path.join(target_dir, relative_path)
-
-            print(f"\n正在处理文件 ({file_count}): {source_file_path}")
-
             try:
-                with open(source_file_path, "r", encoding="utf-8") as f:
-                    original_content = f.read()
+                ok, last_error = future.result()
             except Exception as e:
                 print(f"  -> 读取文件时出错: {e}")
                 permanently_failed_files.append(
@@ -131,31 +424,14 @@ def setup_and_process_files():
                 )
                 continue
 
-            processed_content = None
-            last_error = ""
-            for attempt in range(5):
-                print(f"  -> 尝试处理 (第 {attempt + 1}/5 次)")
-                result = process_md_with_langchain(original_content)
-
-                if not result.startswith("[AI处理时发生错误"):
-                    processed_content = result
-                    print("  -> AI模型处理成功。")
-                    break
-                else:
-                    last_error = result
-                    print(f"  -> 处理失败: {last_error}")
-                    if attempt < 4:
-                        print("  -> 10秒后重试...")
-                        time.sleep(10)
-
-            os.makedirs(os.path.dirname(destination_file_path), exist_ok=True)
-            if processed_content is not None:
-                with open(destination_file_path, "w", encoding="utf-8") as f:
-                    f.write(processed_content)
-                print(f"  -> 已保存到: {destination_file_path}")
-            else:
-                print(f"  -> 5次尝试后处理失败，将直接复制源文件。")
-                shutil.copy2(source_file_path, destination_file_path)
+            catalog.record_progress_by_stem(
+                os.path.splitext(relative_path)[0],
+                STAGE_STRUCTURE,
+                state="done" if ok else "failed",
+                fingerprint=hash_file(source_file_path),
+                detail=last_error or None,
+            )
+            if not ok:
                 permanently_failed_files.append(
                     {
                         "file_path": source_file_path,
@@ -164,6 +440,8 @@ def setup_and_process_files():
                     }
                 )
 
+    catalog.close()
+    print(f"\n{format_stats(get_cache().stats())}")
     if not permanently_failed_files:
         print(f"\n处理完成！共成功处理了 {file_count} 个 Markdown 文件。")
     else:
@@ -176,4 +454,23 @@ def setup_and_process_files():
 
 
 if __name__ == "__main__":
-    setup_and_process_files()
+    # 并发请求数，以及智谱 API 的每分钟请求数 / token 数配额（未设置则不限制）
+    ZHIPUAI_STRUCTURE_WORKERS = int(os.getenv("ZHIPUAI_STRUCTURE_WORKERS", "4"))
+    ZHIPUAI_RPM = int(os.getenv("ZHIPUAI_RPM", "0")) or None
+    ZHIPUAI_TPM = int(os.getenv("ZHIPUAI_TPM", "0")) or None
+    # 长文档切分窗口的 token 预算
+    ZHIPUAI_WINDOW_TOKENS = int(
+        os.getenv("ZHIPUAI_WINDOW_TOKENS", str(WINDOW_MAX_TOKENS))
+    )
+    # 规则整理置信度达到该值的文档不调用大模型；设为大于 1 的值可强制全部使用大模型
+    STRUCTURE_RULE_THRESHOLD = float(
+        os.getenv("STRUCTURE_RULE_THRESHOLD", str(DEFAULT_CONFIDENCE_THRESHOLD))
+    )
+
+    setup_and_process_files(
+        workers=ZHIPUAI_STRUCTURE_WORKERS,
+        requests_per_minute=ZHIPUAI_RPM,
+        tokens_per_minute=ZHIPUAI_TPM,
+        window_tokens=ZHIPUAI_WINDOW_TOKENS,
+        rule_threshold=STRUCTURE_RULE_THRESHOLD,
+    )
@@ -1,8 +1,46 @@
 import os
-import pickle
+import re
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # 确保已安装所需库: pip install langchain-text-splitters
 from langchain_text_splitters import MarkdownHeaderTextSplitter
+from langchain_core.documents import Document
+
+from kb_catalog import FileCatalog, STAGE_CHUNK, hash_file
+from chunk_store import ChunkStore
+from llm_utils import estimate_tokens
+from lexical_index import default_index_dir, update_lexical_index
+
+# 按 Markdown 标题切分时使用的标题级别
+HEADERS_TO_SPLIT_ON = [
+    ("#", "Header 1"),
+    ("##", "Header 2"),
+    ("###", "Header 3"),
+]
+
+# 二次切分：单个分块的 token 上限，以及相邻分块之间重叠的 token 数
+MAX_CHUNK_TOKENS = 2000
+CHUNK_OVERLAP_TOKENS = 200
+
+# 句子边界：中英文句末标点之后
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[。！？；!?;])")
+
+# 每个进程只创建一次分块器，处理多个文件时复用
+_markdown_splitter = None
+
+
+def get_markdown_splitter():
+    """
+    返回当前进程共享的 MarkdownHeaderTextSplitter，首次调用时创建。
+    """
+    global _markdown_splitter
+    if _markdown_splitter is None:
+        _markdown_splitter = MarkdownHeaderTextSplitter(
+            headers_to_split_on=HEADERS_TO_SPLIT_ON, strip_headers=False
+        )
+    return _markdown_splitter
 
 
 def chunk_markdown_content(content: str, file_path: str) -> list:
@@ -13,18 +51,8 @@ def chunk_markdown_content(content: str, file_path: str) -> list:
         f"  -> 正在使用 MarkdownHeaderTextSplitter 进行分块: {os.path.basename(file_path)}"
     )
 
-    headers_to_split_on = [
-        ("#", "Header 1"),
-        ("##", "Header 2"),
-        ("###", "Header 3"),
-    ]
-
-    markdown_splitter = MarkdownHeaderTextSplitter(
-        headers_to_split_on=headers_to_split_on, strip_headers=False
-    )
-
     try:
-        chunks = markdown_splitter.split_text(content)
+        chunks = get_markdown_splitter().split_text(content)
         print(f"  -> 文件被分成了 {len(chunks)} 块。")
         return chunks
     except Exception as e:
@@ -32,16 +60,169 @@ def chunk_markdown_content(content: str, file_path: str) -> list:
         return []
 
 
-def chunk_and_save_files():
+def _split_units(text, max_tokens):
+    """
+    将文本拆成不超过 max_tokens 的片段：先按段落，过长的段落再按句子，
+    过长的句子最后按字符硬切。拼接所有片段即为原文。
+    """
+    units = []
+    for paragraph in re.split(r"(?<=\n\n)", text):
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_BOUNDARY.split(paragraph):
+            if not sentence:
+                continue
+            while estimate_tokens(sentence) > max_tokens:
+                # 按估算的每字符 token 数折算切分位置
+                cut = max(1, len(sentence) * max_tokens // estimate_tokens(sentence))
+                units.append(sentence[:cut])
+                sentence = sentence[cut:]
+            units.append(sentence)
+    return units
+
+
+def split_oversized_chunks(
+    chunks, max_tokens=MAX_CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS
+):
+    """
+    二次切分：把超过 max_tokens 的分块按段落/句子边界拆成多个分块，
+    相邻分块之间重叠不超过 overlap_tokens 个 token 的完整段落或句子，拆出的分块保留原分块的标题元数据。
+
+    :param chunks: MarkdownHeaderTextSplitter 产生的分块列表。
+    :param max_tokens: 单个分块的 token 上限（按 estimate_tokens 估算）。
+    :param overlap_tokens: 相邻分块的重叠 token 数。
+    :return: 新的分块列表。
+    """
+    result = []
+    for chunk in chunks:
+        if estimate_tokens(chunk.page_content) <= max_tokens:
+            result.append(chunk)
+            continue
+
+        # 重叠部分占用窗口的一部分预算，保证加上重叠后仍不超过上限
+        units = _split_units(chunk.page_content, max(1, max_tokens - overlap_tokens))
+        window, window_tokens = [], 0
+        for unit in units:
+            unit_tokens = estimate_tokens(unit)
+            if window and window_tokens + unit_tokens > max_tokens:
+                result.append(
+                    Document(
+                        page_content="".join(window).strip(),
+                        metadata=dict(chunk.metadata),
+                    )
+                )
+                # 从上一个窗口末尾取不超过 overlap_tokens 的片段作为重叠
+                overlap, overlap_count = [], 0
+                for previous in reversed(window):
+                    previous_tokens = estimate_tokens(previous)
+                    if overlap_count + previous_tokens > overlap_tokens:
+                        break
+                    overlap.insert(0, previous)
+                    overlap_count += previous_tokens
+                window, window_tokens = overlap, overlap_count
+            window.append(unit)
+            window_tokens += unit_tokens
+        if window:
+            result.append(
+                Document(
+                    page_content="".join(window).strip(), metadata=dict(chunk.metadata)
+                )
+            )
+    return result
+
+
+def chunk_settings(max_tokens=MAX_CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    影响分块结果的参数，记录在分块文件头部；参数变化后所有源文件都会重新分块。
+    """
+    return {"max_tokens": max_tokens, "overlap_tokens": overlap_tokens}
+
+
+def chunk_md_file(
+    file_path: str,
+    store: ChunkStore,
+    source_key: str,
+    max_tokens=MAX_CHUNK_TOKENS,
+    overlap_tokens=CHUNK_OVERLAP_TOKENS,
+) -> list:
+    """
+    对单个 Markdown 文件分块，并将分块结果连同源文件哈希一起写入分块存储。
+
+    先按标题切分，再把超过 token 上限的分块按段落/句子二次切分。
+
+    :param file_path: 源 Markdown 文件路径。
+    :param store: ChunkStore 分块存储。
+    :param source_key: 源文件标识（相对路径去掉扩展名，用 / 分隔）。
+    :param max_tokens: 单个分块的 token 上限。
+    :param overlap_tokens: 二次切分时相邻分块的重叠 token 数。
+    :return: 分块列表；未生成任何分块时返回空列表，此时写入只有头部的分块文件。
+    :raises OSError: 读取或写入文件失败时抛出。
+    """
+    with open(file_path, "rb") as f:
+        raw = f.read()
+    content = raw.decode("utf-8")
+
+    chunks = chunk_markdown_content(content, file_path)
+    if chunks:
+        split_chunks = split_oversized_chunks(chunks, max_tokens, overlap_tokens)
+        if len(split_chunks) != len(chunks):
+            print(f"  -> 二次切分后共 {len(split_chunks)} 块。")
+        chunks = split_chunks
+    else:
+        # 空结果同样写入分块文件（只有头部）：既替换掉已过期的旧分块，
+        # 头部记录的哈希和参数也让增量分块在源文件不变时跳过它
+        print("  -> 未生成任何分块，写入空的分块文件。")
+
+    # 分块文件先写临时文件再原子替换，中断时不会留下写了一半的文件
+    destination_path = store.write_source(
+        source_key,
+        chunks,
+        source_hash=hashlib.sha256(raw).hexdigest(),
+        settings=chunk_settings(max_tokens, overlap_tokens),
+    )
+    print(f"  -> 分块已保存到: {destination_path}")
+    return chunks
+
+
+def _chunk_file_safely(file_path, store_root, source_key, max_tokens, overlap_tokens):
+    """
+    进程池中执行的包装函数：只把分块数量和错误信息传回主进程，避免序列化分块内容。
+    """
+    try:
+        chunks = chunk_md_file(
+            file_path, ChunkStore(store_root), source_key, max_tokens, overlap_tokens
+        )
+        return source_key, len(chunks), None
+    except Exception as e:
+        return source_key, 0, str(e)
+
+
+def chunk_and_save_files(
+    workers=None,
+    force=False,
+    max_tokens=MAX_CHUNK_TOKENS,
+    overlap_tokens=CHUNK_OVERLAP_TOKENS,
+):
     """
-    主函数，负责分块并将结果保存为 .pkl 文件。
+    主函数，负责分块并将结果写入分块存储。
+
+    分块文件头部记录了源文件的哈希和分块参数，两者都未变化的源文件直接跳过；
+    其余文件分发到进程池中并行分块。源文件已被删除的分块文件会一并清理。
+    分块有变化时，最后按源文件增量更新供混合检索使用的 BM25 倒排索引。
+
+    :param workers: 进程池大小，默认为 CPU 核数。
+    :param force: 忽略已有分块，重新处理所有文件。
+    :param max_tokens: 单个分块的 token 上限。
+    :param overlap_tokens: 二次切分时相邻分块的重叠 token 数。
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
     knowledge_base_dir = os.path.join(script_dir, "knowledge_base")
     source_dir = os.path.join(knowledge_base_dir, "03_structure_md_files")
-    output_dir = os.path.join(
-        knowledge_base_dir, "04_database", "01_langchain_split_documents_files"
-    )
+    store = ChunkStore.open_default(script_dir)
+    output_dir = store.root_dir
 
     if not os.path.isdir(output_dir):
         print(f"目录不存在，正在创建: {output_dir}")
@@ -53,119 +234,152 @@ def chunk_and_save_files():
         print(f"错误：源目录不存在 -> {source_dir}")
         return
 
+    catalog = FileCatalog.open_default(script_dir)
+
+    # --- 1. 找出内容或分块参数有变化的源文件 ---
+    settings = chunk_settings(max_tokens, overlap_tokens)
     print(f"\n开始遍历和分块目录: {source_dir}")
     file_count = 0
-    total_chunks = 0
-
+    pending = {}
+    source_keys = set()
     for root, _, files in os.walk(source_dir):
         for file in files:
-            if file.endswith(".md"):
-                file_count += 1
-                file_path = os.path.join(root, file)
-                print(f"正在处理文件 ({file_count}): {file_path}")
-
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-                except Exception as e:
-                    print(f"  -> 读取文件时出错: {e}")
-                    continue
-
-                chunks = chunk_markdown_content(content, file_path)
-
-                if not chunks:
-                    print("  -> 未生成任何分块，跳过保存。")
+            if not file.endswith(".md"):
+                continue
+            file_count += 1
+            file_path = os.path.join(root, file)
+            source_key = os.path.splitext(os.path.relpath(file_path, source_dir))[
+                0
+            ].replace("\\", "/")
+            source_keys.add(source_key)
+
+            source_hash = hash_file(file_path)
+            header = None if force else store.read_header(source_key)
+            if (
+                header
+                and header.get("source_hash") == source_hash
+                and header.get("settings") == settings
+            ):
+                continue
+            pending[source_key] = (file_path, source_hash)
+
+    # 源文件已不存在的分块文件属于过期产物
+    for source_key in set(store.iter_sources()) - source_keys:
+        store.delete_source(source_key)
+        print(f"  -> 已删除过期的分块文件: {store.path_for(source_key)}")
+
+    print(f"共找到 {file_count} 个 Markdown 文件，其中 {len(pending)} 个需要重新分块。")
+
+    # --- 2. 用进程池并行分块 ---
+    total_chunks = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _chunk_file_safely,
+                    file_path,
+                    output_dir,
+                    source_key,
+                    max_tokens,
+                    overlap_tokens,
+                )
+                for source_key, (file_path, _) in pending.items()
+            ]
+            for future in as_completed(futures):
+                source_key, count, error = future.result()
+                file_path, source_hash = pending[source_key]
+                if error:
+                    print(f"  -> 读取或保存文件 {file_path} 时出错: {error}")
                     continue
 
-                total_chunks += len(chunks)
-
-                relative_path = os.path.relpath(root, source_dir)
-                pkl_filename = os.path.splitext(file)[0] + ".pkl"
-                destination_path = os.path.join(output_dir, relative_path, pkl_filename)
-
-                os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-
-                try:
-                    with open(destination_path, "wb") as f:
-                        pickle.dump(chunks, f)
-                    print(f"  -> 分块已保存到: {destination_path}")
-                except Exception as e:
-                    print(f"  -> 保存 .pkl 文件时出错: {e}")
+                total_chunks += count
+                catalog.record_progress_by_stem(
+                    source_key,
+                    STAGE_CHUNK,
+                    fingerprint=source_hash,
+                    detail=f"{count} chunks",
+                )
 
+    catalog.close()
     if file_count == 0:
         print("在源目录中没有找到任何 .md 文件。")
     else:
         print(
-            f"\n处理完成！共处理了 {file_count} 个 Markdown 文件，总共生成了 {total_chunks} 个文本块。"
+            f"\n处理完成！共处理了 {len(pending)} 个 Markdown 文件，总共生成了 {total_chunks} 个文本块。"
         )
 
+    # --- 3. 分块有变化时增量更新 BM25 倒排索引 ---
+    index_dir = default_index_dir(script_dir)
+    indexed = update_lexical_index(store, index_dir, force=force)
+    if indexed is None:
+        print("倒排索引已是最新。")
+    else:
+        print(f"倒排索引已更新，重新索引了 {indexed} 个分块: {index_dir}")
+
 
-def view_a_sample_pkl_file():
+def view_a_sample_chunk_file():
     """
-    查找第一个生成的 .pkl 文件，并打印其内容以供检查。
+    读取分块存储中的第一个源文件，并打印其前两个分块以供检查。
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    output_dir = os.path.join(
-        script_dir,
-        "knowledge_base",
-        "04_database",
-        "01_langchain_split_documents_files",
-    )
-
-    sample_file_path = None
-    for root, _, files in os.walk(output_dir):
-        for file in files:
-            if file.endswith(".pkl"):
-                sample_file_path = os.path.join(root, file)
-                break
-        if sample_file_path:
-            break
+    store = ChunkStore.open_default(script_dir)
 
-    if not sample_file_path:
+    sample_source = next(store.iter_sources(), None)
+    if not sample_source:
         print(
-            "未找到任何 .pkl 文件可供查看。请先确保 chunk_and_save_files() 已成功运行。"
+            "未找到任何分块文件可供查看。请先确保 chunk_and_save_files() 已成功运行。"
         )
         return
 
-    print(f"正在查看示例文件: {sample_file_path}")
+    print(f"正在查看示例文件: {store.path_for(sample_source)}")
 
     try:
-        with open(sample_file_path, "rb") as f:
-            # 加载pkl文件，还原为Document对象列表
-            chunks = pickle.load(f)
-
-        if not chunks:
+        total = store.count(sample_source)
+        if not total:
             print("文件为空，不包含任何分块。")
             return
 
-        # 打印前两个块作为示例
-        for i, chunk in enumerate(chunks[:2]):
+        # 只读取前两个块作为示例，其余分块不会被加载
+        for i, chunk in enumerate(
+            itertools.islice(store.iter_chunks(sample_source), 2)
+        ):
             print(f"\n--- 文本块 (Chunk) {i + 1} ---")
-            # LangChain的Document对象包含 page_content 和 metadata 属性
             print("元数据 (Metadata):")
-            print(chunk.metadata)
+            print(chunk["metadata"])
             print("\n内容 (Content):")
             # 为防止内容过长刷屏，只显示前300个字符
-            content_preview = chunk.page_content[:300]
+            content_preview = chunk["page_content"][:300]
             print(
                 content_preview + "..."
-                if len(chunk.page_content) > 300
+                if len(chunk["page_content"]) > 300
                 else content_preview
             )
 
-        if len(chunks) > 2:
-            print(f"\n... (以及其他 {len(chunks) - 2} 个文本块)")
+        if total > 2:
+            print(f"\n... (以及其他 {total - 2} 个文本块)")
 
     except Exception as e:
-        print(f"读取或解析 .pkl 文件时出错: {e}")
+        print(f"读取或解析分块文件时出错: {e}")
 
 
 if __name__ == "__main__":
+    # 并行分块的进程数，默认为 CPU 核数
+    CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "0")) or None
+    # 单个分块的 token 上限，以及二次切分时相邻分块的重叠 token 数
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", str(MAX_CHUNK_TOKENS)))
+    CHUNK_OVERLAP_TOKENS = int(
+        os.getenv("CHUNK_OVERLAP_TOKENS", str(CHUNK_OVERLAP_TOKENS))
+    )
+
     # 第一步：执行分块和保存任务
-    chunk_and_save_files()
+    chunk_and_save_files(
+        workers=CHUNK_WORKERS,
+        max_tokens=CHUNK_MAX_TOKENS,
+        overlap_tokens=CHUNK_OVERLAP_TOKENS,
+    )
 
     # 第二步：打印分隔符，并查看一个示例文件的内容
     print("\n" + "=" * 60)
     print("--- 查看一个分块文件的内容示例 ---")
     print("=" * 60)
-    view_a_sample_pkl_file()
+    view_a_sample_chunk_file()
@@ -1,155 +1,496 @@
 import os
-import pickle
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_community.embeddings import ZhipuAIEmbeddings
 from langchain_core.documents import Document
 
+from kb_catalog import FileCatalog, STAGE_VECTOR, hash_file
+from chunk_store import ChunkStore, get_custom_metadata, header_path, parse_chunk_id
+from llm_utils import RateLimiter, estimate_tokens
+from embedding_cache import CachedEmbeddings, EmbeddingCache, format_stats
+from vector_index import default_index_dir, export_from_chroma
+
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
+# 向量模型
+EMBEDDING_MODEL = "embedding-3"
+
+# 向量接口单次请求的上限（embedding-3 每次最多 64 条文本），以及单次写入 Chroma 的向量数
+EMBED_BATCH_MAX_ITEMS = 64
+EMBED_BATCH_MAX_TOKENS = 64000
+CHROMA_WRITE_BATCH_SIZE = 1000
+
+# 合并后分块的 token 区间：小于下限的相邻块会被合并，合并结果不超过上限
+# （上限与 05 脚本二次切分的 MAX_CHUNK_TOKENS 保持一致）
+MIN_CHUNK_TOKENS = 1000
+MAX_CHUNK_TOKENS = 2000
+
+# 向量元数据的版本，元数据字段变化时递增（2：header_path 和分块区间 chunk_start/chunk_end），
+# 记入清单的向量阶段指纹，使分块文件未变化的源文件也会重新比对并补全元数据
+VECTOR_METADATA_VERSION = 2
+
+# 合并时块之间插入的分隔符及其 token 数
+CHUNK_SEPARATOR = "\n\n---\n\n"
+SEPARATOR_TOKENS = estimate_tokens(CHUNK_SEPARATOR)
+
+
+def create_vector_store(
+    db_dir: str,
+    embedding_cache: EmbeddingCache = None,
+    limiter: RateLimiter = None,
+    max_attempts: int = 1,
+) -> Chroma:
+    """
+    创建（或打开）持久化的 Chroma 向量库。
+
+    向量模型外包了一层持久化缓存，文本未变化的分块和重复的查询不会再次调用向量接口。
+
+    :param db_dir: 向量库目录。
+    :param embedding_cache: 向量缓存，默认打开项目默认位置的缓存。
+    :param limiter: 可选的 RateLimiter，调用向量接口前获取配额。
+    :param max_attempts: 调用向量接口失败时的最大尝试次数。
+    """
+    if embedding_cache is None:
+        embedding_cache = EmbeddingCache.open_default(
+            os.path.dirname(os.path.abspath(__file__))
+        )
+    embeddings = CachedEmbeddings(
+        ZhipuAIEmbeddings(model=EMBEDDING_MODEL),
+        embedding_cache,
+        limiter=limiter,
+        max_attempts=max_attempts,
+    )
+    return Chroma(
+        collection_name="linghangjihua_collection",
+        embedding_function=embeddings,
+        persist_directory=db_dir,
+    )
+
+
+def _join_chunks(chunks) -> Document:
+    """
+    将缓冲区中的多个小块拼接为一个 Document，沿用第一个块的元数据。
+
+    分块带有分块ID时，在元数据中记录合并覆盖的分块序号区间 (chunk_start, chunk_end)，
+    混合检索据此把 BM25 命中的分块对应到向量结果。
+    """
+    metadata = dict(chunks[0].metadata)
+    if chunks[0].id and chunks[-1].id:
+        metadata["chunk_start"] = parse_chunk_id(chunks[0].id)[1]
+        metadata["chunk_end"] = parse_chunk_id(chunks[-1].id)[1]
+    return Document(
+        page_content=CHUNK_SEPARATOR.join(c.page_content for c in chunks),
+        metadata=metadata,
+    )
+
 
-def get_custom_metadata(pkl_file_path: str) -> dict:
+def merge_small_chunks(
+    original_chunks,
+    min_chunk_tokens: int = MIN_CHUNK_TOKENS,
+    max_chunk_tokens: int = MAX_CHUNK_TOKENS,
+) -> list:
     """
-    根据文件路径生成自定义元数据。
+    智能合并逻辑：将相邻的小块合并，直到达到最小 token 数；本身足够大的块保持不变。
+
+    合并结果不会超过 max_chunk_tokens（分块阶段的二次切分已保证单个块不超过该上限），
+    因此所有块都落在 [min_chunk_tokens, max_chunk_tokens] 区间内（源文件末尾的剩余块除外）。
+    original_chunks 可以是任意可迭代对象（如分块存储的流式迭代器）。
+    """
+    merged_docs = []
+    small_chunk_buffer = []
+    buffer_token_count = 0
+
+    for chunk in original_chunks:
+        chunk_tokens = estimate_tokens(chunk.page_content)
+
+        if chunk_tokens >= min_chunk_tokens:
+            if small_chunk_buffer:
+                merged_docs.append(_join_chunks(small_chunk_buffer))
+                small_chunk_buffer = []
+                buffer_token_count = 0
+
+            merged_docs.append(_join_chunks([chunk]))
+            continue
+
+        # 加入当前块会超过上限时，先把缓冲区输出
+        if (
+            small_chunk_buffer
+            and buffer_token_count + chunk_tokens + SEPARATOR_TOKENS > max_chunk_tokens
+        ):
+            merged_docs.append(_join_chunks(small_chunk_buffer))
+            small_chunk_buffer = []
+            buffer_token_count = 0
+
+        if small_chunk_buffer:
+            buffer_token_count += SEPARATOR_TOKENS
+        small_chunk_buffer.append(chunk)
+        buffer_token_count += chunk_tokens
+
+        if buffer_token_count >= min_chunk_tokens:
+            merged_docs.append(_join_chunks(small_chunk_buffer))
+            small_chunk_buffer = []
+            buffer_token_count = 0
+
+    if small_chunk_buffer:
+        merged_docs.append(_join_chunks(small_chunk_buffer))
+
+    return merged_docs
+
+
+def vector_fingerprint(chunk_file_path: str) -> str:
+    """
+    向量阶段的输入指纹：分块文件的内容哈希加上向量元数据版本。
+    """
+    return f"{hash_file(chunk_file_path)}:v{VECTOR_METADATA_VERSION}"
+
+
+def make_vector_id(source_key: str, page_content: str) -> str:
+    """
+    向量的确定性ID：由源文件标识和分块内容计算，内容不变时ID不变，重复写入即为覆盖。
+    """
+    payload = source_key + "\n" + page_content
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_source_vector_metadatas(vector_store: Chroma, source_key: str) -> dict:
+    """
+    查询向量库中属于某个源文件的全部向量ID及其元数据。
+    """
+    result = vector_store.get(where={"source_key": source_key}, include=["metadatas"])
+    return {
+        vector_id: metadata or {}
+        for vector_id, metadata in zip(result["ids"], result["metadatas"])
+    }
+
+
+def plan_source_vectors(vector_store: Chroma, store: ChunkStore, source_key: str):
+    """
+    计算单个源文件应有的向量，并删除向量库中该源文件不再产生的旧向量。
+
+    每个向量使用 make_vector_id 计算的确定性ID，内容完全相同的分块只保留一个。
+    ID 只由内容决定，而分块区间 (chunk_start, chunk_end) 等元数据会随源文件中其他位置的修改而变化，
+    因此已有ID的向量也要比较元数据，不一致的以 update_documents 覆盖（向量取自缓存，不调用向量接口）。
+
+    :param vector_store: Chroma 向量库实例。
+    :param store: ChunkStore 分块存储。
+    :param source_key: 源文件标识。
+    :return: (该源文件的全部向量数, 需要新写入的 (ID, Document) 列表)。
+    :raises Exception: 读取分块文件失败时抛出。
+    """
+    existing = get_source_vector_metadatas(vector_store, source_key)
+    existing_ids = existing.keys()
+
+    original_count = store.count(source_key)
+    merged_docs = (
+        merge_small_chunks(store.iter_documents(source_key)) if original_count else []
+    )
+    if original_count:
+        print(f"  -> 原始分块: {original_count} -> 合并后分块: {len(merged_docs)}")
+    else:
+        print("  -> 文件为空。")
+
+    # 为合并后的文档添加自定义元数据
+    custom_meta = get_custom_metadata(source_key)
+    documents_by_id = {}
+    for doc in merged_docs:
+        doc.metadata.update(custom_meta)
+        doc.metadata["source_key"] = source_key
+        doc.metadata["header_path"] = header_path(doc.metadata)
+        documents_by_id.setdefault(make_vector_id(source_key, doc.page_content), doc)
+
+    stale_ids = existing_ids - documents_by_id.keys()
+    if stale_ids:
+        vector_store.delete(ids=sorted(stale_ids))
+        print(f"  -> 删除了 {len(stale_ids)} 个过期向量。")
+
+    outdated = {
+        vector_id: doc
+        for vector_id, doc in documents_by_id.items()
+        if vector_id in existing and existing[vector_id] != doc.metadata
+    }
+    if outdated:
+        vector_store.update_documents(
+            ids=list(outdated), documents=list(outdated.values())
+        )
+        print(f"  -> 更新了 {len(outdated)} 个向量的元数据。")
+
+    new_documents = [
+        (vector_id, doc)
+        for vector_id, doc in documents_by_id.items()
+        if vector_id not in existing_ids
+    ]
+    unchanged = len(documents_by_id) - len(new_documents) - len(outdated)
+    if unchanged:
+        print(f"  -> {unchanged} 个向量未变化，跳过。")
+    return len(documents_by_id), new_documents
+
+
+def add_source_to_vector_store(
+    vector_store: Chroma, store: ChunkStore, source_key: str
+) -> int:
+    """
+    从分块存储中流式读取单个源文件的分块，合并小块、补充自定义元数据后写入向量库。
+
+    向量库中已有的ID直接跳过，新的ID以 upsert 方式写入，
+    该源文件不再产生的旧向量会被删除，重复运行不会产生重复向量。
+
+    :param vector_store: Chroma 向量库实例。
+    :param store: ChunkStore 分块存储。
+    :param source_key: 源文件标识。
+    :return: 该源文件在向量库中的向量数量。
+    :raises Exception: 读取分块文件失败时抛出。
+    """
+    total, new_documents = plan_source_vectors(vector_store, store, source_key)
+    if new_documents:
+        vector_store.add_documents(
+            [doc for _, doc in new_documents],
+            ids=[vector_id for vector_id, _ in new_documents],
+        )
+        print(f"  -> {len(new_documents)} 个向量已写入数据库。")
+    return total
+
+
+def pack_embedding_batches(
+    documents,
+    max_items: int = EMBED_BATCH_MAX_ITEMS,
+    max_tokens: int = EMBED_BATCH_MAX_TOKENS,
+):
     """
-    metadata = {}
-    path_parts = pkl_file_path.replace("\\", "/").split("/")
+    将来自多个源文件的 (ID, Document) 流按向量接口的单次请求上限打包成批。
 
+    :param documents: 可迭代的 (ID, Document)。
+    :param max_items: 单批最多的文本条数。
+    :param max_tokens: 单批最多的 token 数（按 estimate_tokens 估算）。
+    :return: 逐个产出批次列表的生成器。
+    """
+    batch, batch_tokens = [], 0
+    for item in documents:
+        tokens = estimate_tokens(item[1].page_content)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _embed_batch(embeddings, batch):
+    """
+    线程池中执行：计算一批文本的向量，结果写入向量缓存，写库时直接命中缓存。
+    """
     try:
-        if "原文" in path_parts:
-            metadata["file_type"] = "original"
-            metadata["source_info"] = os.path.basename(pkl_file_path).replace(
-                ".pkl", ".md"
+        embeddings.embed_documents([doc.page_content for _, doc in batch])
+        return batch, None
+    except Exception as e:
+        return batch, e
+
+
+def index_documents_concurrently(
+    vector_store: Chroma,
+    documents,
+    workers: int = 4,
+    write_batch_size: int = CHROMA_WRITE_BATCH_SIZE,
+    max_items: int = EMBED_BATCH_MAX_ITEMS,
+    max_tokens: int = EMBED_BATCH_MAX_TOKENS,
+):
+    """
+    跨源文件打包向量请求并发计算，再以大批量写入 Chroma。
+
+    向量请求在线程池中并发发出（配额由向量模型上的限流器控制），同时在途的批次数有上限，
+    内存占用与语料规模无关；计算好的向量先进入向量缓存，累计到 write_batch_size 条后
+    一次性写入 Chroma，写入时的向量查询全部命中缓存，不会重复调用接口。
+
+    :param vector_store: create_vector_store 创建的向量库（向量模型需带缓存）。
+    :param documents: 可迭代的 (ID, Document)，Document 的元数据中需有 source_key。
+    :param workers: 并发的向量请求数。
+    :param write_batch_size: 单次写入 Chroma 的向量数。
+    :param max_items: 单个向量请求最多的文本条数。
+    :param max_tokens: 单个向量请求最多的 token 数。
+    :return: (写入的向量数, 出错的源文件标识到错误信息的字典)。
+    """
+    written = 0
+    failed_sources = {}
+    pending_writes = []
+
+    def flush():
+        nonlocal written, pending_writes
+        if pending_writes:
+            vector_store.add_documents(
+                [doc for _, doc in pending_writes],
+                ids=[vector_id for vector_id, _ in pending_writes],
             )
-        elif "解读" in path_parts:
-            metadata["file_type"] = "construe"
-            metadata["source_info"] = path_parts[-2]
-        else:
-            metadata["file_type"] = "unknown"
-            metadata["source_info"] = os.path.basename(pkl_file_path)
-    except IndexError:
-        metadata["file_type"] = "error"
-        metadata["source_info"] = "path_parsing_error"
+            written += len(pending_writes)
+            print(f"  -> 已写入 {written} 个向量。")
+            pending_writes = []
+
+    def collect(future):
+        batch, error = future.result()
+        if error:
+            print(f"  -> 向量请求失败 ({len(batch)} 条): {error}")
+            for _, doc in batch:
+                failed_sources[doc.metadata["source_key"]] = str(error)
+            return
+        pending_writes.extend(batch)
+        if len(pending_writes) >= write_batch_size:
+            flush()
+
+    started_at = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for batch in pack_embedding_batches(documents, max_items, max_tokens):
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            in_flight.add(executor.submit(_embed_batch, vector_store.embeddings, batch))
+        for future in as_completed(in_flight):
+            collect(future)
+    flush()
+
+    elapsed = time.time() - started_at
+    if written:
+        print(
+            f"  -> 写入 {written} 个向量，用时 {elapsed:.1f} 秒（{written / elapsed:.1f} 个/秒）。"
+        )
+    return written, failed_sources
+
 
-    return metadata
+def delete_stale_sources(vector_store: Chroma, source_keys) -> int:
+    """
+    删除源文件已不在分块存储中的向量，以及旧版本写入的、没有 source_key 元数据的向量。
+
+    :param vector_store: Chroma 向量库实例。
+    :param source_keys: 分块存储中现有的全部源文件标识。
+    :return: 删除的向量数量。
+    """
+    source_keys = set(source_keys)
+    stale_ids = []
+    offset, page_size = 0, 5000
+    while True:
+        result = vector_store.get(include=["metadatas"], limit=page_size, offset=offset)
+        for vector_id, metadata in zip(result["ids"], result["metadatas"]):
+            if (metadata or {}).get("source_key") not in source_keys:
+                stale_ids.append(vector_id)
+        if len(result["ids"]) < page_size:
+            break
+        offset += page_size
+
+    for start in range(0, len(stale_ids), page_size):
+        vector_store.delete(ids=stale_ids[start : start + page_size])
+    return len(stale_ids)
+
+
+def print_embedding_stats(vector_store: Chroma):
+    """
+    打印向量接口的实际调用次数和向量缓存的命中情况。
+    """
+    embeddings = vector_store.embeddings
+    print(
+        f"向量接口调用 {embeddings.api_calls} 次，共计算 {embeddings.embedded_texts} 条文本。"
+    )
+    print(format_stats(embeddings.cache.stats()))
 
 
-def create_vector_db():
+def create_vector_db(workers: int = 4, limiter: RateLimiter = None):
     """
-    主函数，处理pkl文件，合并块，并存入ChromaDB。
+    主函数，逐个源文件读取分块，合并块，并存入ChromaDB。
+
+    向量按确定性ID增量同步：重复运行结果不变，向量库的大小只随语料变化。
+    所有源文件需要新写入的分块汇成一个流，按向量接口的单次请求上限跨文件打包后并发计算。
+
+    :param workers: 并发的向量请求数。
+    :param limiter: 可选的 RateLimiter，控制向量接口的请求和 token 配额。
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
     knowledge_base_dir = os.path.join(script_dir, "knowledge_base")
-    source_dir = os.path.join(
-        knowledge_base_dir, "04_database", "01_langchain_split_documents_files"
-    )
+    store = ChunkStore.open_default(script_dir)
     db_dir = os.path.join(knowledge_base_dir, "04_database", "02_vector_chroma_db")
 
-    if not os.path.isdir(source_dir):
-        print(f"错误：源目录不存在 -> {source_dir}")
+    if not os.path.isdir(store.root_dir):
+        print(f"错误：源目录不存在 -> {store.root_dir}")
         return
 
-    embeddings = ZhipuAIEmbeddings(model="embedding-3")
-    vector_store = Chroma(
-        collection_name="linghangjihua_collection",
-        embedding_function=embeddings,
-        persist_directory=db_dir,
-    )
-
-    print(f"\n开始处理目录: {source_dir}")
-    total_files_processed = 0
-    total_vectors_added = 0
-
-    for root, _, files in os.walk(source_dir):
-        for file in files:
-            if not file.endswith(".pkl"):
-                continue
+    vector_store = create_vector_store(db_dir, limiter=limiter, max_attempts=5)
+    catalog = FileCatalog.open_default(script_dir)
 
-            total_files_processed += 1
-            file_path = os.path.join(root, file)
-            print(f"\n正在处理文件 ({total_files_processed}): {file_path}")
+    print(f"\n开始处理目录: {store.root_dir}")
+    source_keys = list(store.iter_sources())
+    source_totals = {}
+    failed_sources = {}
 
+    def iter_new_documents():
+        for number, source_key in enumerate(source_keys, 1):
+            print(f"\n正在处理文件 ({number}): {store.path_for(source_key)}")
             try:
-                with open(file_path, "rb") as f:
-                    original_chunks = pickle.load(f)
+                total, new_documents = plan_source_vectors(
+                    vector_store, store, source_key
+                )
             except Exception as e:
-                print(f"  -> 读取 .pkl 文件时出错: {e}")
-                continue
-
-            if not original_chunks:
-                print("  -> 文件为空，跳过。")
+                print(f"  -> 读取分块文件时出错: {e}")
+                failed_sources[source_key] = str(e)
                 continue
+            source_totals[source_key] = total
+            yield from new_documents
 
-            # 智能合并逻辑：将小块合并，直到达到最小尺寸
-            merged_docs = []
-            small_chunk_buffer = []
-            buffer_char_count = 0
-            min_chunk_size = 2000
-
-            for chunk in original_chunks:
-                chunk_len = len(chunk.page_content)
-
-                if chunk_len >= min_chunk_size:
-                    if small_chunk_buffer:
-                        merged_content = "\n\n---\n\n".join(
-                            [c.page_content for c in small_chunk_buffer]
-                        )
-                        merged_doc = Document(
-                            page_content=merged_content,
-                            metadata=small_chunk_buffer[0].metadata,
-                        )
-                        merged_docs.append(merged_doc)
-                        small_chunk_buffer = []
-                        buffer_char_count = 0
-
-                    merged_docs.append(chunk)
-                else:
-                    small_chunk_buffer.append(chunk)
-                    buffer_char_count += chunk_len
-
-                    if buffer_char_count >= min_chunk_size:
-                        merged_content = "\n\n---\n\n".join(
-                            [c.page_content for c in small_chunk_buffer]
-                        )
-                        merged_doc = Document(
-                            page_content=merged_content,
-                            metadata=small_chunk_buffer[0].metadata,
-                        )
-                        merged_docs.append(merged_doc)
-                        small_chunk_buffer = []
-                        buffer_char_count = 0
-
-            if small_chunk_buffer:
-                merged_content = "\n\n---\n\n".join(
-                    [c.page_content for c in small_chunk_buffer]
-                )
-                merged_doc = Document(
-                    page_content=merged_content, metadata=small_chunk_buffer[0].metadata
-                )
-                merged_docs.append(merged_doc)
-
-            print(
-                f"  -> 原始分块: {len(original_chunks)} -> 合并后分块: {len(merged_docs)}"
+    written, embed_failures = index_documents_concurrently(
+        vector_store, iter_new_documents(), workers=workers
+    )
+    failed_sources.update(embed_failures)
+
+    for source_key, total in source_totals.items():
+        if source_key in failed_sources:
+            catalog.record_progress_by_stem(
+                source_key,
+                STAGE_VECTOR,
+                state="failed",
+                detail=failed_sources[source_key],
             )
+        elif total:
+            catalog.record_progress_by_stem(
+                source_key,
+                STAGE_VECTOR,
+                fingerprint=vector_fingerprint(store.path_for(source_key)),
+                detail=f"{total} vectors",
+            )
+    catalog.close()
 
-            # 为合并后的文档添加自定义元数据并存入数据库
-            final_documents_to_add = []
-            for doc in merged_docs:
-                custom_meta = get_custom_metadata(file_path)
-                doc.metadata.update(custom_meta)
-                final_documents_to_add.append(doc)
-
-            if final_documents_to_add:
-                vector_store.add_documents(final_documents_to_add)
-                total_vectors_added += len(final_documents_to_add)
-                print(f"  -> {len(final_documents_to_add)} 个向量已添加至数据库。")
+    removed = delete_stale_sources(vector_store, source_keys)
+    if removed:
+        print(f"\n删除了 {removed} 个源文件已不存在（或由旧版本写入）的向量。")
 
     print("\n数据库已成功创建并自动持久化！")
     print(
-        f"总共处理了 {total_files_processed} 个文件，生成了 {total_vectors_added} 个向量。"
+        f"总共处理了 {len(source_keys)} 个文件，新写入 {written} 个向量，"
+        f"向量库中共有 {sum(source_totals.values())} 个向量。"
     )
+    if failed_sources:
+        print(f"有 {len(failed_sources)} 个文件处理失败，下次运行时会重试。")
+    print_embedding_stats(vector_store)
+
+
+def export_numpy_index(dtype: str = "float32"):
+    """
+    将 Chroma 向量库导出为 NumPy 检索索引 (vector_index.NumpyVectorIndex)，供检索端直接内存映射加载。
+
+    :param dtype: 向量矩阵的存储精度，"float32" 或 "float16"。
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    db_dir = os.path.join(
+        script_dir, "knowledge_base", "04_database", "02_vector_chroma_db"
+    )
+    if not os.path.isdir(db_dir):
+        print(f"数据库目录不存在: {db_dir}")
+        return
+
+    index_dir = default_index_dir(script_dir)
+    exported = export_from_chroma(create_vector_store(db_dir), index_dir, dtype)
+    print(f"已导出 {exported} 个向量到 NumPy 检索索引: {index_dir}")
 
 
 def verify_vector_db():
@@ -166,12 +507,7 @@ def verify_vector_db():
         return
 
     print("正在加载持久化的向量数据库...")
-    embeddings = ZhipuAIEmbeddings(model="embedding-3")
-    vector_store = Chroma(
-        collection_name="linghangjihua_collection",
-        embedding_function=embeddings,
-        persist_directory=db_dir,
-    )
+    vector_store = create_vector_store(db_dir)
 
     query = "人工智能是什么"
     print(f"\n正在执行测试查询: '{query}'")
@@ -197,11 +533,28 @@ def verify_vector_db():
     except Exception as e:
         print(f"执行测试查询时出错: {e}")
 
+    print_embedding_stats(vector_store)
+
 
 if __name__ == "__main__":
-    create_vector_db()
+    # 并发的向量请求数，以及向量接口的每分钟请求数 / token 数配额（0 表示不限）
+    EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+    EMBED_RPM = int(os.getenv("EMBED_RPM", "0")) or None
+    EMBED_TPM = int(os.getenv("EMBED_TPM", "0")) or None
+    # NumPy 检索索引中向量的存储精度（float32 / float16）
+    NUMPY_INDEX_DTYPE = os.getenv("NUMPY_INDEX_DTYPE", "float32")
+
+    create_vector_db(
+        workers=EMBED_WORKERS,
+        limiter=RateLimiter(EMBED_RPM, EMBED_TPM),
+    )
 
     print("\n" + "=" * 60)
     print("--- 开始验证向量数据库 ---")
     print("=" * 60)
     verify_vector_db()
+
+    print("\n" + "=" * 60)
+    print("--- 导出 NumPy 检索索引 ---")
+    print("=" * 60)
+    export_numpy_index(NUMPY_INDEX_DTYPE)
@@ -1,20 +1,272 @@
 import os
-import pickle
 import time
+import bisect
+import itertools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from dotenv import load_dotenv
 
 # LangChain and Neo4j imports
 from langchain_experimental.graph_transformers import LLMGraphTransformer
 from langchain_community.chat_models import ChatZhipuAI
-from langchain_neo4j import Neo4jGraph
+
+from kb_catalog import FileCatalog, STAGE_GRAPH, hash_file
+from chunk_store import ChunkStore
+from graph_cache import (
+    GraphExtractionCache,
+    format_stats,
+    graph_document_from_dict,
+    graph_document_to_dict,
+    make_extraction_key,
+)
+from graph_store import SQLiteGraphStore
+from graph_writer import Neo4jBulkWriter
+from llm_utils import AdaptiveConcurrency, RateLimiter, call_with_retry, estimate_tokens
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
+# 图谱抽取使用的模型及 LLMGraphTransformer 的参数（如 allowed_nodes、allowed_relationships），
+# 都参与抽取缓存键的计算，修改后所有分块会重新抽取
+GRAPH_LLM_MODEL = "glm-4-long"
+GRAPH_LLM_TEMPERATURE = 0.0
+GRAPH_TRANSFORMER_CONFIG = {}
+
+# 默认同时在途的抽取请求数，以及单次写入图谱的图文档数（合并去重后批量写入）
+GRAPH_WORKERS = 4
+GRAPH_WRITE_BATCH_SIZE = 500
+
+# 每次抽取请求在文档块之外额外消耗的 token 估计（抽取提示词和输出的图结构），用于 TPM 限流
+EXTRACTION_OVERHEAD_TOKENS = 1500
+
+
+def extraction_settings():
+    """
+    影响抽取结果的参数，记录在抽取缓存键中。
+    """
+    return {
+        "model": GRAPH_LLM_MODEL,
+        "temperature": GRAPH_LLM_TEMPERATURE,
+        "transformer": GRAPH_TRANSFORMER_CONFIG,
+    }
+
+
+def graph_target():
+    """
+    当前连接的图数据库标识（连接地址加数据库名），写入检查点按此区分。
+    """
+    return f"{os.getenv('NEO4J_URI', '')}/{os.getenv('NEO4J_DATABASE', 'neo4j')}"
+
+
+def create_graph_components(backend=None):
+    """
+    初始化图谱写入器和基于 glm-4-long 的 Graph Transformer。
+
+    :param backend: "neo4j" 写入 .env 中配置的 Neo4j；"sqlite" 写入本地的嵌入式图谱存储
+        (knowledge_base/04_database/05_graph_store.sqlite3)，不需要任何服务。
+        默认读取 GRAPH_BACKEND 环境变量，未设置时为 "neo4j"。
+    :return: (writer, llm_transformer)，writer 为 Neo4jBulkWriter 或 SQLiteGraphStore。
+    :raises Exception: 无法连接 Neo4j 时抛出。
+    """
+    backend = backend or os.getenv("GRAPH_BACKEND", "neo4j")
+    if backend == "sqlite":
+        writer = SQLiteGraphStore.open_default(
+            os.path.dirname(os.path.abspath(__file__))
+        )
+    else:
+        from langchain_neo4j import Neo4jGraph
+
+        writer = Neo4jBulkWriter(Neo4jGraph())
+    zhipu_long_llm = ChatZhipuAI(
+        model=GRAPH_LLM_MODEL, temperature=GRAPH_LLM_TEMPERATURE
+    )
+    llm_transformer = LLMGraphTransformer(
+        llm=zhipu_long_llm, **GRAPH_TRANSFORMER_CONFIG
+    )
+    return writer, llm_transformer
+
+
+def extract_graph_document(
+    llm_transformer, chunk, concurrency, limiter=None, max_attempts=3
+):
+    """
+    调用大模型从单个文档块中抽取图文档，失败时按指数退避重试。
+
+    :param llm_transformer: LLMGraphTransformer 实例。
+    :param chunk: 文档块 (Document)。
+    :param concurrency: 共享的 AdaptiveConcurrency，限制同时在途的抽取请求数。
+    :param limiter: 可选的 RateLimiter，控制请求数和 token 配额。
+    :param max_attempts: 最大尝试次数。
+    :return: GraphDocument。
+    """
+
+    def attempt():
+        with concurrency:
+            return llm_transformer.convert_to_graph_documents([chunk])[0]
+
+    return call_with_retry(
+        attempt,
+        max_attempts=max_attempts,
+        limiter=limiter,
+        tokens=estimate_tokens(chunk.page_content) + EXTRACTION_OVERHEAD_TOKENS,
+    )
+
+
+def add_chunks_to_graph(
+    writer,
+    llm_transformer,
+    chunks,
+    batch_size=GRAPH_WRITE_BATCH_SIZE,
+    total=None,
+    workers=GRAPH_WORKERS,
+    limiter=None,
+    concurrency=None,
+    max_attempts=3,
+    cache=None,
+    target=None,
+):
+    """
+    并发抽取文档块的图文档，并分批写入图谱（Neo4j 或本地图谱存储）。
+
+    抽取请求在线程池中并发发出，同时在途的请求数由自适应并发上限控制：
+    遇到限流时减半，持续成功时逐步恢复；配额由共享的限流器控制。
+    抽取结果由调用线程累计到 batch_size 个后，合并去重并通过 writer 批量写入。
+
+    提供抽取缓存时，每个分块的抽取结果一完成就写入缓存，写入图谱成功后记录检查点：
+    已写入且内容未变化的分块直接跳过，已抽取但未写入的分块从缓存重放，
+    中断或部分失败后重新运行，只有失败和新增的分块才会调用大模型。
+
+    :param writer: 图谱写入器（Neo4jBulkWriter 或 SQLiteGraphStore），提供 write 方法。
+    :param llm_transformer: LLMGraphTransformer 实例。
+    :param chunks: 文档块列表或迭代器；迭代器按需逐步读取，不会一次性加载。
+    :param batch_size: 单次写入图谱的图文档数。
+    :param total: 文档块总数，仅用于显示进度；为 None 时尝试使用 len(chunks)。
+    :param workers: 最多同时在途的抽取请求数。
+    :param limiter: 可选的 RateLimiter，多个调用方共享时可将请求速率控制在配额以内。
+    :param concurrency: 可选的共享 AdaptiveConcurrency；为 None 时按 workers 新建。
+    :param max_attempts: 单个文档块抽取的最大尝试次数。
+    :param cache: 可选的 GraphExtractionCache。
+    :param target: 写入检查点使用的图数据库标识，默认为 writer.target，没有时为 graph_target()。
+    :return: 处理失败的文档块下标集合。
+    """
+    if total is None and hasattr(chunks, "__len__"):
+        total = len(chunks)
+    total_chunks = total or 0
+    workers = max(1, workers)
+    if concurrency is None:
+        concurrency = AdaptiveConcurrency(workers)
+    settings = extraction_settings()
+    target = target or getattr(writer, "target", None) or graph_target()
+    failed_indices = set()
+    pending_writes = []
+    stats = {"done": 0, "skipped": 0, "replayed": 0, "nodes": 0, "relationships": 0}
+
+    print(f"--- 开始处理 {total_chunks} 个文档块，最多 {workers} 个并发抽取请求 ---")
 
-def create_neo4j_graph_from_chunks():
+    def flush():
+        nonlocal pending_writes
+        if not pending_writes:
+            return
+        batch, pending_writes = pending_writes, []
+        indices = [index for index, _, _, _ in batch]
+        graph_documents = [doc for _, _, _, doc in batch]
+        try:
+            writer.write(graph_documents)
+        except Exception as e:
+            print(f"  - [错误] {len(indices)} 个文档块写入图谱失败: {e}")
+            failed_indices.update(indices)
+            return
+        if cache is not None:
+            cache.mark_written(
+                target,
+                [(chunk_id, key) for _, chunk_id, key, _ in batch if chunk_id],
+            )
+        stats["nodes"] += sum(len(doc.nodes) for doc in graph_documents)
+        stats["relationships"] += sum(len(doc.relationships) for doc in graph_documents)
+        print(
+            f"  - 已完成 {stats['done']}/{total_chunks} 个文档块，"
+            f"累计写入 {stats['nodes']} 个节点、{stats['relationships']} 个关系"
+            f"（当前并发上限 {concurrency.limit}）。"
+        )
+
+    def enqueue(index, chunk_id, key, graph_document):
+        pending_writes.append((index, chunk_id, key, graph_document))
+        if len(pending_writes) >= batch_size:
+            flush()
+
+    def collect(future, index, chunk_id, key):
+        stats["done"] += 1
+        try:
+            graph_document = future.result()
+        except Exception as e:
+            print(f"  - [错误] 文档块 {chunk_id or index} 抽取失败: {e}")
+            failed_indices.add(index)
+            return
+        if cache is not None:
+            cache.put(
+                key,
+                GRAPH_LLM_MODEL,
+                chunk_id,
+                graph_document_to_dict(graph_document),
+            )
+        enqueue(index, chunk_id, key, graph_document)
+
+    started_at = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        for index, chunk in enumerate(chunks):
+            chunk_id = getattr(chunk, "id", None)
+            key = None
+            if cache is not None:
+                key = make_extraction_key(settings, chunk.page_content)
+                if chunk_id and cache.written_key(target, chunk_id) == key:
+                    stats["done"] += 1
+                    stats["skipped"] += 1
+                    continue
+                cached = cache.get(key)
+                if cached is not None:
+                    stats["done"] += 1
+                    stats["replayed"] += 1
+                    enqueue(
+                        index, chunk_id, key, graph_document_from_dict(cached, chunk)
+                    )
+                    continue
+
+            # 提交的任务数有上限，迭代器中的文档块按需读取
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, *in_flight.pop(future))
+            future = executor.submit(
+                extract_graph_document,
+                llm_transformer,
+                chunk,
+                concurrency,
+                limiter,
+                max_attempts,
+            )
+            in_flight[future] = (index, chunk_id, key)
+        for future in as_completed(in_flight):
+            collect(future, *in_flight[future])
+    flush()
+
+    elapsed = time.time() - started_at
+    if stats["done"]:
+        print(
+            f"--- 处理 {stats['done']} 个文档块，用时 {elapsed:.1f} 秒"
+            f"（{stats['done'] / elapsed * 60:.1f} 个/分钟），"
+            f"跳过已写入 {stats['skipped']} 个，从缓存重放 {stats['replayed']} 个，"
+            f"限流 {concurrency.rate_limited} 次，失败 {len(failed_indices)} 个 ---"
+        )
+    return failed_indices
+
+
+def create_neo4j_graph_from_chunks(workers=GRAPH_WORKERS, limiter=None):
     """
-    主函数，采用“全局加载，分批处理”的策略，构建Neo4j知识图谱。
+    主函数，采用“流式读取，并发抽取，分批写入”的策略，构建知识图谱。
+    写入目标由 GRAPH_BACKEND 环境变量选择（neo4j 或 sqlite），见 create_graph_components。
+
+    :param workers: 最多同时在途的抽取请求数。
+    :param limiter: 可选的 RateLimiter，控制大模型的请求和 token 配额。
     """
     # --- 1. 路径定义 ---
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -27,74 +279,74 @@ def create_neo4j_graph_from_chunks():
         print(f"错误：源目录不存在 -> {source_dir}")
         return
 
-    # --- 2. 一次性加载所有文档块 ---
-    print(f"正在从 {source_dir} 加载所有文档块...")
-    all_document_chunks = []
-    for root, _, files in os.walk(source_dir):
-        for file in files:
-            if file.endswith(".pkl"):
-                file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, "rb") as f:
-                        all_document_chunks.extend(pickle.load(f))
-                except Exception as e:
-                    print(f"警告：读取文件 {file_path} 时出错: {e}")
-
-    if not all_document_chunks:
+    # --- 2. 读取各源文件的分块数量（只读头部，不加载分块内容） ---
+    print(f"正在从 {source_dir} 读取分块索引...")
+    store = ChunkStore(source_dir)
+    source_keys, source_starts = [], []
+    total_chunks = 0
+    for source_key in store.iter_sources():
+        try:
+            count = store.count(source_key)
+        except Exception as e:
+            print(f"警告：读取文件 {store.path_for(source_key)} 时出错: {e}")
+            continue
+        if count:
+            source_keys.append(source_key)
+            source_starts.append(total_chunks)
+            total_chunks += count
+
+    if not total_chunks:
         print("未能加载任何文档块，程序终止。")
         return
 
     # --- 3. 初始化组件和数据库 ---
-    print("正在初始化LLM、Graph Transformer和Neo4j连接...")
+    print("正在初始化LLM、Graph Transformer和图谱写入目标...")
     try:
-        graph = Neo4jGraph()
+        writer, llm_transformer = create_graph_components()
     except Exception as e:
-        print(f"错误：无法连接到Neo4j数据库，请检查.env配置和数据库状态: {e}")
+        print(f"错误：无法连接到图数据库，请检查.env配置和数据库状态: {e}")
         return
 
-    zhipu_long_llm = ChatZhipuAI(model="glm-4-long", temperature=0.0)
-    llm_transformer = LLMGraphTransformer(llm=zhipu_long_llm)
-
-    # --- 4. 分批处理与写入 ---
-    total_chunks = len(all_document_chunks)
-    batch_size = 5
-    total_batches = (total_chunks + batch_size - 1) // batch_size
-
-    print(f"--- 开始处理 {total_chunks} 个文档块，共分为 {total_batches} 个批次 ---")
-
-    for i in range(0, total_chunks, batch_size):
-        batch = all_document_chunks[i : i + batch_size]
-        current_batch_num = i // batch_size + 1
-
-        print(
-            f"\n[批次 {current_batch_num}/{total_batches}] 正在处理 {len(batch)} 个文档块..."
+    # --- 4. 流式分批处理与写入 ---
+    all_document_chunks = itertools.chain.from_iterable(
+        store.iter_documents(source_key) for source_key in source_keys
+    )
+    with GraphExtractionCache.open_default(script_dir) as cache:
+        failed_indices = add_chunks_to_graph(
+            writer,
+            llm_transformer,
+            all_document_chunks,
+            total=total_chunks,
+            workers=workers,
+            limiter=limiter,
+            cache=cache,
         )
+        print(format_stats(cache.stats()))
+    print(writer.format_stats())
+    # 根据各源文件分块的起始下标，把失败的分块映射回源文件
+    failed_sources = {
+        source_keys[bisect.bisect_right(source_starts, i) - 1] for i in failed_indices
+    }
 
-        try:
-            # 步骤 1: 将文本块转换为图文档
-            print("  - 步骤 1: 调用 LLM 进行图谱转换...")
-            graph_documents_batch = llm_transformer.convert_to_graph_documents(batch)
-            total_nodes = sum(len(doc.nodes) for doc in graph_documents_batch)
-            total_rels = sum(len(doc.relationships) for doc in graph_documents_batch)
-            print(
-                f"  - 步骤 1: 转换成功！生成了 {total_nodes} 个节点和 {total_rels} 个关系。"
+    # --- 5. 按文件记录处理进度 ---
+    with FileCatalog.open_default(script_dir) as catalog:
+        for source_key in source_keys:
+            catalog.record_progress_by_stem(
+                source_key,
+                STAGE_GRAPH,
+                state="failed" if source_key in failed_sources else "done",
+                fingerprint=hash_file(store.path_for(source_key)),
             )
 
-            # 步骤 2: 将生成的图文档添加到 Neo4j 数据库
-            print("  - 步骤 2: 正在将图数据写入 Neo4j...")
-            graph.add_graph_documents(
-                graph_documents_batch, baseEntityLabel=True, include_source=True
-            )
-            print(f"  - 步骤 2: 批次 {current_batch_num} 数据写入完成。")
-
-        except Exception as e:
-            print(f"  - [错误] 批次 {current_batch_num} 处理失败: {e}")
-
-        # 在批次之间加入短暂延迟
-        time.sleep(1)
-
-    print("\n--- 所有批次处理完成！知识图谱已在Neo4j中构建。 ---")
+    print("\n--- 所有文档块处理完成！知识图谱已构建。 ---")
 
 
 if __name__ == "__main__":
-    create_neo4j_graph_from_chunks()
+    # 并发抽取请求数上限，以及 glm-4-long 的每分钟请求数 / token 数配额（0 表示不限制）
+    GRAPH_WORKERS = int(os.getenv("GRAPH_WORKERS", str(GRAPH_WORKERS)))
+    ZHIPUAI_RPM = int(os.getenv("ZHIPUAI_RPM", "0")) or None
+    ZHIPUAI_TPM = int(os.getenv("ZHIPUAI_TPM", "0")) or None
+
+    create_neo4j_graph_from_chunks(
+        workers=GRAPH_WORKERS, limiter=RateLimiter(ZHIPUAI_RPM, ZHIPUAI_TPM)
+    )
@@ -0,0 +1,330 @@
+import os
+import json
+import mmap
+import argparse
+
+# 分块文件的扩展名：每个源文件对应一个 .chunks.jsonl
+CHUNK_FILE_SUFFIX = ".chunks.jsonl"
+
+# 文件格式版本，写在每个分块文件的头部
+FORMAT_VERSION = 1
+
+# 组成标题路径的元数据字段（与 MarkdownHeaderTextSplitter 的配置一致）
+HEADER_KEYS = ("Header 1", "Header 2", "Header 3")
+
+
+def header_path(metadata):
+    """
+    将分块元数据中的各级标题拼接为标题路径，如 "一、总体要求 > （一）科学技术"。
+    """
+    return " > ".join(metadata[key] for key in HEADER_KEYS if metadata.get(key))
+
+
+def get_custom_metadata(source_key: str) -> dict:
+    """
+    根据源文件标识（相对路径去掉扩展名）生成自定义元数据：
+    文件类型（原文 / 解读）、来源信息，以及所属的顶层政策目录。
+    """
+    metadata = {}
+    path_parts = source_key.replace("\\", "/").split("/")
+
+    try:
+        if "原文" in path_parts:
+            metadata["file_type"] = "original"
+            metadata["source_info"] = path_parts[-1] + ".md"
+        elif "解读" in path_parts:
+            metadata["file_type"] = "construe"
+            metadata["source_info"] = path_parts[-2]
+        else:
+            metadata["file_type"] = "unknown"
+            metadata["source_info"] = path_parts[-1]
+    except IndexError:
+        metadata["file_type"] = "error"
+        metadata["source_info"] = "path_parsing_error"
+    metadata["top_folder"] = path_parts[0]
+
+    return metadata
+
+
+def make_chunk_id(source_key, index):
+    """
+    分块的ID：源文件标识加上该分块在源文件中的序号。
+    """
+    return f"{source_key}#{index}"
+
+
+def parse_chunk_id(chunk_id):
+    """
+    将分块ID拆分为 (源文件标识, 序号)。
+    """
+    source_key, _, index = chunk_id.rpartition("#")
+    return source_key, int(index)
+
+
+class ChunkStore:
+    """
+    基于 JSONL 加偏移索引的分块存储，替代按源文件保存的 pickle。
+
+    每个源文件对应一个 .chunks.jsonl 文件：第一行是头部（格式版本、源文件哈希、
+    每个分块的字节偏移和标题路径），其后每行是一个分块的 JSON。读取时只解析头部，
+    再通过内存映射按偏移取出需要的分块，因此可以按源文件、标题路径或分块ID惰性读取，
+    下游阶段逐块流式处理，内存占用不随语料规模增长。
+    """
+
+    def __init__(self, root_dir):
+        """
+        :param root_dir: 分块文件的根目录，目录结构与源文件相同。
+        """
+        self.root_dir = root_dir
+
+    @classmethod
+    def open_default(cls, project_root, kb_dir="knowledge_base"):
+        """
+        打开项目默认位置的分块存储 (knowledge_base/04_database/01_langchain_split_documents_files)。
+        """
+        return cls(
+            os.path.join(
+                project_root,
+                kb_dir,
+                "04_database",
+                "01_langchain_split_documents_files",
+            )
+        )
+
+    # ------------------------------------------------------------------
+    # 路径
+    # ------------------------------------------------------------------
+    def path_for(self, source_key):
+        """
+        计算源文件标识（相对路径去掉扩展名，用 / 分隔）对应的分块文件路径。
+        """
+        return os.path.join(self.root_dir, *source_key.split("/")) + CHUNK_FILE_SUFFIX
+
+    def source_key_for(self, chunk_file_path):
+        """
+        由分块文件路径反推源文件标识。
+        """
+        relative_path = os.path.relpath(chunk_file_path, self.root_dir)
+        return relative_path[: -len(CHUNK_FILE_SUFFIX)].replace("\\", "/")
+
+    def iter_sources(self):
+        """
+        按路径顺序列出存储中所有源文件的标识。
+        """
+        for root, dirs, files in os.walk(self.root_dir):
+            dirs.sort()
+            for file in sorted(files):
+                if file.endswith(CHUNK_FILE_SUFFIX):
+                    yield self.source_key_for(os.path.join(root, file))
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def write_source(self, source_key, documents, source_hash=None, settings=None):
+        """
+        写入（或整体替换）一个源文件的全部分块。
+
+        先写临时文件再原子重命名，中断时不会留下不完整的分块文件。
+
+        :param source_key: 源文件标识。
+        :param documents: 具有 page_content 和 metadata 属性的分块列表（如 LangChain Document）。
+        :param source_hash: 源文件的内容哈希，记录在头部，供增量分块判断是否需要重新处理。
+        :param settings: 生成这些分块时使用的参数（可 JSON 序列化），同样记录在头部。
+        :return: 分块文件路径。
+        """
+        lines, offsets, header_paths = [], [], []
+        position = 0
+        for document in documents:
+            line = (
+                json.dumps(
+                    {
+                        "page_content": document.page_content,
+                        "metadata": document.metadata,
+                    },
+                    ensure_ascii=False,
+                )
+                + "\n"
+            ).encode("utf-8")
+            lines.append(line)
+            offsets.append(position)
+            header_paths.append(header_path(document.metadata))
+            position += len(line)
+
+        header = {
+            "format_version": FORMAT_VERSION,
+            "source_key": source_key,
+            "source_hash": source_hash,
+            "settings": settings,
+            "count": len(lines),
+            "offsets": offsets + [position],
+            "header_paths": header_paths,
+        }
+        path = self.path_for(source_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".part"
+        with open(temp_path, "wb") as f:
+            f.write((json.dumps(header, ensure_ascii=False) + "\n").encode("utf-8"))
+            f.writelines(lines)
+        os.replace(temp_path, path)
+        return path
+
+    def delete_source(self, source_key):
+        """
+        删除一个源文件的分块文件，文件不存在时返回 False。
+        """
+        try:
+            os.remove(self.path_for(source_key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    def read_header(self, source_key):
+        """
+        只读取分块文件的头部，文件不存在时返回 None。
+        """
+        try:
+            with open(self.path_for(source_key), "rb") as f:
+                return json.loads(f.readline())
+        except FileNotFoundError:
+            return None
+
+    def source_hash(self, source_key):
+        """
+        返回写入分块时记录的源文件哈希，没有记录时返回 None。
+        """
+        header = self.read_header(source_key)
+        return header.get("source_hash") if header else None
+
+    def count(self, source_key=None):
+        """
+        返回某个源文件（或整个存储）的分块数量，只读取头部。
+        """
+        keys = [source_key] if source_key else self.iter_sources()
+        return sum((self.read_header(key) or {}).get("count", 0) for key in keys)
+
+    def _iter_source(self, source_key, indices=None, header_prefix=None):
+        path = self.path_for(source_key)
+        with open(path, "rb") as f:
+            header_line = f.readline()
+            header = json.loads(header_line)
+            if header["count"] == 0:
+                return
+            base = len(header_line)
+            offsets = header["offsets"]
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for index in range(header["count"]) if indices is None else indices:
+                    path_text = header["header_paths"][index]
+                    if header_prefix and not path_text.startswith(header_prefix):
+                        continue
+                    record = json.loads(
+                        mapped[base + offsets[index] : base + offsets[index + 1]]
+                    )
+                    record["chunk_id"] = make_chunk_id(source_key, index)
+                    record["source_key"] = source_key
+                    record["header_path"] = path_text
+                    yield record
+
+    def iter_chunks(self, source_key=None, header_prefix=None):
+        """
+        逐个产出分块记录（字典，包含 chunk_id、source_key、header_path、page_content、metadata）。
+
+        :param source_key: 只读取该源文件；为 None 时按顺序读取全部源文件。
+        :param header_prefix: 只读取标题路径以该前缀开头的分块。
+        """
+        keys = [source_key] if source_key else self.iter_sources()
+        for key in keys:
+            yield from self._iter_source(key, header_prefix=header_prefix)
+
+    def get_chunk(self, chunk_id):
+        """
+        按分块ID读取单个分块记录，不存在时返回 None。
+        """
+        source_key, index = parse_chunk_id(chunk_id)
+        header = self.read_header(source_key)
+        if not header or not 0 <= index < header["count"]:
+            return None
+        return next(self._iter_source(source_key, indices=[index]))
+
+    def iter_documents(self, source_key=None, header_prefix=None):
+        """
+        与 iter_chunks 相同，但产出 LangChain Document 对象（id 为分块ID），供向量库和图谱阶段使用。
+        """
+        from langchain_core.documents import Document
+
+        for record in self.iter_chunks(source_key, header_prefix):
+            yield Document(
+                id=record["chunk_id"],
+                page_content=record["page_content"],
+                metadata=record["metadata"],
+            )
+
+
+def migrate_pickles(store):
+    """
+    将旧版 .pkl 分块文件转换为 .chunks.jsonl，转换成功后删除 .pkl。
+
+    只应对自己生成的 .pkl 文件运行：反序列化 pickle 可能执行任意代码。
+    """
+    import pickle
+
+    converted = 0
+    for root, _, files in os.walk(store.root_dir):
+        for file in files:
+            if not file.endswith(".pkl"):
+                continue
+            pkl_path = os.path.join(root, file)
+            source_key = os.path.splitext(os.path.relpath(pkl_path, store.root_dir))[
+                0
+            ].replace("\\", "/")
+            with open(pkl_path, "rb") as f:
+                chunks = pickle.load(f)
+            store.write_source(source_key, chunks)
+            os.remove(pkl_path)
+            converted += 1
+            print(f"  - 已转换: {pkl_path}")
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="查看分块存储，或转换旧版 .pkl 分块文件。"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="统计各源文件的分块数量")
+    show_parser = subparsers.add_parser("show", help="按分块ID或标题路径前缀查看分块")
+    show_parser.add_argument("--chunk-id", help="分块ID，如 'a/b/c#0'")
+    show_parser.add_argument("--source", help="只查看该源文件（相对路径，不含扩展名）")
+    show_parser.add_argument("--header-prefix", help="标题路径前缀")
+    show_parser.add_argument("--limit", type=int, default=3, help="最多显示的分块数")
+    subparsers.add_parser("migrate", help="将旧版 .pkl 分块文件转换为 .chunks.jsonl")
+    args = parser.parse_args()
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    store = ChunkStore.open_default(PROJECT_ROOT)
+
+    if args.command == "migrate":
+        converted = migrate_pickles(store)
+        print(f"共转换了 {converted} 个 .pkl 文件。")
+    elif args.command == "stats":
+        total = 0
+        for source_key in store.iter_sources():
+            count = store.count(source_key)
+            total += count
+            print(f"{count:6d}  {source_key}")
+        print(f"共 {total} 个分块。")
+    else:
+        if args.chunk_id:
+            records = [store.get_chunk(args.chunk_id)]
+        else:
+            records = store.iter_chunks(args.source, args.header_prefix)
+        for shown, record in enumerate(records):
+            if record is None or shown >= args.limit:
+                break
+            print(f"\n--- {record['chunk_id']} ---")
+            print(f"标题路径: {record['header_path']}")
+            print(f"元数据: {record['metadata']}")
+            preview = record["page_content"][:300]
+            print(preview + "..." if len(record["page_content"]) > 300 else preview)
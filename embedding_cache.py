@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from llm_utils import call_with_retry, estimate_tokens
+from sqlite_cache import (
+    SQLiteCache,
+    build_cli_parser,
+    format_lookups,
+    run_cli_command,
+)
+
+# 向量缓存目录，存放在 knowledge_base 目录下
+CACHE_DIRNAME = "embedding_cache"
+INDEX_FILENAME = "index.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key         TEXT PRIMARY KEY,
+    model       TEXT NOT NULL,
+    dimensions  INTEGER NOT NULL,
+    row         INTEGER NOT NULL,
+    created_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_model ON embeddings (model);
+"""
+
+
+def make_embedding_key(model, dimensions, text):
+    """
+    根据模型、向量维度和文本计算缓存键，任意一项变化都会得到不同的键。
+    """
+    payload = json.dumps([model, dimensions, text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(SQLiteCache):
+    """
+    文本向量的持久化缓存。
+
+    向量按维度分别追加写入 float32 二进制文件 (vectors_<维度>.f32)，读取时通过
+    numpy.memmap 按行号取出；SQLite 索引只保存缓存键到行号的映射，体积很小。
+    """
+
+    SCHEMA = _SCHEMA
+    ENTRY_TABLE = "embeddings"
+    DEFAULT_NAME = CACHE_DIRNAME
+
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: 缓存目录，包含 SQLite 索引和各维度的向量文件。
+        """
+        self.cache_dir = cache_dir
+        # 检索服务和 06 号脚本可能同时写入，等待其他进程释放写锁的时间放宽到 30 秒
+        super().__init__(os.path.join(cache_dir, INDEX_FILENAME), timeout=30)
+        # 各维度向量文件的内存映射，文件增长后重新映射
+        self._maps = {}
+
+    def close(self):
+        with self._lock:
+            self._maps.clear()
+            super().close()
+
+    def _vector_path(self, dimensions):
+        return os.path.join(self.cache_dir, f"vectors_{dimensions}.f32")
+
+    def _read_rows_locked(self, dimensions, rows):
+        mapped = self._maps.get(dimensions)
+        if mapped is None or max(rows) >= mapped.shape[0]:
+            path = self._vector_path(dimensions)
+            total_rows = os.path.getsize(path) // (4 * dimensions)
+            mapped = np.memmap(
+                path, dtype=np.float32, mode="r", shape=(total_rows, dimensions)
+            )
+            self._maps[dimensions] = mapped
+        return mapped[rows]
+
+    def get_many(self, keys):
+        """
+        批量读取缓存的向量。
+
+        :param keys: 缓存键列表。
+        :return: 与 keys 等长的列表，未命中的位置为 None。
+        """
+        results = [None] * len(keys)
+        with self._lock, self._conn:
+            positions = {}
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for row in self._conn.execute(
+                    f"SELECT key, dimensions, row FROM embeddings "
+                    f"WHERE key IN ({placeholders})",
+                    batch,
+                ):
+                    positions[row["key"]] = (row["dimensions"], row["row"])
+
+            by_dimensions = {}
+            for index, key in enumerate(keys):
+                if key in positions:
+                    dimensions, row = positions[key]
+                    by_dimensions.setdefault(dimensions, []).append((index, row))
+            for dimensions, items in by_dimensions.items():
+                vectors = self._read_rows_locked(dimensions, [row for _, row in items])
+                for (index, _), vector in zip(items, vectors):
+                    results[index] = vector.tolist()
+
+            hit_count = sum(result is not None for result in results)
+            self._record_lookups(hit_count, len(keys) - hit_count)
+        return results
+
+    def put_many(self, model, items):
+        """
+        批量写入向量：先追加到向量文件，再写入索引。
+
+        追加和写索引在同一个 SQLite 写事务 (BEGIN IMMEDIATE) 中进行，多个进程共享缓存时
+        追加操作也是串行的，行号由加锁后的文件大小计算。中断时最多留下未被索引的完整行，
+        以及文件末尾不完整的一行；后者在下次追加前被截掉，不会使之后的行号错位。
+
+        :param model: 生成向量的模型名称（用于按模型清除缓存）。
+        :param items: (缓存键, 向量) 列表。
+        """
+        by_dimensions = {}
+        for key, vector in items:
+            by_dimensions.setdefault(len(vector), []).append((key, vector))
+
+        now = time.time()
+        with self._lock, self._conn:
+            # 先取得数据库写锁，其他进程的追加会在这里等待
+            self._conn.execute("BEGIN IMMEDIATE")
+            for dimensions, group in by_dimensions.items():
+                path = self._vector_path(dimensions)
+                row_bytes = 4 * dimensions
+                # 追加前释放旧的内存映射（Windows 上映射中的文件不能扩展）
+                self._maps.pop(dimensions, None)
+                with open(path, "ab") as f:
+                    size = f.seek(0, os.SEEK_END)
+                    if size % row_bytes:
+                        # 上次写入中断留下的半行，截断到行边界
+                        size -= size % row_bytes
+                        f.truncate(size)
+                    first_row = size // row_bytes
+                    f.write(
+                        np.asarray([v for _, v in group], dtype=np.float32).tobytes()
+                    )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings "
+                    "(key, model, dimensions, row, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (key, model, dimensions, first_row + offset, now)
+                        for offset, (key, _) in enumerate(group)
+                    ],
+                )
+
+    def _after_invalidate(self, model):
+        # 按模型清除时向量文件中的空间不回收；清空全部缓存时删除向量文件
+        if model is not None:
+            return
+        self._maps.clear()
+        for file in os.listdir(self.cache_dir):
+            if file.startswith("vectors_") and file.endswith(".f32"):
+                os.remove(os.path.join(self.cache_dir, file))
+
+    def stats(self):
+        """
+        返回缓存的条目数、向量文件总大小，以及本进程和累计的命中/未命中次数。
+        """
+        with self._lock:
+            stats = super().stats()
+            stats["total_bytes"] = sum(
+                os.path.getsize(os.path.join(self.cache_dir, file))
+                for file in os.listdir(self.cache_dir)
+                if file.endswith(".f32")
+            )
+            return stats
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    在任意 LangChain Embeddings 前加一层持久化缓存，可直接作为 Chroma 的 embedding_function。
+
+    文档向量和查询向量共用同一缓存（智谱 embedding-3 对两者的处理相同），
+    只有未命中的文本才会调用底层接口，同一批次中重复的文本只请求一次。
+    配置了限流器时，只有实际调用接口的请求才占用配额；多个线程可以共享同一实例。
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        cache,
+        model=None,
+        dimensions=None,
+        limiter=None,
+        max_attempts=1,
+    ):
+        """
+        :param embeddings: 底层的 Embeddings 实例，如 ZhipuAIEmbeddings。
+        :param cache: EmbeddingCache 实例。
+        :param model: 参与缓存键计算的模型名称，默认读取 embeddings.model。
+        :param dimensions: 参与缓存键计算的向量维度，默认读取 embeddings.dimensions。
+        :param limiter: 可选的 RateLimiter，调用底层接口前获取配额。
+        :param max_attempts: 调用底层接口失败时的最大尝试次数。
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+        self.dimensions = dimensions or getattr(embeddings, "dimensions", None)
+        # 本进程内实际调用底层接口的次数和文本数
+        self.api_calls = 0
+        self.embedded_texts = 0
+        self._stats_lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        keys = [make_embedding_key(self.model, self.dimensions, t) for t in texts]
+        vectors = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        if missing:
+            missing_texts = list(missing.values())
+            new_vectors = call_with_retry(
+                lambda: self.embeddings.embed_documents(missing_texts),
+                max_attempts=self.max_attempts,
+                limiter=self.limiter,
+                tokens=sum(estimate_tokens(t) for t in missing_texts),
+            )
+            with self._stats_lock:
+                self.api_calls += 1
+                self.embedded_texts += len(missing)
+            computed = dict(zip(missing, new_vectors))
+            self.cache.put_many(self.model, list(computed.items()))
+            vectors = [
+                computed[key] if vector is None else vector
+                for key, vector in zip(keys, vectors)
+            ]
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def format_stats(stats):
+    """
+    将 stats() 的结果格式化为一行便于打印的摘要。
+    """
+    return (
+        f"向量缓存 {stats['entries']} 条，"
+        f"占用 {stats['total_bytes'] / 1024 / 1024:.1f} MB；" + format_lookups(stats)
+    )
+
+
+if __name__ == "__main__":
+    parser, _ = build_cli_parser("查看或清理文本向量缓存。")
+    args = parser.parse_args()
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    with EmbeddingCache.open_default(PROJECT_ROOT) as cache:
+        run_cli_command(cache, args)
+        print(format_stats(cache.stats()))
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import hashlib
+
+from sqlite_cache import (
+    SQLiteCache,
+    build_cli_parser,
+    format_lookups,
+    run_cli_command,
+)
+
+# 图谱抽取缓存数据库文件名，存放在 knowledge_base 目录下
+CACHE_FILENAME = "graph_extraction_cache.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    key         TEXT PRIMARY KEY,
+    model       TEXT NOT NULL,
+    chunk_id    TEXT,
+    graph       TEXT NOT NULL,
+    created_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_extractions_model ON extractions (model);
+CREATE TABLE IF NOT EXISTS written (
+    target      TEXT NOT NULL,
+    chunk_id    TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    written_at  REAL NOT NULL,
+    PRIMARY KEY (target, chunk_id)
+);
+"""
+
+
+def make_extraction_key(settings, text):
+    """
+    根据抽取参数（模型、温度、Graph Transformer 配置）和分块文本计算缓存键，
+    任意一项变化都会得到不同的键。
+    """
+    payload = json.dumps([settings, text], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _node_to_dict(node):
+    return {"id": node.id, "type": node.type, "properties": dict(node.properties)}
+
+
+def graph_document_to_dict(graph_document):
+    """
+    将 GraphDocument 的节点和关系转换为可 JSON 序列化的字典（不含来源文档）。
+    """
+    return {
+        "nodes": [_node_to_dict(node) for node in graph_document.nodes],
+        "relationships": [
+            {
+                "source": _node_to_dict(rel.source),
+                "target": _node_to_dict(rel.target),
+                "type": rel.type,
+                "properties": dict(rel.properties),
+            }
+            for rel in graph_document.relationships
+        ],
+    }
+
+
+def graph_document_from_dict(data, source):
+    """
+    由 graph_document_to_dict 的结果重建 GraphDocument。
+
+    :param data: 节点和关系字典。
+    :param source: 来源文档块 (Document)，写入图谱时用于关联分块。
+    """
+    from langchain_community.graphs.graph_document import (
+        GraphDocument,
+        Node,
+        Relationship,
+    )
+
+    return GraphDocument(
+        nodes=[Node(**node) for node in data["nodes"]],
+        relationships=[
+            Relationship(
+                source=Node(**rel["source"]),
+                target=Node(**rel["target"]),
+                type=rel["type"],
+                properties=rel["properties"],
+            )
+            for rel in data["relationships"]
+        ],
+        source=source,
+    )
+
+
+class GraphExtractionCache(SQLiteCache):
+    """
+    基于 SQLite 的图谱抽取缓存和写入检查点。
+
+    extractions 表以 make_extraction_key 计算的哈希为键，保存每个分块抽取出的节点和关系；
+    written 表按图数据库（target）记录已写入的分块及其抽取键，重新运行时已写入且内容未变化的
+    分块直接跳过，已抽取但未写入的分块从缓存重放，只有失败或新增的分块才调用大模型。
+    """
+
+    SCHEMA = _SCHEMA
+    ENTRY_TABLE = "extractions"
+    DEFAULT_NAME = CACHE_FILENAME
+
+    def get(self, key):
+        """
+        读取缓存的抽取结果（graph_document_to_dict 的格式），未命中时返回 None。
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT graph FROM extractions WHERE key = ?", (key,)
+            ).fetchone()
+            self._record_lookups(int(row is not None), int(row is None))
+            return None if row is None else json.loads(row["graph"])
+
+    def put(self, key, model, chunk_id, graph):
+        """
+        写入一个分块的抽取结果。
+
+        :param graph: graph_document_to_dict 的结果。
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions "
+                "(key, model, chunk_id, graph, created_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    model,
+                    chunk_id,
+                    json.dumps(graph, ensure_ascii=False),
+                    time.time(),
+                ),
+            )
+
+    def written_key(self, target, chunk_id):
+        """
+        返回分块写入图数据库时使用的抽取键，尚未写入时返回 None。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key FROM written WHERE target = ? AND chunk_id = ?",
+                (target, chunk_id),
+            ).fetchone()
+            return row["key"] if row else None
+
+    def mark_written(self, target, items):
+        """
+        记录已成功写入图数据库的分块。
+
+        :param target: 图数据库标识（如连接地址加数据库名）。
+        :param items: (分块ID, 抽取键) 列表。
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO written (target, chunk_id, key, written_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(target, chunk_id, key, now) for chunk_id, key in items],
+            )
+
+    def reset_checkpoint(self, target=None):
+        """
+        清除写入检查点（如清空了图数据库后），抽取缓存保留。
+
+        :param target: 只清除该图数据库的检查点；为 None 时全部清除。
+        :return: 删除的记录数。
+        """
+        with self._lock, self._conn:
+            if target is None:
+                return self._conn.execute("DELETE FROM written").rowcount
+            return self._conn.execute(
+                "DELETE FROM written WHERE target = ?", (target,)
+            ).rowcount
+
+    def stats(self):
+        """
+        返回缓存的条目数、各图数据库已写入的分块数，以及本进程和累计的命中/未命中次数。
+        """
+        with self._lock:
+            stats = super().stats()
+            stats["written"] = dict(
+                self._conn.execute(
+                    "SELECT target, COUNT(*) FROM written GROUP BY target"
+                ).fetchall()
+            )
+            return stats
+
+
+def format_stats(stats):
+    """
+    将 stats() 的结果格式化为便于打印的摘要。
+    """
+    lines = [f"抽取缓存 {stats['entries']} 条；" + format_lookups(stats)]
+    for target, count in stats["written"].items():
+        lines.append(f"  已写入 {target}: {count} 个分块")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser, subparsers = build_cli_parser("查看或清理图谱抽取缓存和写入检查点。")
+    reset_parser = subparsers.add_parser(
+        "reset-checkpoint", help="清除写入检查点（清空图数据库后使用）"
+    )
+    reset_parser.add_argument("--target", help="只清除该图数据库的检查点")
+    args = parser.parse_args()
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    with GraphExtractionCache.open_default(PROJECT_ROOT) as cache:
+        run_cli_command(cache, args)
+        if args.command == "reset-checkpoint":
+            removed = cache.reset_checkpoint(args.target)
+            print(f"已清除 {removed} 条写入记录。")
+        print(format_stats(cache.stats()))
@@ -0,0 +1,546 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+import numpy as np
+
+from graph_writer import BASE_ENTITY_LABEL, DOCUMENT_LABEL, MENTIONS_TYPE, GraphBatch
+
+# 本地图谱数据库文件名，存放在 knowledge_base/04_database 目录下
+STORE_FILENAME = "05_graph_store.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    key         INTEGER PRIMARY KEY,
+    id          TEXT NOT NULL UNIQUE,
+    labels      TEXT NOT NULL,
+    properties  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS relationships (
+    source      INTEGER NOT NULL,
+    type        TEXT NOT NULL,
+    target      INTEGER NOT NULL,
+    properties  TEXT NOT NULL,
+    PRIMARY KEY (source, type, target)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_relationships_target ON relationships (target);
+CREATE TABLE IF NOT EXISTS documents (
+    key         INTEGER PRIMARY KEY,
+    id          TEXT NOT NULL UNIQUE,
+    text        TEXT NOT NULL,
+    metadata    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mentions (
+    document    INTEGER NOT NULL,
+    node        INTEGER NOT NULL,
+    PRIMARY KEY (document, node)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_mentions_node ON mentions (node);
+"""
+
+# SQLite 单条语句的参数个数有上限，IN 查询按此分批
+_IN_BATCH_SIZE = 500
+
+
+def _csv_value(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def _csv_header(key, values):
+    """
+    带 neo4j-admin 类型后缀的属性列名，与驱动写入 Python 值时使用的类型一致：
+    bool 为 boolean，int 为 long，含小数的数值为 double，其余（字符串、列表、字典）为字符串。
+    """
+    types = {type(value) for value in values if value is not None}
+    if types == {bool}:
+        return f"{key}:boolean"
+    if types == {int}:
+        return f"{key}:long"
+    if types and types <= {int, float}:
+        return f"{key}:double"
+    return key
+
+
+def _property_columns(properties_list):
+    """
+    收集一组属性字典的全部键，返回 (键列表, CSV 列名列表)。
+    """
+    keys = sorted({k for properties in properties_list for k in properties})
+    return keys, [
+        _csv_header(k, [properties.get(k) for properties in properties_list])
+        for k in keys
+    ]
+
+
+class SQLiteGraphStore:
+    """
+    基于 SQLite 的嵌入式图谱存储，可替代 Neo4j 作为 07 号脚本的写入目标。
+
+    保存与 add_graph_documents(baseEntityLabel=True, include_source=True) 相同的内容：
+    按 id 合并的实体节点、实体之间的关系、来源分块 (Document) 以及分块到实体的 MENTIONS 关联。
+    节点和分块以整数键互相引用，邻居查询走索引；多跳扩展使用按需构建的 CSR 邻接数组
+    (indptr / indices)，每一跳是一次向量化的数组运算。不需要任何服务端，读写都是本地磁盘速度；
+    可导出为 neo4j-admin import 使用的 CSV，批量导入 Neo4j。
+    """
+
+    def __init__(self, db_path):
+        """
+        :param db_path: SQLite 数据库文件路径。
+        """
+        self.db_path = db_path
+        # 写入检查点按此区分图谱存储
+        self.target = "sqlite:" + os.path.abspath(db_path)
+        self.totals = {"nodes": 0, "relationships": 0, "documents": 0, "seconds": 0.0}
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # 允许跨线程共享连接，并用锁串行化访问
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        # CSR 邻接数组，写入后失效，下次多跳扩展时重建
+        self._adjacency = None
+
+    @classmethod
+    def open_default(cls, project_root, kb_dir="knowledge_base"):
+        """
+        打开项目默认位置的图谱存储 (knowledge_base/04_database/05_graph_store.sqlite3)。
+        """
+        return cls(os.path.join(project_root, kb_dir, "04_database", STORE_FILENAME))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def _select_in(self, query, values):
+        for start in range(0, len(values), _IN_BATCH_SIZE):
+            batch = values[start : start + _IN_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            yield from self._conn.execute(query.format(placeholders), batch)
+
+    def _keys_for(self, table, ids):
+        return {
+            row["id"]: row["key"]
+            for row in self._select_in(
+                f"SELECT key, id FROM {table} WHERE id IN ({{}})", list(ids)
+            )
+        }
+
+    def _upsert_nodes(self, nodes):
+        # 与已有节点合并：标签取并集，属性以新值覆盖
+        merged = {
+            node_id: (set(entry["labels"]), dict(entry["properties"]))
+            for node_id, entry in nodes.items()
+        }
+        for row in self._select_in(
+            "SELECT id, labels, properties FROM nodes WHERE id IN ({})", list(nodes)
+        ):
+            labels, properties = merged[row["id"]]
+            labels.update(json.loads(row["labels"]))
+            merged[row["id"]] = (
+                labels,
+                {**json.loads(row["properties"]), **properties},
+            )
+        self._conn.executemany(
+            "INSERT INTO nodes (id, labels, properties) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET "
+            "labels = excluded.labels, properties = excluded.properties",
+            [
+                (
+                    node_id,
+                    json.dumps(sorted(labels), ensure_ascii=False),
+                    json.dumps(properties, ensure_ascii=False),
+                )
+                for node_id, (labels, properties) in merged.items()
+            ],
+        )
+        return self._keys_for("nodes", nodes)
+
+    def write(self, graph_documents):
+        """
+        合并并写入一批图文档（在一个事务中完成）。
+
+        :param graph_documents: GraphDocument 列表。
+        :return: 本次写入的 {"nodes", "relationships", "documents"} 数量（去重后）。
+        """
+        batch = GraphBatch()
+        for graph_document in graph_documents:
+            batch.add(graph_document)
+
+        with self._lock, self._conn:
+            started_at = time.perf_counter()
+            node_keys = self._upsert_nodes(batch.nodes)
+            self._conn.executemany(
+                "INSERT INTO relationships (source, type, target, properties) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (source, type, target) DO UPDATE SET "
+                "properties = json_patch(relationships.properties, excluded.properties)",
+                [
+                    (
+                        node_keys[source],
+                        rel_type,
+                        node_keys[target],
+                        json.dumps(properties, ensure_ascii=False),
+                    )
+                    for (source, rel_type, target), properties in (
+                        batch.relationships.items()
+                    )
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO documents (id, text, metadata) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET "
+                "text = excluded.text, metadata = excluded.metadata",
+                [
+                    (
+                        doc_id,
+                        properties["text"],
+                        json.dumps(
+                            {
+                                k: v
+                                for k, v in properties.items()
+                                if k not in ("id", "text")
+                            },
+                            ensure_ascii=False,
+                        ),
+                    )
+                    for doc_id, properties in batch.documents.items()
+                ],
+            )
+            document_keys = self._keys_for("documents", batch.documents)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO mentions (document, node) VALUES (?, ?)",
+                [
+                    (document_keys[doc_id], node_keys[node_id])
+                    for doc_id, node_id in batch.mentions
+                ],
+            )
+            self._adjacency = None
+
+            written = {
+                "nodes": len(batch.nodes),
+                "relationships": len(batch.relationships),
+                "documents": len(batch.documents),
+            }
+            for name, count in written.items():
+                self.totals[name] += count
+            self.totals["seconds"] += time.perf_counter() - started_at
+        return written
+
+    def format_stats(self):
+        """
+        本进程累计写入量和吞吐量的摘要。
+        """
+        totals = self.totals
+        seconds = totals["seconds"] or float("inf")
+        return (
+            f"图谱写入 {totals['nodes']} 个节点、{totals['relationships']} 个关系、"
+            f"{totals['documents']} 个分块，用时 {totals['seconds']:.1f} 秒"
+            f"（{totals['nodes'] / seconds:.0f} 节点/秒）。"
+        )
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    def stats(self):
+        """
+        返回节点、关系、分块和 MENTIONS 关联的数量。
+        """
+        with self._lock:
+            return {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("nodes", "relationships", "documents", "mentions")
+            }
+
+    def get_node(self, node_id):
+        """
+        按 id 读取实体节点 ({"id", "labels", "properties"})，不存在时返回 None。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, labels, properties FROM nodes WHERE id = ?", (node_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "labels": json.loads(row["labels"]),
+            "properties": json.loads(row["properties"]),
+        }
+
+    def neighbors(self, node_id, direction="both", rel_type=None, limit=None):
+        """
+        查询实体的直接邻居。
+
+        :param node_id: 实体 id。
+        :param direction: "out"（出边）、"in"（入边）或 "both"。
+        :param rel_type: 只返回该类型的关系，为 None 时不限制。
+        :param limit: 最多返回的邻居数。
+        :return: [{"id", "labels", "type", "direction", "properties"}] 列表，
+            properties 为关系的属性。
+        """
+        queries = []
+        if direction in ("out", "both"):
+            queries.append(("out", "r.source", "r.target"))
+        if direction in ("in", "both"):
+            queries.append(("in", "r.target", "r.source"))
+        type_filter = " AND r.type = ?" if rel_type else ""
+        results = []
+        with self._lock:
+            for label, this_end, other_end in queries:
+                params = [node_id] + ([rel_type] if rel_type else [])
+                for row in self._conn.execute(
+                    f"SELECT n.id, n.labels, r.type, r.properties "
+                    f"FROM nodes AS self "
+                    f"JOIN relationships AS r ON {this_end} = self.key "
+                    f"JOIN nodes AS n ON n.key = {other_end} "
+                    f"WHERE self.id = ?{type_filter}",
+                    params,
+                ):
+                    results.append(
+                        {
+                            "id": row["id"],
+                            "labels": json.loads(row["labels"]),
+                            "type": row["type"],
+                            "direction": label,
+                            "properties": json.loads(row["properties"]),
+                        }
+                    )
+        return results[:limit] if limit else results
+
+    def documents_mentioning(self, node_id):
+        """
+        返回提到该实体的来源分块 [{"id", "text", "metadata"}]。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT d.id, d.text, d.metadata FROM nodes AS n "
+                "JOIN mentions AS m ON m.node = n.key "
+                "JOIN documents AS d ON d.key = m.document WHERE n.id = ?",
+                (node_id,),
+            ).fetchall()
+        return [
+            {
+                "id": row["id"],
+                "text": row["text"],
+                "metadata": json.loads(row["metadata"]),
+            }
+            for row in rows
+        ]
+
+    def _build_adjacency(self):
+        """
+        由关系表构建无向 CSR 邻接数组：节点键 k 的邻居为 indices[indptr[k]:indptr[k + 1]]。
+        """
+        edges = np.array(
+            self._conn.execute("SELECT source, target FROM relationships").fetchall(),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        size = (
+            self._conn.execute("SELECT COALESCE(MAX(key), 0) FROM nodes").fetchone()[0]
+            + 1
+        )
+        sources = np.concatenate([edges[:, 0], edges[:, 1]])
+        targets = np.concatenate([edges[:, 1], edges[:, 0]])
+        order = np.argsort(sources, kind="stable")
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=size), out=indptr[1:])
+        return indptr, targets[order]
+
+    def expand(self, node_ids, hops=1):
+        """
+        从一组实体出发，沿关系（不分方向）扩展 hops 跳，返回到达的全部实体 id（含起点）。
+        """
+        with self._lock:
+            if self._adjacency is None:
+                self._adjacency = self._build_adjacency()
+            indptr, indices = self._adjacency
+            start_keys = list(self._keys_for("nodes", list(node_ids)).values())
+
+            visited = np.zeros(len(indptr) - 1, dtype=bool)
+            frontier = np.asarray(start_keys, dtype=np.int64)
+            visited[frontier] = True
+            for _ in range(hops):
+                if not len(frontier):
+                    break
+                starts, ends = indptr[frontier], indptr[frontier + 1]
+                counts = ends - starts
+                # 把各节点邻居区间 [start, end) 拼接成一个下标数组，一次取出全部邻居
+                offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+                reached = indices[offsets + np.arange(counts.sum())]
+                frontier = np.unique(reached[~visited[reached]])
+                visited[frontier] = True
+
+            keys = np.flatnonzero(visited).tolist()
+            return [
+                row["id"]
+                for row in self._select_in(
+                    "SELECT id FROM nodes WHERE key IN ({})", keys
+                )
+            ]
+
+    # ------------------------------------------------------------------
+    # 导出
+    # ------------------------------------------------------------------
+    def export_csv(self, output_dir):
+        """
+        导出为 neo4j-admin database import 使用的 CSV 文件（实体和分块使用不同的 ID 空间）。
+
+        :param output_dir: 输出目录。
+        :return: neo4j-admin 导入命令。导入完成后可运行 graph_writer.py schema 创建唯一约束。
+        """
+        os.makedirs(output_dir, exist_ok=True)
+
+        def write_csv(name, header, rows):
+            path = os.path.join(output_dir, name)
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(rows)
+            return path
+
+        with self._lock:
+            node_rows = [
+                (row["id"], json.loads(row["labels"]), json.loads(row["properties"]))
+                for row in self._conn.execute(
+                    "SELECT id, labels, properties FROM nodes"
+                )
+            ]
+            node_keys, node_columns = _property_columns(
+                [
+                    {k: v for k, v in props.items() if k != "id"}
+                    for _, _, props in node_rows
+                ]
+            )
+            nodes_path = write_csv(
+                "nodes.csv",
+                ["id:ID(Entity)", ":LABEL"] + node_columns,
+                (
+                    [node_id, ";".join([BASE_ENTITY_LABEL] + labels)]
+                    + [_csv_value(props.get(k)) for k in node_keys]
+                    for node_id, labels, props in node_rows
+                ),
+            )
+
+            document_rows = [
+                (row["id"], row["text"], json.loads(row["metadata"]))
+                for row in self._conn.execute(
+                    "SELECT id, text, metadata FROM documents"
+                )
+            ]
+            metadata_keys, metadata_columns = _property_columns(
+                [metadata for _, _, metadata in document_rows]
+            )
+            documents_path = write_csv(
+                "documents.csv",
+                ["id:ID(Document)", ":LABEL", "text"] + metadata_columns,
+                (
+                    [doc_id, DOCUMENT_LABEL, text]
+                    + [_csv_value(metadata.get(k)) for k in metadata_keys]
+                    for doc_id, text, metadata in document_rows
+                ),
+            )
+
+            rel_rows = [
+                (
+                    row["source"],
+                    row["type"],
+                    row["target"],
+                    json.loads(row["properties"]),
+                )
+                for row in self._conn.execute(
+                    "SELECT s.id AS source, r.type, t.id AS target, r.properties "
+                    "FROM relationships AS r "
+                    "JOIN nodes AS s ON s.key = r.source "
+                    "JOIN nodes AS t ON t.key = r.target"
+                )
+            ]
+            rel_keys, rel_columns = _property_columns(
+                [props for _, _, _, props in rel_rows]
+            )
+            relationships_path = write_csv(
+                "relationships.csv",
+                [":START_ID(Entity)", ":TYPE", ":END_ID(Entity)"] + rel_columns,
+                (
+                    [source, rel_type, target]
+                    + [_csv_value(props.get(k)) for k in rel_keys]
+                    for source, rel_type, target, props in rel_rows
+                ),
+            )
+
+            mentions_path = write_csv(
+                "mentions.csv",
+                [":START_ID(Document)", ":TYPE", ":END_ID(Entity)"],
+                (
+                    [row["document"], MENTIONS_TYPE, row["node"]]
+                    for row in self._conn.execute(
+                        "SELECT d.id AS document, n.id AS node FROM mentions AS m "
+                        "JOIN documents AS d ON d.key = m.document "
+                        "JOIN nodes AS n ON n.key = m.node"
+                    )
+                ),
+            )
+
+        # 分块正文中含有换行，必须开启 --multiline-fields
+        return (
+            "neo4j-admin database import full --multiline-fields=true "
+            f"--nodes={nodes_path} --nodes={documents_path} "
+            f"--relationships={relationships_path} --relationships={mentions_path} "
+            "neo4j"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查询或导出本地图谱存储。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="统计节点、关系和分块数量")
+    neighbors_parser = subparsers.add_parser("neighbors", help="查询实体的邻居")
+    neighbors_parser.add_argument("node_id", help="实体 id")
+    neighbors_parser.add_argument(
+        "--direction", choices=["out", "in", "both"], default="both"
+    )
+    neighbors_parser.add_argument("--type", help="只查询该类型的关系")
+    neighbors_parser.add_argument(
+        "--hops", type=int, default=1, help="大于 1 时列出多跳范围内的全部实体"
+    )
+    export_parser = subparsers.add_parser(
+        "export-csv", help="导出为 neo4j-admin import 使用的 CSV"
+    )
+    export_parser.add_argument("output_dir", help="输出目录")
+    args = parser.parse_args()
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    with SQLiteGraphStore.open_default(PROJECT_ROOT) as store:
+        if args.command == "stats":
+            print(store.stats())
+        elif args.command == "export-csv":
+            command = store.export_csv(args.output_dir)
+            print(f"已导出到 {args.output_dir}，导入命令：\n{command}")
+        elif args.hops > 1:
+            reached = store.expand([args.node_id], args.hops)
+            print(f"{args.hops} 跳范围内共 {len(reached)} 个实体：")
+            for node_id in reached:
+                print(f"  {node_id}")
+        else:
+            for neighbor in store.neighbors(args.node_id, args.direction, args.type):
+                arrow = "->" if neighbor["direction"] == "out" else "<-"
+                print(
+                    f"  {arrow} [{neighbor['type']}] {neighbor['id']} {neighbor['labels']}"
+                )
@@ -0,0 +1,417 @@
+import os
+import sys
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+
+# 单条 UNWIND 语句（一个事务）写入的最大行数
+ROWS_PER_QUERY = 5000
+
+# 与 Neo4jGraph.add_graph_documents(baseEntityLabel=True, include_source=True) 相同的图模型：
+# 实体节点都带 __Entity__ 标签并按 id 合并，分块保存为 Document 节点，通过 MENTIONS 关联实体
+BASE_ENTITY_LABEL = "__Entity__"
+DOCUMENT_LABEL = "Document"
+MENTIONS_TYPE = "MENTIONS"
+
+# 不指定约束名，与 add_graph_documents 创建的约束等价，已存在时 IF NOT EXISTS 不做任何操作
+_SCHEMA_STATEMENTS = (
+    f"CREATE CONSTRAINT IF NOT EXISTS "
+    f"FOR (n:{BASE_ENTITY_LABEL}) REQUIRE n.id IS UNIQUE",
+    f"CREATE CONSTRAINT IF NOT EXISTS "
+    f"FOR (d:{DOCUMENT_LABEL}) REQUIRE d.id IS UNIQUE",
+)
+
+
+def _quote(name):
+    """
+    将标签或关系类型转为 Cypher 中可用的反引号标识符（标签和类型不能作为参数传递）。
+    """
+    return "`" + str(name).replace("`", "") + "`"
+
+
+def document_id(document):
+    """
+    来源分块在图谱中的 ID：优先使用元数据中的 id，否则为正文的 MD5（与 add_graph_documents 一致）。
+    """
+    return (
+        document.metadata.get("id")
+        or hashlib.md5(document.page_content.encode("utf-8")).hexdigest()
+    )
+
+
+class GraphBatch:
+    """
+    在客户端合并多个 GraphDocument 的节点、关系和来源分块。
+
+    同一 id 的节点只保留一行（标签取并集、属性合并），同一 (起点, 类型, 终点) 的关系只保留一条，
+    写入时每种标签组合、每种关系类型各用一条 UNWIND 语句。
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.relationships = {}
+        self.documents = {}
+        self.mentions = set()
+
+    def __len__(self):
+        return len(self.nodes) + len(self.relationships)
+
+    def _add_node(self, node):
+        entry = self.nodes.setdefault(node.id, {"labels": set(), "properties": {}})
+        if node.type:
+            entry["labels"].add(node.type)
+        entry["properties"].update(node.properties or {})
+
+    def add(self, graph_document, include_source=True):
+        for node in graph_document.nodes:
+            self._add_node(node)
+        for rel in graph_document.relationships:
+            self._add_node(rel.source)
+            self._add_node(rel.target)
+            key = (rel.source.id, rel.type, rel.target.id)
+            self.relationships.setdefault(key, {}).update(rel.properties or {})
+
+        source = graph_document.source
+        if include_source and source is not None:
+            doc_id = document_id(source)
+            self.documents[doc_id] = dict(
+                source.metadata, text=source.page_content, id=doc_id
+            )
+            self.mentions.update((doc_id, node.id) for node in graph_document.nodes)
+
+    def node_groups(self):
+        """
+        按标签组合分组的节点行：{(标签, ...): [{"id", "properties"}]}。
+        """
+        groups = {}
+        for node_id, entry in self.nodes.items():
+            groups.setdefault(tuple(sorted(entry["labels"])), []).append(
+                {"id": node_id, "properties": entry["properties"]}
+            )
+        return groups
+
+    def relationship_groups(self):
+        """
+        按关系类型分组的关系行：{类型: [{"source", "target", "properties"}]}。
+        """
+        groups = {}
+        for (source, rel_type, target), properties in self.relationships.items():
+            groups.setdefault(rel_type, []).append(
+                {"source": source, "target": target, "properties": properties}
+            )
+        return groups
+
+
+class Neo4jBulkWriter:
+    """
+    以大批量参数化 UNWIND/MERGE 语句写入图文档，替代逐批调用 add_graph_documents。
+
+    第一次写入前创建唯一约束（实体和 Document 的 id），并为新出现的实体标签创建 id 索引，
+    MERGE 查找始终走索引，写入速度不随图谱规模下降。可在多个线程间共享，写入串行执行。
+    """
+
+    def __init__(self, graph, rows_per_query=ROWS_PER_QUERY, include_source=True):
+        """
+        :param graph: Neo4jGraph 实例（或任何提供 query(cypher, params) 的对象）。
+        :param rows_per_query: 单条语句写入的最大行数。
+        :param include_source: 是否写入来源分块 (Document) 及其 MENTIONS 关系。
+        """
+        self.graph = graph
+        self.rows_per_query = rows_per_query
+        self.include_source = include_source
+        self.totals = {
+            "nodes": 0,
+            "relationships": 0,
+            "documents": 0,
+            "queries": 0,
+            "seconds": 0.0,
+        }
+        self._schema_ready = False
+        self._indexed_labels = set()
+        self._lock = threading.Lock()
+
+    def ensure_schema(self):
+        """
+        创建唯一约束（已存在时跳过）。
+        """
+        for statement in _SCHEMA_STATEMENTS:
+            self.graph.query(statement)
+        self._schema_ready = True
+
+    def _ensure_label_indexes(self, labels):
+        for label in sorted(set(labels) - self._indexed_labels):
+            self.graph.query(
+                f"CREATE INDEX IF NOT EXISTS FOR (n:{_quote(label)}) ON (n.id)"
+            )
+            self._indexed_labels.add(label)
+
+    def _run(self, query, rows):
+        for start in range(0, len(rows), self.rows_per_query):
+            self.graph.query(query, {"rows": rows[start : start + self.rows_per_query]})
+            self.totals["queries"] += 1
+
+    def write(self, graph_documents):
+        """
+        合并并写入一批图文档。
+
+        :param graph_documents: GraphDocument 列表。
+        :return: 本次写入的 {"nodes", "relationships", "documents"} 数量（去重后）。
+        :raises Exception: 写入失败时抛出（已执行的语句不会回滚，重新写入时 MERGE 保证幂等）。
+        """
+        batch = GraphBatch()
+        for graph_document in graph_documents:
+            batch.add(graph_document, self.include_source)
+
+        with self._lock:
+            started_at = time.perf_counter()
+            if not self._schema_ready:
+                self.ensure_schema()
+            node_groups = batch.node_groups()
+            self._ensure_label_indexes(
+                label for labels in node_groups for label in labels
+            )
+
+            for labels, rows in node_groups.items():
+                set_labels = "".join(f" SET n:{_quote(label)}" for label in labels)
+                self._run(
+                    f"UNWIND $rows AS row "
+                    f"MERGE (n:{BASE_ENTITY_LABEL} {{id: row.id}})"
+                    f"{set_labels} SET n += row.properties",
+                    rows,
+                )
+            for rel_type, rows in batch.relationship_groups().items():
+                self._run(
+                    f"UNWIND $rows AS row "
+                    f"MERGE (s:{BASE_ENTITY_LABEL} {{id: row.source}}) "
+                    f"MERGE (t:{BASE_ENTITY_LABEL} {{id: row.target}}) "
+                    f"MERGE (s)-[r:{_quote(rel_type)}]->(t) SET r += row.properties",
+                    rows,
+                )
+            if batch.documents:
+                self._run(
+                    f"UNWIND $rows AS row "
+                    f"MERGE (d:{DOCUMENT_LABEL} {{id: row.id}}) SET d += row",
+                    list(batch.documents.values()),
+                )
+                self._run(
+                    f"UNWIND $rows AS row "
+                    f"MATCH (d:{DOCUMENT_LABEL} {{id: row.document}}) "
+                    f"MATCH (n:{BASE_ENTITY_LABEL} {{id: row.node}}) "
+                    f"MERGE (d)-[:{MENTIONS_TYPE}]->(n)",
+                    [
+                        {"document": doc_id, "node": node_id}
+                        for doc_id, node_id in batch.mentions
+                    ],
+                )
+
+            written = {
+                "nodes": len(batch.nodes),
+                "relationships": len(batch.relationships),
+                "documents": len(batch.documents),
+            }
+            for name, count in written.items():
+                self.totals[name] += count
+            self.totals["seconds"] += time.perf_counter() - started_at
+        return written
+
+    def format_stats(self):
+        """
+        累计写入量和吞吐量的摘要。
+        """
+        totals = self.totals
+        seconds = totals["seconds"] or float("inf")
+        return (
+            f"图谱写入 {totals['nodes']} 个节点、{totals['relationships']} 个关系、"
+            f"{totals['documents']} 个分块，{totals['queries']} 条语句，"
+            f"用时 {totals['seconds']:.1f} 秒"
+            f"（{totals['nodes'] / seconds:.0f} 节点/秒，"
+            f"{totals['relationships'] / seconds:.0f} 关系/秒）。"
+        )
+
+
+def make_synthetic_documents(num_entities, entities_per_document=50):
+    """
+    生成用于压测的图文档：每个文档块包含若干实体和一条实体链，相邻文档块共享一个实体。
+    """
+    from langchain_core.documents import Document
+    from langchain_community.graphs.graph_document import (
+        GraphDocument,
+        Node,
+        Relationship,
+    )
+
+    documents = []
+    for start in range(0, num_entities, entities_per_document):
+        ids = range(start, min(start + entities_per_document + 1, num_entities))
+        nodes = [
+            Node(id=f"实体{i}", type="Policy" if i % 2 else "Organization") for i in ids
+        ]
+        documents.append(
+            GraphDocument(
+                nodes=nodes,
+                relationships=[
+                    Relationship(source=a, target=b, type="RELATED_TO")
+                    for a, b in zip(nodes, nodes[1:])
+                ],
+                source=Document(page_content=f"压测分块 {start}", metadata={}),
+            )
+        )
+    return documents
+
+
+def make_check_documents(prefix):
+    """
+    生成集成检查使用的两个小图文档，所有 id 以 prefix 开头，便于统计和清理。
+
+    合并后应有 3 个实体、2 条关系、2 个分块和 4 条 MENTIONS（两个文档共用实体和一条关系）。
+    """
+    from langchain_core.documents import Document
+    from langchain_community.graphs.graph_document import (
+        GraphDocument,
+        Node,
+        Relationship,
+    )
+
+    ministry = Node(id=f"{prefix}财政部", type="Organization")
+    tax_policy = Node(
+        id=f"{prefix}增值税政策", type="Policy", properties={"year": 2024}
+    )
+    fee_policy = Node(id=f"{prefix}收费政策", type="Policy")
+    return [
+        GraphDocument(
+            nodes=[ministry, tax_policy],
+            relationships=[
+                Relationship(source=ministry, target=tax_policy, type="ISSUED")
+            ],
+            source=Document(
+                page_content="财政部发布增值税政策。", metadata={"id": f"{prefix}doc1"}
+            ),
+        ),
+        GraphDocument(
+            nodes=[ministry, fee_policy],
+            relationships=[
+                Relationship(source=ministry, target=tax_policy, type="ISSUED"),
+                Relationship(source=ministry, target=fee_policy, type="ISSUED"),
+            ],
+            source=Document(
+                page_content="财政部还发布了收费政策。",
+                metadata={"id": f"{prefix}doc2"},
+            ),
+        ),
+    ]
+
+
+# 集成检查写入的节点和关系数量（见 make_check_documents）
+_CHECK_EXPECTED = {"nodes": 3, "relationships": 2, "documents": 2, "mentions": 4}
+
+_CHECK_COUNT_QUERIES = {
+    "nodes": f"MATCH (n:{BASE_ENTITY_LABEL}) WHERE n.id STARTS WITH $prefix "
+    f"RETURN count(n) AS count",
+    "relationships": f"MATCH (s:{BASE_ENTITY_LABEL})-[r]->(:{BASE_ENTITY_LABEL}) "
+    f"WHERE s.id STARTS WITH $prefix RETURN count(r) AS count",
+    "documents": f"MATCH (d:{DOCUMENT_LABEL}) WHERE d.id STARTS WITH $prefix "
+    f"RETURN count(d) AS count",
+    "mentions": f"MATCH (d:{DOCUMENT_LABEL})-[m:{MENTIONS_TYPE}]->() "
+    f"WHERE d.id STARTS WITH $prefix RETURN count(m) AS count",
+}
+
+
+def check_writer(graph):
+    """
+    对一个可写的 Neo4j 做集成检查：用 Neo4jBulkWriter 把同一批图文档写入两次，
+    检查节点、关系、分块和 MENTIONS 数量，第二次写入不得产生重复（MERGE 依赖唯一约束），
+    并确认唯一约束已创建。检查数据使用随机前缀的 id，结束后删除。
+
+    :param graph: Neo4jGraph 实例。
+    :return: 检查失败的描述列表，全部通过时为空列表。
+    """
+    prefix = f"__check_{uuid.uuid4().hex[:8]}_"
+    documents = make_check_documents(prefix)
+    writer = Neo4jBulkWriter(graph)
+    failures = []
+
+    def counts():
+        return {
+            name: graph.query(query, {"prefix": prefix})[0]["count"]
+            for name, query in _CHECK_COUNT_QUERIES.items()
+        }
+
+    try:
+        for attempt in ("第一次写入", "重复写入"):
+            writer.write(documents)
+            actual = counts()
+            if actual != _CHECK_EXPECTED:
+                failures.append(f"{attempt}后数量为 {actual}，期望 {_CHECK_EXPECTED}")
+
+        labels = graph.query(
+            f"MATCH (n:{BASE_ENTITY_LABEL} {{id: $id}}) RETURN labels(n) AS labels",
+            {"id": f"{prefix}财政部"},
+        )
+        if not labels or "Organization" not in labels[0]["labels"]:
+            failures.append(f"实体标签不正确: {labels}")
+
+        constraints = {
+            (tuple(row["labelsOrTypes"]), tuple(row["properties"]))
+            for row in graph.query(
+                "SHOW CONSTRAINTS YIELD type, labelsOrTypes, properties "
+                "WHERE type CONTAINS 'UNIQUENESS' RETURN labelsOrTypes, properties"
+            )
+        }
+        for label in (BASE_ENTITY_LABEL, DOCUMENT_LABEL):
+            if ((label,), ("id",)) not in constraints:
+                failures.append(f"缺少 {label}.id 的唯一约束")
+    finally:
+        for label in (BASE_ENTITY_LABEL, DOCUMENT_LABEL):
+            graph.query(
+                f"MATCH (n:{label}) WHERE n.id STARTS WITH $prefix DETACH DELETE n",
+                {"prefix": prefix},
+            )
+    return failures
+
+
+if __name__ == "__main__":
+    # 压测和集成检查需要一个可写的 Neo4j，例如本地容器：
+    #   docker run --rm -p 7474:7474 -p 7687:7687 -e NEO4J_AUTH=neo4j/password neo4j:5
+    # 并在 .env 中设置 NEO4J_URI=bolt://localhost:7687、NEO4J_USERNAME、NEO4J_PASSWORD
+    parser = argparse.ArgumentParser(description="图谱批量写入工具。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("schema", help="创建唯一约束")
+    bench_parser = subparsers.add_parser(
+        "bench", help="向 Neo4j 写入合成图文档并报告吞吐量（会写入测试数据）"
+    )
+    bench_parser.add_argument("--entities", type=int, default=100000)
+    bench_parser.add_argument("--batch-documents", type=int, default=500)
+    subparsers.add_parser(
+        "check",
+        help="集成检查：写入小批图文档两次并校验数量和幂等性（未设置 NEO4J_URI 时跳过）",
+    )
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if args.command == "check" and not os.getenv("NEO4J_URI"):
+        print("未设置 NEO4J_URI，跳过集成检查。")
+        sys.exit(0)
+
+    from langchain_neo4j import Neo4jGraph
+
+    writer = Neo4jBulkWriter(Neo4jGraph())
+    if args.command == "check":
+        failures = check_writer(writer.graph)
+        for failure in failures:
+            print(f"[失败] {failure}")
+        print(
+            "集成检查通过。" if not failures else f"集成检查失败 {len(failures)} 项。"
+        )
+        sys.exit(1 if failures else 0)
+    elif args.command == "schema":
+        writer.ensure_schema()
+        print("约束已创建。")
+    else:
+        documents = make_synthetic_documents(args.entities)
+        for start in range(0, len(documents), args.batch_documents):
+            writer.write(documents[start : start + args.batch_documents])
+        print(writer.format_stats())
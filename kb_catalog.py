@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# 目录清单数据库文件名，存放在 knowledge_base 目录下
+CATALOG_FILENAME = "catalog.sqlite3"
+
+# 各处理阶段在进度表中的名称，与脚本编号一一对应
+STAGE_UPLOAD = "01_upload"
+STAGE_DOWNLOAD = "02_download"
+STAGE_UNZIP = "03_unzip"
+STAGE_STRUCTURE = "04_structure"
+STAGE_CHUNK = "05_chunk"
+STAGE_VECTOR = "06_vector"
+STAGE_GRAPH = "07_graph"
+
+# 计算哈希时每次读取的字节数
+HASH_BUFFER_SIZE = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    relative_path TEXT PRIMARY KEY,
+    raw_stem      TEXT NOT NULL,
+    file_name     TEXT NOT NULL,
+    content_hash  TEXT NOT NULL,
+    data_id       TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    mtime_ns      INTEGER NOT NULL,
+    batch_id      TEXT,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_raw_stem ON files (raw_stem);
+CREATE INDEX IF NOT EXISTS idx_files_data_id ON files (data_id);
+CREATE TABLE IF NOT EXISTS progress (
+    relative_path TEXT NOT NULL REFERENCES files (relative_path) ON DELETE CASCADE,
+    stage         TEXT NOT NULL,
+    state         TEXT NOT NULL,
+    fingerprint   TEXT,
+    detail        TEXT,
+    updated_at    REAL NOT NULL,
+    PRIMARY KEY (relative_path, stage)
+);
+"""
+
+
+def hash_file(file_path, buffer_size=HASH_BUFFER_SIZE):
+    """
+    以流式方式计算文件内容的 SHA-256 哈希值。
+
+    :param file_path: 文件路径。
+    :param buffer_size: 每次读取的字节数。
+    :return: 十六进制哈希字符串。
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(buffer_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stat_fingerprint(file_path):
+    """
+    用文件大小和修改时间作为廉价指纹，适用于只会被整体替换、不会原地修改的产物（如下载的 zip）。
+    """
+    st = os.stat(file_path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+class FileCatalog:
+    """
+    基于 SQLite 的原始文件清单，以文件内容哈希作为稳定ID，并记录各阶段的处理进度。
+
+    文件的 relative_path 相对于项目根目录保存，绝对路径在运行时再拼接，
+    因此数据库可以随项目目录一起迁移。
+    """
+
+    def __init__(self, db_path, project_root):
+        """
+        :param db_path: SQLite 数据库文件路径。
+        :param project_root: 项目根目录，用于换算相对路径和绝对路径。
+        """
+        self.db_path = db_path
+        self.project_root = project_root
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # 后续阶段会在线程池中回写进度，因此允许跨线程共享连接，并用锁串行化写入
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+
+    @classmethod
+    def open_default(cls, project_root, kb_dir="knowledge_base"):
+        """
+        打开项目默认位置的清单数据库 (knowledge_base/catalog.sqlite3)。
+        """
+        db_path = os.path.join(project_root, kb_dir, CATALOG_FILENAME)
+        return cls(db_path, project_root)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 路径换算
+    # ------------------------------------------------------------------
+    def to_relative(self, absolute_path):
+        return os.path.relpath(absolute_path, self.project_root).replace("\\", "/")
+
+    def to_absolute(self, relative_path):
+        return os.path.join(self.project_root, *relative_path.split("/"))
+
+    def _row_to_info(self, row):
+        info = dict(row)
+        info["absolute_path"] = self.to_absolute(row["relative_path"])
+        return info
+
+    # ------------------------------------------------------------------
+    # 扫描
+    # ------------------------------------------------------------------
+    def scan(self, raw_files_dir):
+        """
+        增量扫描原始文件目录并更新清单。
+
+        大小和修改时间均未变化的文件直接跳过，不重新计算哈希；
+        新增或变化的文件重新计算哈希；已不存在的文件连同其进度记录一并删除。
+
+        :param raw_files_dir: 原始文件目录的绝对路径。
+        :return: 统计字典，包含 added/changed/unchanged/removed 四个计数。
+        """
+        stats = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0}
+
+        with self._lock:
+            known = {
+                row["relative_path"]: row
+                for row in self._conn.execute(
+                    "SELECT relative_path, content_hash, size, mtime_ns FROM files"
+                )
+            }
+            seen = set()
+            now = time.time()
+
+            with self._conn:
+                for root, _, files in os.walk(raw_files_dir):
+                    for filename in files:
+                        absolute_path = os.path.join(root, filename)
+                        relative_path = self.to_relative(absolute_path)
+                        seen.add(relative_path)
+
+                        st = os.stat(absolute_path)
+                        old = known.get(relative_path)
+                        # 快速路径：大小和修改时间都没变，认为内容未变
+                        if (
+                            old is not None
+                            and old["size"] == st.st_size
+                            and old["mtime_ns"] == st.st_mtime_ns
+                        ):
+                            stats["unchanged"] += 1
+                            continue
+
+                        content_hash = hash_file(absolute_path)
+                        if old is not None and old["content_hash"] == content_hash:
+                            # 仅修改时间变化（如被 touch 或复制），内容相同，只刷新 stat
+                            self._conn.execute(
+                                "UPDATE files SET size = ?, mtime_ns = ?, updated_at = ? "
+                                "WHERE relative_path = ?",
+                                (st.st_size, st.st_mtime_ns, now, relative_path),
+                            )
+                            stats["unchanged"] += 1
+                            continue
+
+                        raw_stem = os.path.splitext(
+                            os.path.relpath(absolute_path, raw_files_dir)
+                        )[0].replace("\\", "/")
+
+                        if old is None:
+                            stats["added"] += 1
+                            print(f"  - 新文件: {relative_path}")
+                        else:
+                            stats["changed"] += 1
+                            print(f"  - 内容已变化: {relative_path}")
+                            # 内容变化后，下游所有阶段的结果都已失效
+                            self._conn.execute(
+                                "DELETE FROM progress WHERE relative_path = ?",
+                                (relative_path,),
+                            )
+
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO files (relative_path, raw_stem, file_name, "
+                            "content_hash, data_id, size, mtime_ns, batch_id, updated_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?)",
+                            (
+                                relative_path,
+                                raw_stem,
+                                filename,
+                                content_hash,
+                                content_hash,
+                                st.st_size,
+                                st.st_mtime_ns,
+                                now,
+                            ),
+                        )
+
+                removed = [path for path in known if path not in seen]
+                for relative_path in removed:
+                    print(f"  - 文件已删除: {relative_path}")
+                    self._conn.execute(
+                        "DELETE FROM files WHERE relative_path = ?", (relative_path,)
+                    )
+                stats["removed"] = len(removed)
+
+        return stats
+
+    def import_legacy_metadata(self, metadata_path):
+        """
+        从旧版 metadata.json 导入已有的 UUID 和 batch_id。
+
+        旧版本上传到 MinerU 时使用 UUID 作为 data_id，导入后下载阶段仍能匹配到这些历史任务。
+
+        :param metadata_path: 旧版 metadata.json 路径。
+        :return: 导入的记录数。
+        """
+        try:
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return 0
+
+        imported = 0
+        with self._lock, self._conn:
+            for file_uuid, info in metadata.items():
+                batch_id = info.get("batch_id")
+                relative_path = info.get("relative_path")
+                if not batch_id or not relative_path:
+                    continue
+                cursor = self._conn.execute(
+                    "UPDATE files SET data_id = ?, batch_id = ? "
+                    "WHERE relative_path = ? AND batch_id IS NULL",
+                    (file_uuid, batch_id, relative_path.replace("\\", "/")),
+                )
+                if cursor.rowcount:
+                    self._mark_uploaded_locked(relative_path.replace("\\", "/"))
+                    imported += cursor.rowcount
+        return imported
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def iter_files(self):
+        """
+        返回清单中所有文件的信息字典列表（含运行时拼接的 absolute_path）。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM files ORDER BY relative_path"
+            ).fetchall()
+        return [self._row_to_info(row) for row in rows]
+
+    def get_file(self, relative_path):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM files WHERE relative_path = ?", (relative_path,)
+            ).fetchone()
+        return self._row_to_info(row) if row else None
+
+    def get_file_by_data_id(self, data_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM files WHERE data_id = ?", (data_id,)
+            ).fetchone()
+        return self._row_to_info(row) if row else None
+
+    def find_by_stem(self, raw_stem):
+        """
+        根据去掉扩展名、相对于 01_raw_files 的路径查找原始文件。
+
+        后续阶段的产物（.zip/.md/.chunks.jsonl）与原始文件同名同目录，只是扩展名不同，
+        因此可以用这个“词干”把任意阶段的产物映射回原始文件。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM files WHERE raw_stem = ? ORDER BY relative_path",
+                (raw_stem.replace("\\", "/"),),
+            ).fetchone()
+        return self._row_to_info(row) if row else None
+
+    # ------------------------------------------------------------------
+    # 进度记录
+    # ------------------------------------------------------------------
+    def set_batch_id(self, relative_path, batch_id):
+        """
+        记录文件提交到 MinerU 后得到的 batch_id，并将上传阶段标记为完成。
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE files SET batch_id = ?, updated_at = ? WHERE relative_path = ?",
+                (batch_id, time.time(), relative_path),
+            )
+            self._mark_uploaded_locked(relative_path)
+
+    def _mark_uploaded_locked(self, relative_path):
+        row = self._conn.execute(
+            "SELECT content_hash FROM files WHERE relative_path = ?", (relative_path,)
+        ).fetchone()
+        if row:
+            self._record_progress_locked(
+                relative_path, STAGE_UPLOAD, "done", fingerprint=row["content_hash"]
+            )
+
+    def _record_progress_locked(
+        self, relative_path, stage, state, fingerprint=None, detail=None
+    ):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO progress "
+            "(relative_path, stage, state, fingerprint, detail, updated_at) "
+            "SELECT relative_path, ?, ?, ?, ?, ? FROM files WHERE relative_path = ?",
+            (stage, state, fingerprint, detail, time.time(), relative_path),
+        )
+
+    def record_progress(
+        self, relative_path, stage, state="done", fingerprint=None, detail=None
+    ):
+        """
+        记录某个文件在某个阶段的处理状态。
+
+        :param relative_path: 原始文件相对于项目根目录的路径。
+        :param stage: 阶段名称，如 STAGE_CHUNK。
+        :param state: 状态，如 "done"、"failed"。
+        :param fingerprint: 该阶段输入的指纹，用于判断是否需要重新处理。
+        :param detail: 附加说明（如错误信息或输出路径）。
+        """
+        with self._lock, self._conn:
+            self._record_progress_locked(
+                relative_path, stage, state, fingerprint, detail
+            )
+
+    def record_progress_by_stem(
+        self, raw_stem, stage, state="done", fingerprint=None, detail=None
+    ):
+        """
+        与 record_progress 相同，但通过产物的“词干”定位原始文件；找不到时返回 False。
+        """
+        info = self.find_by_stem(raw_stem)
+        if not info:
+            return False
+        self.record_progress(info["relative_path"], stage, state, fingerprint, detail)
+        return True
+
+    def get_stage_progress(self, stage):
+        """
+        一次性读取某个阶段所有文件的进度，返回以 raw_stem 为键的字典，避免逐个文件查询。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT files.raw_stem, progress.* FROM progress "
+                "JOIN files USING (relative_path) WHERE progress.stage = ?",
+                (stage,),
+            ).fetchall()
+        return {row["raw_stem"]: dict(row) for row in rows}
+
+    def get_progress(self, relative_path, stage):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM progress WHERE relative_path = ? AND stage = ?",
+                (relative_path, stage),
+            ).fetchone()
+        return dict(row) if row else None
@@ -0,0 +1,524 @@
+import os
+import re
+import json
+import mmap
+import time
+import argparse
+import collections
+
+import numpy as np
+
+from chunk_store import ChunkStore, get_custom_metadata, parse_chunk_id
+from kb_catalog import stat_fingerprint
+from vector_index import MetadataIndex
+
+# 倒排索引的目录，与分块存储并列存放
+INDEX_DIRNAME = "04_lexical_index"
+LEXICON_FILENAME = "lexicon.json"
+
+# 文件格式版本，写在 lexicon.json 中
+FORMAT_VERSION = 2
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 倒数排名融合 (RRF) 的平滑常数
+RRF_K = 60
+
+# 中文按连续汉字串切出字二元组（单字串保留单字），英文单词和数字整体作为词项
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[A-Za-z0-9]+(?:\.[0-9]+)*")
+_CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+")
+
+
+def tokenize(text):
+    """
+    将文本切分为词项：汉字按字二元组切分，英文单词（转小写）和数字（含 1.2 这样的编号）整体保留。
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        run = match.group()
+        if _CJK_RUN.fullmatch(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def default_index_dir(project_root, kb_dir="knowledge_base"):
+    """
+    项目默认的倒排索引目录 (knowledge_base/04_database/04_lexical_index)。
+    """
+    return os.path.join(project_root, kb_dir, "04_database", INDEX_DIRNAME)
+
+
+def _store_fingerprints(store):
+    return {
+        source_key: stat_fingerprint(store.path_for(source_key))
+        for source_key in store.iter_sources()
+    }
+
+
+def _index_sources(store, source_keys, documents_file, first_doc_id):
+    """
+    对指定源文件的分块分词，正文依次追加写入 documents_file。
+
+    :return: (chunk_ids, metadatas, doc_lengths, text_lengths, postings)，
+        postings 为 (词项列表, 分块序号列表, 词频列表) 三个等长列表。
+    """
+    chunk_ids, metadatas, doc_lengths, text_lengths = [], [], [], []
+    terms, docs, tfs = [], [], []
+    doc_id = first_doc_id
+    for source_key in source_keys:
+        for record in store.iter_chunks(source_key):
+            tokens = tokenize(record["page_content"])
+            for term, tf in collections.Counter(tokens).items():
+                terms.append(term)
+                docs.append(doc_id)
+                tfs.append(min(tf, 65535))
+            chunk_ids.append(record["chunk_id"])
+            metadata = dict(record["metadata"])
+            metadata.update(get_custom_metadata(record["source_key"]))
+            metadata["source_key"] = record["source_key"]
+            metadata["header_path"] = record["header_path"]
+            metadatas.append(metadata)
+            doc_lengths.append(len(tokens))
+            encoded = record["page_content"].encode("utf-8")
+            documents_file.write(encoded)
+            text_lengths.append(len(encoded))
+            doc_id += 1
+    return chunk_ids, metadatas, doc_lengths, text_lengths, (terms, docs, tfs)
+
+
+def _load_index(index_dir):
+    """
+    读取已有索引的词表和数组（读入内存，不做内存映射，之后可以安全地替换文件），
+    索引不存在或格式版本不一致时返回 None。
+    """
+    lexicon_path = os.path.join(index_dir, LEXICON_FILENAME)
+    if not os.path.exists(lexicon_path):
+        return None
+    with open(lexicon_path, "r", encoding="utf-8") as f:
+        lexicon = json.load(f)
+    if lexicon.get("format_version") != FORMAT_VERSION:
+        return None
+    arrays = {
+        name: np.load(os.path.join(index_dir, f"{name}.npy"))
+        for name in (
+            "postings_docs",
+            "postings_tf",
+            "term_offsets",
+            "doc_lengths",
+            "doc_offsets",
+        )
+    }
+    return lexicon, arrays
+
+
+def _write_index(store, index_dir, fingerprints, reindex_sources, previous=None):
+    """
+    写入倒排索引：previous 中不属于 reindex_sources 且仍在分块存储中的分块原样保留，
+    reindex_sources 中的源文件重新分词后追加在后面，最后合并两部分的倒排表。
+
+    :param fingerprints: 分块存储中全部源文件的 stat 指纹。
+    :param reindex_sources: 需要重新分词的源文件标识。
+    :param previous: _load_index 读取的已有索引；为 None 时构建全新的索引。
+    :return: (索引的分块总数, 重新分词的分块数)。
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    chunk_ids, metadatas = [], []
+    doc_lengths, text_lengths = np.zeros(0, np.uint32), np.zeros(0, np.uint64)
+    kept_terms, kept_docs, kept_tfs = (
+        np.zeros(0, np.int64),
+        np.zeros(0, np.int64),
+        np.zeros(0, np.uint16),
+    )
+    kept_vocabulary = []
+
+    documents_path = os.path.join(index_dir, "documents.bin")
+    with open(documents_path + ".part", "wb") as documents_file:
+        if previous is not None:
+            lexicon, arrays = previous
+            old_metadatas = lexicon["metadatas"]
+            kept = np.fromiter(
+                (
+                    metadata["source_key"] in fingerprints
+                    and metadata["source_key"] not in reindex_sources
+                    for metadata in old_metadatas
+                ),
+                dtype=bool,
+                count=len(old_metadatas),
+            )
+            kept_ids = np.flatnonzero(kept)
+            chunk_ids = [lexicon["chunk_ids"][i] for i in kept_ids.tolist()]
+            metadatas = [old_metadatas[i] for i in kept_ids.tolist()]
+            doc_lengths = arrays["doc_lengths"][kept_ids]
+            old_offsets = arrays["doc_offsets"]
+            text_lengths = np.diff(old_offsets)[kept_ids]
+
+            # 同一源文件的分块在原索引中是连续的，正文按连续区间整段复制
+            with open(documents_path, "rb") as old_documents:
+                runs = np.split(kept_ids, np.flatnonzero(np.diff(kept_ids) != 1) + 1)
+                for run in runs:
+                    if not len(run):
+                        continue
+                    start, end = int(old_offsets[run[0]]), int(old_offsets[run[-1] + 1])
+                    old_documents.seek(start)
+                    documents_file.write(old_documents.read(end - start))
+
+            # 保留的倒排记录：分块序号按保留顺序重新编号
+            old_terms = np.repeat(
+                np.arange(len(lexicon["vocabulary"])),
+                np.diff(arrays["term_offsets"].astype(np.int64)),
+            )
+            postings_docs = arrays["postings_docs"]
+            keep = kept[postings_docs]
+            new_ids = np.cumsum(kept) - 1
+            kept_term_ids, kept_terms = np.unique(old_terms[keep], return_inverse=True)
+            kept_docs = new_ids[postings_docs[keep]]
+            kept_tfs = arrays["postings_tf"][keep]
+            kept_vocabulary = [lexicon["vocabulary"][i] for i in kept_term_ids]
+
+        added = _index_sources(
+            store, sorted(reindex_sources), documents_file, len(chunk_ids)
+        )
+    added_ids, added_metadatas, added_lengths, added_text_lengths, postings = added
+    terms, docs, tfs = postings
+
+    # 合并词表，把两部分的倒排记录都映射到新的词项编号上，再按 (词项, 分块) 排序
+    vocabulary = sorted(set(kept_vocabulary).union(terms))
+    term_ids = {term: i for i, term in enumerate(vocabulary)}
+    if len(kept_terms):
+        remap = np.asarray([term_ids[term] for term in kept_vocabulary])
+        kept_terms = remap[kept_terms]
+    all_terms = np.concatenate(
+        [kept_terms, np.fromiter((term_ids[t] for t in terms), np.int64, len(terms))]
+    )
+    all_docs = np.concatenate([kept_docs, np.asarray(docs, dtype=np.int64)])
+    all_tfs = np.concatenate([kept_tfs, np.asarray(tfs, dtype=np.uint16)])
+    order = np.lexsort((all_docs, all_terms))
+    term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.uint64)
+    np.cumsum(np.bincount(all_terms, minlength=len(vocabulary)), out=term_offsets[1:])
+
+    chunk_ids += added_ids
+    metadatas += added_metadatas
+    text_lengths = np.concatenate(
+        [text_lengths, np.asarray(added_text_lengths, dtype=np.uint64)]
+    )
+    doc_offsets = np.zeros(len(chunk_ids) + 1, dtype=np.uint64)
+    np.cumsum(text_lengths, out=doc_offsets[1:])
+
+    arrays = {
+        "postings_docs.npy": all_docs[order].astype(np.uint32),
+        "postings_tf.npy": all_tfs[order],
+        "term_offsets.npy": term_offsets,
+        "doc_lengths.npy": np.concatenate(
+            [doc_lengths, np.asarray(added_lengths, dtype=np.uint32)]
+        ),
+        "doc_offsets.npy": doc_offsets,
+    }
+    for filename, array in arrays.items():
+        path = os.path.join(index_dir, filename)
+        with open(path + ".part", "wb") as f:
+            np.save(f, array)
+        os.replace(path + ".part", path)
+    os.replace(documents_path + ".part", documents_path)
+
+    # lexicon.json 最后写入，写入中断时旧索引仍然可用
+    lexicon = {
+        "format_version": FORMAT_VERSION,
+        "sources": fingerprints,
+        "vocabulary": vocabulary,
+        "chunk_ids": chunk_ids,
+        "metadatas": metadatas,
+    }
+    lexicon_path = os.path.join(index_dir, LEXICON_FILENAME)
+    with open(lexicon_path + ".part", "w", encoding="utf-8") as f:
+        json.dump(lexicon, f, ensure_ascii=False)
+    os.replace(lexicon_path + ".part", lexicon_path)
+    return len(chunk_ids), len(added_ids)
+
+
+def build_lexical_index(store, index_dir):
+    """
+    遍历分块存储中的全部分块，构建 BM25 倒排索引并写入 index_dir。
+
+    倒排表以 numpy 数组紧凑保存：词项 i 的倒排记录位于
+    postings_docs / postings_tf 的 [term_offsets[i], term_offsets[i + 1]) 区间。
+    分块正文另存一份 UTF-8 文本，用于短语精确匹配和返回结果。
+
+    :param store: ChunkStore 分块存储。
+    :param index_dir: 索引输出目录。
+    :return: 索引的分块数。
+    """
+    fingerprints = _store_fingerprints(store)
+    total, _ = _write_index(store, index_dir, fingerprints, set(fingerprints))
+    return total
+
+
+def update_lexical_index(store, index_dir, force=False):
+    """
+    按源文件增量更新倒排索引。
+
+    比较索引记录的各分块文件 stat 指纹，只对新增或修改过的源文件重新分词；
+    其余源文件的倒排记录、文档长度和正文从已有索引中原样保留，已删除的源文件被剔除。
+    索引不存在、格式升级或 force 为 True 时整体重建。
+
+    :return: 重新分词的分块数；索引已是最新时返回 None。
+    """
+    fingerprints = _store_fingerprints(store)
+    previous = None if force else _load_index(index_dir)
+    if previous is None:
+        return build_lexical_index(store, index_dir)
+
+    indexed_sources = previous[0].get("sources", {})
+    changed = {
+        source_key
+        for source_key, fingerprint in fingerprints.items()
+        if indexed_sources.get(source_key) != fingerprint
+    }
+    if not changed and indexed_sources.keys() == fingerprints.keys():
+        return None
+    _, reindexed = _write_index(store, index_dir, fingerprints, changed, previous)
+    return reindexed
+
+
+class LexicalIndex:
+    """
+    基于字二元组的 BM25 倒排索引，检索完全在本地完成，不需要调用向量接口。
+
+    倒排表和文档长度以内存映射方式打开，查询时只读取查询词项对应的倒排区间，
+    用 numpy 累加 BM25 得分；短语查询先对词项倒排求交集，再在候选分块的原文中精确匹配。
+    """
+
+    def __init__(self, index_dir):
+        """
+        :param index_dir: 索引目录（由 build_lexical_index 生成）。
+        :raises FileNotFoundError: 索引不存在时抛出。
+        """
+        self.index_dir = index_dir
+        with open(
+            os.path.join(index_dir, LEXICON_FILENAME), "r", encoding="utf-8"
+        ) as f:
+            lexicon = json.load(f)
+        self.chunk_ids = lexicon["chunk_ids"]
+        self.metadatas = lexicon["metadatas"]
+        self._term_ids = {term: i for i, term in enumerate(lexicon["vocabulary"])}
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode="r")
+
+        self._postings_docs = load("postings_docs.npy")
+        self._postings_tf = load("postings_tf.npy")
+        self._term_offsets = load("term_offsets.npy")
+        self._doc_offsets = load("doc_offsets.npy")
+        self._doc_lengths = np.asarray(load("doc_lengths.npy"), dtype=np.float32)
+        self._avg_length = float(self._doc_lengths.mean()) if len(self) else 0.0
+        # BM25 的长度归一化项对每个分块是固定的，预先算好
+        self._length_norm = BM25_K1 * (
+            1 - BM25_B + BM25_B * self._doc_lengths / max(self._avg_length, 1.0)
+        )
+
+        self.metadata_index = MetadataIndex(self.metadatas)
+
+        self._documents_file = open(os.path.join(index_dir, "documents.bin"), "rb")
+        self._documents = (
+            mmap.mmap(self._documents_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(self) and self._doc_offsets[-1]
+            else b""
+        )
+
+    def close(self):
+        if isinstance(self._documents, mmap.mmap):
+            self._documents.close()
+        self._documents_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def get_text(self, doc_id):
+        """
+        按分块序号读取分块正文。
+        """
+        start, end = self._doc_offsets[doc_id], self._doc_offsets[doc_id + 1]
+        return self._documents[int(start) : int(end)].decode("utf-8")
+
+    def get_mask(self, where):
+        """
+        返回 Chroma 风格过滤条件对应的布尔掩码（带缓存）；where 为空时返回 None。
+        """
+        return self.metadata_index.mask(where)
+
+    def _postings(self, term):
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            return None, None
+        start, end = self._term_offsets[term_id], self._term_offsets[term_id + 1]
+        return self._postings_docs[start:end], self._postings_tf[start:end]
+
+    def _bm25_scores(self, terms):
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term, query_tf in collections.Counter(terms).items():
+            docs, tf = self._postings(term)
+            if docs is None:
+                continue
+            idf = np.log(1 + (len(self) - len(docs) + 0.5) / (len(docs) + 0.5))
+            tf = tf.astype(np.float32)
+            scores[docs] += (
+                query_tf * idf * tf * (BM25_K1 + 1) / (tf + self._length_norm[docs])
+            )
+        return scores
+
+    def _to_results(self, doc_ids, scores):
+        return [
+            {
+                "id": self.chunk_ids[doc_id],
+                "score": float(score),
+                "metadata": self.metadatas[doc_id],
+                "page_content": self.get_text(doc_id),
+            }
+            for doc_id, score in zip(doc_ids, scores)
+        ]
+
+    def search(self, query, k=4, mask=None):
+        """
+        BM25 检索。
+
+        :param query: 查询文本。
+        :param k: 返回的结果数。
+        :param mask: 可选的布尔掩码（与分块一一对应），只在选中的分块中检索。
+        :return: 结果字典列表 (id 为分块ID，score 为 BM25 得分)，按得分降序。
+        """
+        scores = self._bm25_scores(tokenize(query))
+        if mask is not None:
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return self._to_results(candidates.tolist(), scores[candidates].tolist())
+
+    def phrase_search(self, phrase, k=4, mask=None):
+        """
+        短语精确匹配：返回原文中包含 phrase 的分块，按 BM25 得分排序。
+
+        :param phrase: 需要原样出现的短语，如 "人工智能+"。
+        :param k: 返回的结果数。
+        :param mask: 可选的布尔掩码，只在选中的分块中检索。
+        """
+        terms = tokenize(phrase)
+        if terms:
+            candidates = None
+            for term in set(terms):
+                docs, _ = self._postings(term)
+                if docs is None:
+                    return []
+                candidates = (
+                    np.asarray(docs)
+                    if candidates is None
+                    else np.intersect1d(candidates, docs, assume_unique=True)
+                )
+        else:
+            # 短语中没有可索引的词项（如纯标点），只能逐个分块匹配
+            candidates = np.arange(len(self))
+        if not len(candidates) or not isinstance(self._documents, mmap.mmap):
+            return []
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+
+        # 直接在内存映射的原文字节上查找，不必解码每个候选分块
+        encoded = phrase.encode("utf-8")
+        starts = self._doc_offsets[candidates].tolist()
+        ends = self._doc_offsets[candidates + 1].tolist()
+        matches = [
+            int(doc_id)
+            for doc_id, start, end in zip(candidates.tolist(), starts, ends)
+            if self._documents.find(encoded, start, end) != -1
+        ]
+        if not matches:
+            return []
+        scores = self._bm25_scores(terms)[matches]
+        order = np.argsort(-scores)[:k]
+        return self._to_results([matches[i] for i in order], scores[order].tolist())
+
+
+def _covers(vector_result, chunk_id):
+    """
+    判断向量检索结果（06 号脚本合并后的文档）是否包含某个分块。
+    """
+    metadata = vector_result["metadata"]
+    if "chunk_start" not in metadata:
+        return False
+    source_key, index = parse_chunk_id(chunk_id)
+    return (
+        metadata.get("source_key") == source_key
+        and metadata["chunk_start"] <= index <= metadata["chunk_end"]
+    )
+
+
+def reciprocal_rank_fusion(vector_results, lexical_results, k=4, rrf_k=RRF_K):
+    """
+    用倒数排名融合 (RRF) 合并向量检索和 BM25 检索的结果。
+
+    向量检索的结果是合并后的文档，BM25 的结果是分块；分块落在某个向量结果的分块区间内时，
+    两者视为同一条结果，排名得分相加，返回内容更完整的向量结果。
+
+    :param vector_results: 向量检索结果列表（按相关度降序）。
+    :param lexical_results: BM25 检索结果列表（按得分降序）。
+    :param k: 返回的结果数。
+    :param rrf_k: RRF 平滑常数。
+    :return: 结果字典列表，score 为 RRF 得分，ranks 记录在各路检索中的名次。
+    """
+    fused = {}
+    for rank, result in enumerate(vector_results, 1):
+        fused[result["id"]] = dict(
+            result, score=1 / (rrf_k + rank), ranks={"vector": rank}
+        )
+    for rank, result in enumerate(lexical_results, 1):
+        key = next(
+            (v["id"] for v in vector_results if _covers(v, result["id"])), result["id"]
+        )
+        if key in fused:
+            fused[key]["score"] += 1 / (rrf_k + rank)
+            fused[key]["ranks"].setdefault("lexical", rank)
+        else:
+            fused[key] = dict(result, score=1 / (rrf_k + rank), ranks={"lexical": rank})
+    return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:k]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="构建或查询 BM25 倒排索引。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="从分块存储重建倒排索引")
+    query_parser = subparsers.add_parser("query", help="执行一次检索")
+    query_parser.add_argument("query", help="查询文本")
+    query_parser.add_argument("--k", type=int, default=3)
+    query_parser.add_argument(
+        "--phrase", action="store_true", help="按短语精确匹配，而不是 BM25"
+    )
+    args = parser.parse_args()
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    index_dir = default_index_dir(PROJECT_ROOT)
+    if args.command == "build":
+        count = build_lexical_index(ChunkStore.open_default(PROJECT_ROOT), index_dir)
+        print(f"已为 {count} 个分块构建倒排索引: {index_dir}")
+    else:
+        with LexicalIndex(index_dir) as index:
+            started_at = time.perf_counter()
+            search = index.phrase_search if args.phrase else index.search
+            results = search(args.query, args.k)
+            elapsed = (time.perf_counter() - started_at) * 1000
+            for result in results:
+                print(f"\n--- {result['score']:.3f} {result['id']} ---")
+                print(result["page_content"][:300])
+            print(f"\n共 {len(results)} 条结果，用时 {elapsed:.2f} 毫秒。")
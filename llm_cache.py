@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import hashlib
+
+from sqlite_cache import (
+    SQLiteCache,
+    build_cli_parser,
+    format_lookups,
+    run_cli_command,
+)
+
+# 大模型响应缓存数据库文件名，存放在 knowledge_base 目录下
+CACHE_FILENAME = "llm_cache.sqlite3"
+
+# 缓存的默认容量上限（按响应文本的 UTF-8 字节数计）
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key         TEXT PRIMARY KEY,
+    model       TEXT NOT NULL,
+    response    TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    created_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at);
+CREATE INDEX IF NOT EXISTS idx_responses_model ON responses (model);
+
+-- 缓存总大小保存在 counters 表中，由触发器随写入、覆盖和删除同步更新，
+-- 写入时不必对全表求和；已有数据库升级时只求和一次作为初始值
+INSERT OR IGNORE INTO counters (name, value)
+    SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM responses;
+CREATE TRIGGER IF NOT EXISTS responses_insert_size AFTER INSERT ON responses BEGIN
+    UPDATE counters SET value = value + NEW.size WHERE name = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS responses_update_size AFTER UPDATE OF size ON responses BEGIN
+    UPDATE counters SET value = value + NEW.size - OLD.size WHERE name = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS responses_delete_size AFTER DELETE ON responses BEGIN
+    UPDATE counters SET value = value - OLD.size WHERE name = 'total_bytes';
+END;
+"""
+
+
+def make_cache_key(model, temperature, system_prompt, content):
+    """
+    根据模型、温度、系统提示和输入内容计算缓存键，任意一项变化都会得到不同的键。
+    """
+    payload = json.dumps(
+        [model, temperature, system_prompt, content], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache(SQLiteCache):
+    """
+    基于 SQLite 的大模型响应缓存。
+
+    以 make_cache_key 计算的哈希为键保存响应文本，总大小超过上限时按最近访问时间淘汰，
+    并累计记录命中和未命中次数。
+    """
+
+    SCHEMA = _SCHEMA
+    ENTRY_TABLE = "responses"
+    DEFAULT_NAME = CACHE_FILENAME
+
+    def __init__(self, db_path, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param db_path: SQLite 数据库文件路径。
+        :param max_bytes: 缓存容量上限，超过后淘汰最久未访问的条目。
+        """
+        super().__init__(db_path)
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        """
+        读取缓存的响应，未命中时返回 None。
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._record_lookups(int(row is not None), int(row is None))
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            return row["response"]
+
+    def put(self, key, model, response):
+        """
+        写入一条响应，并在总大小超过上限时淘汰最久未访问的条目。
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            # 用 UPSERT 覆盖已有的键（INSERT OR REPLACE 的隐式删除不会触发删除触发器）
+            self._conn.execute(
+                "INSERT INTO responses "
+                "(key, model, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET model = excluded.model, "
+                "response = excluded.response, size = excluded.size, "
+                "created_at = excluded.created_at, accessed_at = excluded.accessed_at",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict_locked(self.max_bytes)
+
+    def _total_bytes_locked(self):
+        return self._conn.execute(
+            "SELECT value FROM counters WHERE name = 'total_bytes'"
+        ).fetchone()[0]
+
+    def _evict_locked(self, max_bytes):
+        # 总大小来自触发器维护的计数，只有超出上限时才按访问时间扫描条目
+        excess = self._total_bytes_locked() - max_bytes
+        if excess <= 0:
+            return 0
+        keys = []
+        for row in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ):
+            if excess <= 0:
+                break
+            keys.append((row["key"],))
+            excess -= row["size"]
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        return len(keys)
+
+    def evict(self, max_bytes=None):
+        """
+        按最近访问时间淘汰条目，直到总大小不超过 max_bytes（默认使用实例的上限）。
+
+        :return: 淘汰的条目数。
+        """
+        with self._lock, self._conn:
+            return self._evict_locked(
+                self.max_bytes if max_bytes is None else max_bytes
+            )
+
+    def stats(self):
+        """
+        返回缓存的条目数、总大小，以及本进程和累计的命中/未命中次数。
+        """
+        with self._lock:
+            stats = super().stats()
+            stats["total_bytes"] = self._total_bytes_locked()
+            stats["max_bytes"] = self.max_bytes
+            return stats
+
+
+def format_stats(stats):
+    """
+    将 stats() 的结果格式化为一行便于打印的摘要。
+    """
+    return (
+        f"缓存条目 {stats['entries']} 个，"
+        f"占用 {stats['total_bytes'] / 1024 / 1024:.1f} MB / "
+        f"{stats['max_bytes'] / 1024 / 1024:.0f} MB；" + format_lookups(stats)
+    )
+
+
+if __name__ == "__main__":
+    parser, subparsers = build_cli_parser("查看或清理大模型响应缓存。")
+    evict_parser = subparsers.add_parser("evict", help="按容量上限淘汰旧条目")
+    evict_parser.add_argument(
+        "--max-mb", type=float, required=True, help="淘汰后保留的最大容量 (MB)"
+    )
+    args = parser.parse_args()
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    with LLMCache.open_default(PROJECT_ROOT) as cache:
+        run_cli_command(cache, args)
+        if args.command == "evict":
+            removed = cache.evict(int(args.max_mb * 1024 * 1024))
+            print(f"已淘汰 {removed} 条缓存。")
+        print(format_stats(cache.stats()))
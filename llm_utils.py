@@ -0,0 +1,250 @@
+import re
+import time
+import random
+import threading
+
+# 中日韩统一表意文字及常用全角标点，这些字符大约每个对应一个 token
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    快速估算文本的 token 数：中文字符按 1 个 token 计，其余字符按 4 个字符 1 个 token 计。
+
+    只用于限流和分批时的预算估计，不追求与具体模型的分词器完全一致。
+    """
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶：容量为每分钟的配额，按匀速补充。
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, amount: float) -> float:
+        """
+        尝试取出 amount 个令牌。成功时返回 0，否则返回需要等待的秒数（不扣减令牌）。
+
+        单次请求超过桶容量时，只要桶是满的就放行，避免永远等不到。
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def refund(self, amount: float):
+        """
+        退还之前取出的令牌。
+        """
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    同时限制每分钟请求数 (RPM) 和每分钟 token 数 (TPM) 的限流器，可在多个线程间共享。
+
+    收到服务端的限流响应时调用 penalize，所有共享该限流器的调用方都会暂停相应时间。
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def penalize(self, seconds: float):
+        """
+        暂停所有调用方 seconds 秒（用于响应服务端的限流）。
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _wait_time(self, tokens: int) -> float:
+        with self._lock:
+            paused = self._paused_until - time.monotonic()
+        if paused > 0:
+            return paused
+        if self.request_bucket:
+            wait = self.request_bucket.try_acquire(1)
+            if wait:
+                return wait
+        if self.token_bucket and tokens:
+            wait = self.token_bucket.try_acquire(tokens)
+            if wait:
+                # token 配额不足时退还已取出的请求令牌，避免重复扣减
+                if self.request_bucket:
+                    self.request_bucket.refund(1)
+                return wait
+        return 0.0
+
+    def acquire(self, tokens: int = 0):
+        """
+        阻塞直到可以发出一个预计消耗 tokens 个 token 的请求。
+        """
+        while True:
+            wait = self._wait_time(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    自适应并发上限（加性增、乘性减），可在多个线程间共享，按上下文管理器使用：
+
+        with concurrency:
+            call_api()
+
+    同时在途的调用数不超过当前上限；调用因限流失败时上限减半，
+    连续成功的调用数达到当前上限后上限加一，直到 max_limit。
+    同一波并发请求往往一起被限流，因此只有在上次减半之后发出的调用被限流时才再次减半。
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, initial_limit=None):
+        """
+        :param max_limit: 并发上限的最大值。
+        :param min_limit: 并发上限的最小值。
+        :param initial_limit: 初始上限，默认等于 max_limit。
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = min(self.max_limit, initial_limit or self.max_limit)
+        self.in_flight = 0
+        self.rate_limited = 0
+        self._successes = 0
+        # 每次减半后加一；调用开始时记录在线程局部变量中
+        self._epoch = 0
+        self._local = threading.local()
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+            self._local.epoch = self._epoch
+
+    def release(self, error=None):
+        """
+        释放当前线程占用的并发名额，并根据调用结果调整上限。
+
+        :param error: 调用抛出的异常，成功时为 None。
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if error is None:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            elif is_rate_limit_error(error):
+                self.rate_limited += 1
+                self._successes = 0
+                if getattr(self._local, "epoch", self._epoch) == self._epoch:
+                    self.limit = max(self.min_limit, self.limit // 2)
+                    self._epoch += 1
+            self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(exc)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    判断异常是否来自服务端限流（HTTP 429，或智谱的 1302/1303/1305 错误码）。
+    """
+    status_code = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+    if status_code == 429:
+        return True
+    message = str(error).lower()
+    return (
+        "429" in message
+        or "rate limit" in message
+        or any(code in message for code in ("1302", "1303", "1305"))
+    )
+
+
+def get_retry_after(error: Exception):
+    """
+    从异常携带的响应头中读取 Retry-After 秒数，没有时返回 None。
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, error: Exception, base_delay=2.0, max_delay=60.0):
+    """
+    计算第 attempt 次失败（从 0 开始）后的等待时间：优先使用 Retry-After，
+    否则按指数退避并叠加随机抖动；限流错误的起始等待更长。
+    """
+    retry_after = get_retry_after(error)
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    if is_rate_limit_error(error):
+        base_delay *= 2
+    delay = min(base_delay * (2**attempt), max_delay)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def call_with_retry(
+    func, max_attempts=5, base_delay=2.0, max_delay=60.0, limiter=None, tokens=0
+):
+    """
+    调用 func()，失败时按指数退避重试；若配置了限流器，每次调用前先获取配额，
+    遇到限流错误时让共享同一限流器的所有调用方一起暂停。
+
+    :param func: 无参可调用对象。
+    :param max_attempts: 最大尝试次数。
+    :param base_delay: 第一次重试前的基础等待秒数。
+    :param max_delay: 单次等待的上限。
+    :param limiter: 可选的 RateLimiter。
+    :param tokens: 本次调用预计消耗的 token 数，用于 TPM 限流。
+    :return: func 的返回值。
+    :raises Exception: 所有尝试都失败时抛出最后一次的异常。
+    """
+    for attempt in range(max_attempts):
+        if limiter:
+            limiter.acquire(tokens)
+        try:
+            return func()
+        except Exception as e:
+            if attempt == max_attempts - 1:
+                raise
+            delay = backoff_delay(attempt, e, base_delay, max_delay)
+            if limiter and is_rate_limit_error(e):
+                limiter.penalize(delay)
+            print(
+                f"  -> 调用失败 (第 {attempt + 1}/{max_attempts} 次): {e}，{delay:.1f}秒后重试..."
+            )
+            time.sleep(delay)
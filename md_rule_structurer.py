@@ -0,0 +1,407 @@
+import os
+import re
+import argparse
+
+# 原始文本中的序号标题及其对应的层级（按匹配顺序排列，"1.1" 须先于 "1." 判断）
+HEADING_PATTERNS = [
+    (1, re.compile(r"^([一二三四五六七八九十百零〇]+)、")),
+    (2, re.compile(r"^[（(]([一二三四五六七八九十百零〇]+)[)）]")),
+    (4, re.compile(r"^(\d+)[\.．](\d+)(?![\.．\d])")),
+    (3, re.compile(r"^(\d+)[\.．、](?!\d)")),
+]
+
+# 序号后面紧跟的标题文字不超过该长度时，才把“序号+短句。正文”拆成标题和正文
+MAX_HEADING_CHARS = 30
+
+# 置信度不低于该值的文档直接采用规则整理的结果，否则交给大模型处理
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+
+_CHINESE_DIGITS = {
+    "零": 0,
+    "〇": 0,
+    "一": 1,
+    "二": 2,
+    "三": 3,
+    "四": 4,
+    "五": 5,
+    "六": 6,
+    "七": 7,
+    "八": 8,
+    "九": 9,
+}
+
+# 行内公式：$...$（连同两侧 OCR 插入的空格）
+_INLINE_MATH = re.compile(r" ?\$([^$\n]+)\$ ?")
+# OCR 把右引号识别成上标撇号/剑号的情况，如 “人工智能 $+ ^ { \dag \dag }$ 行动
+_QUOTE_AS_MATH = re.compile(r"^\s*\+\s*(\^\s*\{)?[\s\\a-z{}]*(prime|dag)[\s\\a-z{}]*$")
+# 只由数字、小数点、百分号等组成的公式，如 $7 0 \%$
+_NUMBER_MATH = re.compile(r"^[\s\d\.,\\%+\-]+$")
+# 问答体段落
+_QA_PATTERN = re.compile(r"^(\*\*)?(问|答)[：:](\*\*)?")
+# 句末标点：以这些符号结尾的整行不视为标题
+_SENTENCE_END = "。；;，,！!？?：:"
+# 不含任何文字、数字的行中，这些开头表示合法的 Markdown 结构（表格、分隔线、图片等）
+_STRUCTURAL_PREFIXES = ("|", "-", "*", "_", "!", ">", "`", "<", "=")
+_WORD_CHAR = re.compile(r"\w")
+# 清理后仍残留的可疑字符，用于估计 OCR 噪声
+_GARBAGE_CHAR = re.compile(r"[\ufffd$\\^{}]")
+
+
+def chinese_to_int(text):
+    """
+    将不超过“九十九”的中文数字或阿拉伯数字转换为整数，无法识别时返回 None。
+    """
+    if text.isdigit():
+        return int(text)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        tens_value = _CHINESE_DIGITS.get(tens, None) if tens else 1
+        ones_value = _CHINESE_DIGITS.get(ones, None) if ones else 0
+        if tens_value is None or ones_value is None:
+            return None
+        return tens_value * 10 + ones_value
+    if len(text) == 1:
+        return _CHINESE_DIGITS.get(text)
+    return None
+
+
+def strip_heading_marks(line):
+    """
+    去掉行首的 Markdown 标题符号、加粗符号和空白，便于匹配序号。
+    """
+    return line.lstrip().lstrip("#").strip().replace("**", "").strip()
+
+
+def match_heading(line):
+    """
+    按序号格式匹配一行，返回 (层级, 序号元组)，不是序号标题时返回 None。
+
+    序号元组如 "三、" 为 (3,)、"2.1" 为 (2, 1)；无法解析的中文数字记为 None。
+    """
+    text = strip_heading_marks(line)
+    for level, pattern in HEADING_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            return level, tuple(chinese_to_int(group) for group in match.groups())
+    return None
+
+
+def detect_heading_level(line):
+    """
+    根据序号格式判断一行是否为标题，返回层级 (1-4)，不是序号标题时返回 None。
+    """
+    matched = match_heading(line)
+    return matched[0] if matched else None
+
+
+def _clean_math(match):
+    body = match.group(1)
+    if _QUOTE_AS_MATH.match(body):
+        return "+”"
+    if _NUMBER_MATH.match(body):
+        return body.replace(" ", "").replace("\\", "")
+    return match.group(0)
+
+
+def clean_line(line):
+    """
+    清理单行中的 OCR 噪声：还原被识别成公式的数字和引号，删除替换字符和多余的行尾空白。
+    """
+    line = _INLINE_MATH.sub(_clean_math, line)
+    return line.replace("\ufffd", "").rstrip()
+
+
+def _is_garbage_line(line):
+    stripped = line.strip()
+    return (
+        bool(stripped)
+        and not _WORD_CHAR.search(stripped)
+        and not stripped.startswith(_STRUCTURAL_PREFIXES)
+    )
+
+
+def _split_heading(text):
+    """
+    将带序号的一行拆成 (标题, 正文)。
+
+    整行较短且不以句末标点结尾时整行都是标题；“序号+短句。正文”的形式拆为标题和正文；
+    其他情况（如带序号的长段落）返回 None，按普通段落处理。
+    """
+    if len(text) <= MAX_HEADING_CHARS + 10 and not text.endswith(tuple(_SENTENCE_END)):
+        return text, ""
+    head, sep, body = text.partition("。")
+    if sep and body.strip() and len(head) <= MAX_HEADING_CHARS:
+        return head, body.strip()
+    return None
+
+
+def _count_marks(line):
+    stripped = line.lstrip()
+    return len(stripped) - len(stripped.lstrip("#"))
+
+
+def _is_next_number(number, previous):
+    """
+    判断序号是否紧接在同级的上一个序号之后。
+
+    :param number: 当前序号元组。
+    :param previous: (上级标题之后本级的上一个序号, 全文中本级的上一个序号)，本级首次出现时为 None。
+    """
+    if None in number:
+        return False
+    last_in_parent, last_overall = previous or (None, None)
+    candidates = [last for last in (last_in_parent, last_overall) if last]
+    if not last_in_parent and number[-1] == 1:
+        return True
+    for last in candidates:
+        if number[:-1] == last[:-1] and number[-1] == last[-1] + 1:
+            return True
+        if number[:-1] != last[:-1] and number[-1] == 1:
+            return True
+    return False
+
+
+def rule_structure(content):
+    """
+    用正则规则整理 OCR 得到的 Markdown：清理噪声、按序号重建标题层级、保留问答段落。
+
+    序号层级按文档中实际出现的种类排序后依次映射为 #、##、###……；
+    文档开头的标题固定为一级标题，其余没有序号的 Markdown 标题保持原有层级，
+    此时序号标题整体下沉一级。
+
+    置信度综合考虑序号是否连续、无法确定层级的标题所占比例以及残留的噪声字符。
+
+    :param content: 原始 Markdown 文本。
+    :return: (整理后的文本, 置信度 0-1, 统计信息字典)
+    """
+    lines = [clean_line(line) for line in content.splitlines()]
+    lines = [line for line in lines if not _is_garbage_line(line)]
+
+    # --- 1. 识别标题候选 ---
+    first_text_index = next((i for i, line in enumerate(lines) if line.strip()), None)
+    candidates = {}
+    for index, line in enumerate(lines):
+        if line.lstrip().startswith(("|", "!", "`")) or _QA_PATTERN.match(line):
+            continue
+        matched = match_heading(line)
+        if matched:
+            split = _split_heading(strip_heading_marks(line))
+            if split:
+                candidates[index] = (matched[0], matched[1], split)
+
+    kinds = sorted({kind for kind, _, _ in candidates.values()})
+    rank = {kind: position + 1 for position, kind in enumerate(kinds)}
+
+    # 文档中存在没有序号的章节标题（如“第一部分”）时，序号标题整体下沉一级
+    has_sections = any(
+        line.lstrip().startswith("#") and index != first_text_index
+        for index, line in enumerate(lines)
+        if index not in candidates
+    )
+    # 源文本中最高一级的序号标题比文档标题低一级时（如标题为 #、“一、”为 ##），同样下沉一级
+    top_marks = [
+        _count_marks(lines[index])
+        for index, (kind, _, _) in sorted(candidates.items())
+        if kind == kinds[0]
+    ][:1]
+    title_marks = (
+        _count_marks(lines[first_text_index]) if first_text_index is not None else 0
+    )
+    offset = (
+        1
+        if has_sections or (title_marks and top_marks and top_marks[0] > title_marks)
+        else 0
+    )
+
+    # --- 2. 输出并检查序号是否连续 ---
+    output = []
+    previous = {}
+    in_sequence = 0
+    unresolved_headings = 0
+    for index, line in enumerate(lines):
+        if index in candidates:
+            kind, number, (heading, body) = candidates[index]
+            if _is_next_number(number, previous.get(kind)):
+                in_sequence += 1
+            # 出现上级标题时，下级序号通常重新从 1 开始（公文中也有跨章节连续编号的写法）
+            previous = {
+                k: (v if k <= kind else (None, v[1])) for k, v in previous.items()
+            }
+            previous[kind] = (number, number)
+            level = min(rank[kind] + offset, 6)
+            output.append(f"{'#' * level} {heading}")
+            if body:
+                output.append(body)
+            continue
+
+        stripped = line.lstrip()
+        if stripped.startswith("#"):
+            heading = strip_heading_marks(line)
+            if index == first_text_index:
+                output.append(f"# {heading}")
+            else:
+                unresolved_headings += 1
+                output.append(f"{'#' * min(_count_marks(line), 6)} {heading}")
+            continue
+
+        qa = _QA_PATTERN.match(stripped)
+        if qa:
+            rest = stripped[qa.end() :].strip()
+            if qa.group(2) == "问":
+                rest = rest.strip("*")
+                output.append(f"**问：{rest}**")
+            else:
+                output.append(f"**答：**{rest}")
+            continue
+        output.append(line)
+
+    structured = re.sub(r"\n{3,}", "\n\n", "\n".join(output)).strip() + "\n"
+
+    # --- 3. 计算置信度 ---
+    heading_count = len(candidates)
+    garbage = len(_GARBAGE_CHAR.findall(structured))
+    garbage_per_1k = garbage * 1000 / max(len(structured), 1)
+    if heading_count:
+        sequence_ratio = in_sequence / heading_count
+        unresolved_ratio = unresolved_headings / (heading_count + unresolved_headings)
+        confidence = sequence_ratio * (1 - 0.5 * unresolved_ratio)
+    elif unresolved_headings:
+        # 只有无序号的标题时无法判断层级是否正确，交给大模型更稳妥
+        sequence_ratio = unresolved_ratio = 0.0
+        confidence = 0.5
+    else:
+        # 除文档标题外没有任何标题的短文（如新闻稿、答记者问），只需清理噪声
+        sequence_ratio = unresolved_ratio = 0.0
+        confidence = 0.9
+    confidence *= max(0.0, 1 - garbage_per_1k / 5)
+
+    stats = {
+        "headings": heading_count,
+        "unresolved_headings": unresolved_headings,
+        "sequence_ratio": sequence_ratio,
+        "garbage_per_1k": garbage_per_1k,
+    }
+    return structured, round(confidence, 3), stats
+
+
+def _normalize_heading(text):
+    text = strip_heading_marks(text).replace("*", "")
+    text = text.replace("“", '"').replace("”", '"').replace("‘", "'")
+    text = text.replace("’", "'")
+    return re.sub(r"\s+", "", text).rstrip(_SENTENCE_END)
+
+
+def extract_headings(markdown):
+    """
+    提取 Markdown 中的标题，返回 [(层级, 规范化后的标题文本)]。
+    """
+    headings = []
+    for line in markdown.splitlines():
+        stripped = line.lstrip()
+        if stripped.startswith("#"):
+            headings.append((_count_marks(stripped), _normalize_heading(stripped)))
+    return headings
+
+
+def compare_headings(rule_markdown, reference_markdown):
+    """
+    比较规则整理结果与参考结果（大模型输出）的标题。
+
+    :return: 字典，包含标题文本的精确率、召回率、F1，以及匹配标题中层级一致的比例。
+    """
+    rule_headings = extract_headings(rule_markdown)
+    reference_headings = extract_headings(reference_markdown)
+    reference_levels = {}
+    for level, text in reference_headings:
+        reference_levels.setdefault(text, level)
+
+    matched = [
+        (level, text) for level, text in rule_headings if text in reference_levels
+    ]
+    precision = len(matched) / len(rule_headings) if rule_headings else 1.0
+    recall = (
+        len({text for _, text in matched}) / len(reference_levels)
+        if reference_levels
+        else 1.0
+    )
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    level_agreement = (
+        sum(1 for level, text in matched if reference_levels[text] == level)
+        / len(matched)
+        if matched
+        else 0.0
+    )
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "level_agreement": level_agreement,
+    }
+
+
+def compare_with_llm_output(raw_dir, structured_dir, threshold):
+    """
+    对比评测：用规则整理 raw_dir 下的每个 Markdown 文件，与 structured_dir 中
+    对应的大模型整理结果比较标题，并打印每个文件及总体的指标。
+    """
+    rows = []
+    for root, _, files in os.walk(raw_dir):
+        for file in files:
+            if not file.endswith(".md"):
+                continue
+            raw_path = os.path.join(root, file)
+            relative_path = os.path.relpath(raw_path, raw_dir)
+            reference_path = os.path.join(structured_dir, relative_path)
+            if not os.path.exists(reference_path):
+                continue
+            with open(raw_path, "r", encoding="utf-8") as f:
+                raw_content = f.read()
+            with open(reference_path, "r", encoding="utf-8") as f:
+                reference_content = f.read()
+
+            structured, confidence, _ = rule_structure(raw_content)
+            scores = compare_headings(structured, reference_content)
+            rows.append((relative_path, confidence, scores))
+
+    if not rows:
+        print(f"在 {raw_dir} 与 {structured_dir} 中没有找到可以对比的文件。")
+        return
+
+    for relative_path, confidence, scores in sorted(rows):
+        route = "规则" if confidence >= threshold else "大模型"
+        print(
+            f"[{route}] 置信度 {confidence:.2f}  F1 {scores['f1']:.2f}  "
+            f"层级一致 {scores['level_agreement']:.2f}  {relative_path}"
+        )
+
+    fast = [row for row in rows if row[1] >= threshold]
+    print(
+        f"\n共 {len(rows)} 个文件，其中 {len(fast)} 个置信度不低于 {threshold}，可不调用大模型。"
+    )
+    if fast:
+        mean_f1 = sum(row[2]["f1"] for row in fast) / len(fast)
+        mean_level = sum(row[2]["level_agreement"] for row in fast) / len(fast)
+        print(
+            f"这些文件与大模型结果的平均标题 F1 为 {mean_f1:.2f}，平均层级一致率为 {mean_level:.2f}。"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="将规则整理结果与 03_structure_md_files 中的大模型结果进行对比。"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_CONFIDENCE_THRESHOLD,
+        help="直接采用规则结果的置信度阈值",
+    )
+    args = parser.parse_args()
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    KNOWLEDGE_BASE_DIR = os.path.join(PROJECT_ROOT, "knowledge_base")
+    compare_with_llm_output(
+        os.path.join(KNOWLEDGE_BASE_DIR, "02_raw_md_files"),
+        os.path.join(KNOWLEDGE_BASE_DIR, "03_structure_md_files"),
+        args.threshold,
+    )
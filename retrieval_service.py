@@ -0,0 +1,522 @@
+import os
+import time
+import asyncio
+import argparse
+import collections
+
+from aiohttp import web
+
+import vector_index
+import lexical_index
+from lexical_index import reciprocal_rank_fusion
+from vector_index import MMR_FETCH_FACTOR, mmr_select
+
+# 查询向量微批处理：单批最多的查询数，以及凑批时最长等待的毫秒数
+QUERY_BATCH_SIZE = 32
+QUERY_BATCH_WAIT_MS = 5
+
+# 内存中缓存的最近查询向量数
+QUERY_CACHE_SIZE = 1024
+
+# 检索模式，以及混合检索时每一路相对于 k 多取的候选倍数
+SEARCH_MODES = ("hybrid", "vector", "lexical", "phrase")
+HYBRID_CANDIDATE_FACTOR = 3
+
+# 统计延迟分位数时保留的最近请求数
+LATENCY_WINDOW = 2000
+
+
+class QueryEmbeddingBatcher:
+    """
+    将并发请求的查询文本合并为一次向量接口调用。
+
+    第一个查询到达后最多等待 max_wait_ms 毫秒，凑齐的查询（最多 max_batch_size 个）
+    在线程池中一次性调用 embed_documents；最近用过的查询向量保存在内存 LRU 缓存中。
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        max_batch_size=QUERY_BATCH_SIZE,
+        max_wait_ms=QUERY_BATCH_WAIT_MS,
+        cache_size=QUERY_CACHE_SIZE,
+    ):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        # 正在计算中的查询，相同文本的并发请求共享同一个结果
+        self._pending = {}
+        self._queue = asyncio.Queue()
+        self._worker = None
+        # 统计信息
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.batches = 0
+        self.batched_queries = 0
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+    async def embed(self, text):
+        """
+        返回查询文本的向量：先查 LRU 缓存，未命中时加入当前批次等待结果。
+        """
+        vector = self._cache.get(text)
+        if vector is not None:
+            self._cache.move_to_end(text)
+            self.cache_hits += 1
+            return vector
+        self.cache_misses += 1
+        future = self._pending.get(text)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[text] = future
+            await self._queue.put((text, future))
+        return await asyncio.shield(future)
+
+    def _remember(self, text, vector):
+        self._cache[text] = vector
+        self._cache.move_to_end(text)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                vectors = await loop.run_in_executor(
+                    None, self.embeddings.embed_documents, texts
+                )
+            except Exception as e:
+                for text, future in batch:
+                    self._pending.pop(text, None)
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.batched_queries += len(texts)
+            for (text, future), vector in zip(batch, vectors):
+                self._remember(text, vector)
+                self._pending.pop(text, None)
+                future.set_result(vector)
+
+
+class NumpySearchBackend:
+    """
+    以 NumpyVectorIndex 为后端的检索：得分为余弦相似度。
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.embeddings = index.embeddings
+
+    def __len__(self):
+        return len(self.index)
+
+    def partitions(self):
+        metadata_index = self.index.metadata_index
+        return {key: metadata_index.values(key) for key in ("file_type", "top_folder")}
+
+    def _to_results(self, hits):
+        return [
+            {
+                "id": self.index.ids[row],
+                "score": score,
+                "metadata": self.index.metadatas[row],
+                "page_content": self.index.get_text(row),
+            }
+            for row, score in hits
+        ]
+
+    def search(self, vector, k, where):
+        return self._to_results(self.index.search_by_vectors([vector], k, where)[0])
+
+    def mmr_search(self, vector, k, where, lambda_mult, max_per_source=None):
+        return self._to_results(
+            self.index.mmr_search_by_vector(
+                vector,
+                k,
+                where=where,
+                lambda_mult=lambda_mult,
+                max_per_source=max_per_source,
+            )
+        )
+
+
+class ChromaSearchBackend:
+    """
+    以 Chroma 向量库为后端的检索：得分为 LangChain 换算后的相关度 (0~1)。
+    """
+
+    def __init__(self, vector_store):
+        self.vector_store = vector_store
+        self.embeddings = vector_store.embeddings
+
+    def __len__(self):
+        return len(self.vector_store.get(include=[])["ids"])
+
+    def partitions(self):
+        return None
+
+    def search(self, vector, k, where):
+        results = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+            vector, k=k, filter=where
+        )
+        return [
+            {
+                "id": doc.id,
+                "score": score,
+                "metadata": doc.metadata,
+                "page_content": doc.page_content,
+            }
+            for doc, score in results
+        ]
+
+    def mmr_search(self, vector, k, where, lambda_mult, max_per_source=None):
+        candidates = self.search(vector, k * MMR_FETCH_FACTOR, where)
+        if not candidates:
+            return []
+        # 相似度检索不返回向量，按 ID 一次取回全部候选的向量
+        fetched = self.vector_store.get(
+            ids=[c["id"] for c in candidates], include=["embeddings"]
+        )
+        by_id = dict(zip(fetched["ids"], fetched["embeddings"]))
+        picks = mmr_select(
+            vector,
+            [by_id[c["id"]] for c in candidates],
+            k,
+            lambda_mult,
+            groups=[(c["metadata"] or {}).get("source_key") for c in candidates],
+            max_per_group=max_per_source,
+        )
+        return [candidates[pick] for pick in picks]
+
+
+def cap_per_source(results, max_per_source):
+    """
+    按顺序保留结果，同一源文件（metadata.source_key，缺失时按结果 ID）最多保留 max_per_source 个。
+    """
+    if not max_per_source:
+        return results
+    counts = collections.Counter()
+    capped = []
+    for result in results:
+        source = (result.get("metadata") or {}).get("source_key") or result["id"]
+        if counts[source] < max_per_source:
+            counts[source] += 1
+            capped.append(result)
+    return capped
+
+
+def load_backend(project_root, backend="numpy"):
+    """
+    加载检索后端（只在服务启动时执行一次）。
+
+    :param project_root: 项目根目录。
+    :param backend: "numpy" 使用导出的 NumPy 索引，"chroma" 直接查询 Chroma 向量库。
+    """
+    if backend == "numpy":
+        return NumpySearchBackend(vector_index.open_default(project_root))
+    import importlib
+
+    vector_db = importlib.import_module("06_create_vector_database_from_chunks")
+    return ChromaSearchBackend(
+        vector_db.create_vector_store(
+            os.path.join(
+                project_root, "knowledge_base", "04_database", "02_vector_chroma_db"
+            )
+        )
+    )
+
+
+def build_where(body):
+    """
+    将请求中的常用过滤字段与自定义 filter 合并为一个 Chroma 风格的 where 条件。
+
+    支持的字段（值可以是字符串或字符串列表）：
+      file_type      文件类型，"original"（原文）或 "construe"（解读）
+      source         源文件标识（相对路径去掉扩展名）
+      folder         顶层政策目录
+      header_prefix  标题路径前缀，如 "一、总体要求"（不支持 chroma 后端）
+
+    :return: where 条件；没有任何过滤时返回 None。
+    """
+    clauses = []
+    for field, key in (
+        ("file_type", "file_type"),
+        ("source", "source_key"),
+        ("folder", "top_folder"),
+    ):
+        value = body.get(field)
+        if isinstance(value, list):
+            clauses.append({key: {"$in": value}})
+        elif value:
+            clauses.append({key: value})
+    if body.get("header_prefix"):
+        clauses.append({"header_path": {"$prefix": body["header_prefix"]}})
+    if body.get("filter"):
+        clauses.append(body["filter"])
+
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _elapsed_ms(started_at):
+    return round((time.perf_counter() - started_at) * 1000, 3)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 2)
+
+
+def create_app(
+    backend,
+    lexical=None,
+    max_batch_size=QUERY_BATCH_SIZE,
+    max_wait_ms=QUERY_BATCH_WAIT_MS,
+    cache_size=QUERY_CACHE_SIZE,
+    mmr_lambda=None,
+    max_per_source=None,
+):
+    """
+    创建检索服务的 aiohttp 应用。
+
+    接口：
+      POST /search  {"query": "...", "k": 4, "filter": {...}, "score_threshold": 0.5,
+                     "mode": "hybrid" | "vector" | "lexical" | "phrase",
+                     "file_type": ..., "source": ..., "folder": ..., "header_prefix": ...,
+                     "mmr_lambda": 0.5, "max_per_source": 2}
+                    过滤条件见 build_where，在检索前作为预过滤作用于索引。
+                    给出 mmr_lambda 时向量检索改用 MMR 去冗余（多取候选后选出互不重复的结果），
+                    max_per_source 限制同一源文件返回的结果数；两者缺省时使用服务的默认值。
+                    返回结果列表，以及各环节耗时 (timings_ms: lexical / embed / search / total)。
+                    lexical 和 phrase 模式只查询本地倒排索引，不调用向量接口；
+                    score_threshold 只作用于向量检索的相似度。
+      GET  /stats   查询向量缓存、微批处理和延迟分位数统计。
+      GET  /health  健康检查。
+
+    :param backend: load_backend 返回的检索后端。
+    :param lexical: 可选的 LexicalIndex；提供时默认使用混合检索。
+    :param mmr_lambda: 默认的 MMR 相关性权重 (0~1)，为 None 时默认不做 MMR。
+    :param max_per_source: 默认的同一源文件最多结果数，为 None 时不限制。
+    """
+    batcher = QueryEmbeddingBatcher(
+        backend.embeddings, max_batch_size, max_wait_ms, cache_size
+    )
+    latencies = collections.deque(maxlen=LATENCY_WINDOW)
+    default_mode = "hybrid" if lexical is not None else "vector"
+
+    async def on_startup(app):
+        batcher.start()
+
+    async def on_cleanup(app):
+        await batcher.stop()
+
+    async def search(request):
+        started_at = time.perf_counter()
+        try:
+            body = await request.json()
+            query = body["query"]
+            k = int(body.get("k", 4))
+            where = build_where(body)
+            threshold = body.get("score_threshold")
+            mode = body.get("mode") or default_mode
+            lambda_mult = body.get("mmr_lambda", mmr_lambda)
+            if lambda_mult is not None:
+                lambda_mult = float(lambda_mult)
+                if not 0 <= lambda_mult <= 1:
+                    raise ValueError("mmr_lambda 应在 0 到 1 之间")
+            source_cap = body.get("max_per_source", max_per_source)
+            source_cap = int(source_cap) if source_cap else None
+            if mode not in SEARCH_MODES:
+                raise ValueError(f"未知的检索模式: {mode}")
+            if mode != "vector" and lexical is None:
+                raise ValueError("未加载倒排索引，只支持 vector 模式")
+        except (ValueError, KeyError, TypeError) as e:
+            return web.json_response({"error": f"请求格式错误: {e}"}, status=400)
+
+        # 混合检索时两路各取更多候选，融合后再截取前 k 个
+        candidate_k = k * HYBRID_CANDIDATE_FACTOR if mode == "hybrid" else k
+        timings = {}
+        vector_results, lexical_results = [], []
+        try:
+            if mode != "vector":
+                lexical_started_at = time.perf_counter()
+                search_lexical = (
+                    lexical.phrase_search if mode == "phrase" else lexical.search
+                )
+                lexical_results = search_lexical(
+                    query,
+                    candidate_k * MMR_FETCH_FACTOR if source_cap else candidate_k,
+                    lexical.get_mask(where),
+                )
+                timings["lexical"] = _elapsed_ms(lexical_started_at)
+
+            if mode in ("vector", "hybrid"):
+                embed_started_at = time.perf_counter()
+                try:
+                    vector = await batcher.embed(query)
+                except Exception as e:
+                    return web.json_response(
+                        {"error": f"计算查询向量失败: {e}"}, status=502
+                    )
+                timings["embed"] = _elapsed_ms(embed_started_at)
+
+                search_started_at = time.perf_counter()
+                if lambda_mult is None:
+                    # 只限制来源数时多取候选，避免截断后不足 k 个
+                    fetch_k = (
+                        candidate_k * MMR_FETCH_FACTOR if source_cap else candidate_k
+                    )
+                    search_args = (backend.search, vector, fetch_k, where)
+                else:
+                    search_args = (
+                        backend.mmr_search,
+                        vector,
+                        candidate_k,
+                        where,
+                        lambda_mult,
+                        source_cap,
+                    )
+                vector_results = await asyncio.get_running_loop().run_in_executor(
+                    None, *search_args
+                )
+                if threshold is not None:
+                    vector_results = [
+                        r for r in vector_results if r["score"] >= threshold
+                    ]
+                timings["search"] = _elapsed_ms(search_started_at)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+        # 同一源文件的结果数限制在融合之后统一执行，词法结果也受限制
+        if mode == "hybrid":
+            results = reciprocal_rank_fusion(
+                vector_results, lexical_results, candidate_k if source_cap else k
+            )
+        else:
+            results = vector_results or lexical_results
+        results = cap_per_source(results, source_cap)[:k]
+
+        timings["total"] = _elapsed_ms(started_at)
+        latencies.append(timings)
+        return web.json_response(
+            {"mode": mode, "results": results, "timings_ms": timings}
+        )
+
+    async def stats(request):
+        totals = [t["total"] for t in latencies]
+        return web.json_response(
+            {
+                "vectors": len(backend),
+                "partitions": backend.partitions(),
+                "query_cache": {
+                    "size": len(batcher._cache),
+                    "hits": batcher.cache_hits,
+                    "misses": batcher.cache_misses,
+                },
+                "embedding_batches": {
+                    "batches": batcher.batches,
+                    "queries": batcher.batched_queries,
+                },
+                "latency_ms": {
+                    "requests": len(totals),
+                    "p50": _percentile(totals, 0.5),
+                    "p99": _percentile(totals, 0.99),
+                    "search_p99": _percentile(
+                        [t["search"] for t in latencies if "search" in t], 0.99
+                    ),
+                    "lexical_p99": _percentile(
+                        [t["lexical"] for t in latencies if "lexical" in t], 0.99
+                    ),
+                },
+            }
+        )
+
+    async def health(request):
+        return web.json_response({"status": "ok"})
+
+    app = web.Application()
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/search", search)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/health", health)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动本地检索服务。")
+    parser.add_argument(
+        "--backend",
+        choices=["numpy", "chroma"],
+        default=os.getenv("RETRIEVAL_BACKEND", "numpy"),
+        help="检索后端，默认使用 06 号脚本导出的 NumPy 索引",
+    )
+    parser.add_argument(
+        "--host", default=os.getenv("RETRIEVAL_HOST", "127.0.0.1"), help="监听地址"
+    )
+    parser.add_argument(
+        "--port", type=int, default=int(os.getenv("RETRIEVAL_PORT", "8000"))
+    )
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    # 加载 .env 文件中的环境变量
+    load_dotenv()
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    print(f"正在加载检索后端 ({args.backend})...")
+    backend = load_backend(PROJECT_ROOT, args.backend)
+    print(f"已加载 {len(backend)} 个向量。")
+    lexical_dir = lexical_index.default_index_dir(PROJECT_ROOT)
+    if os.path.isdir(lexical_dir):
+        lexical = lexical_index.LexicalIndex(lexical_dir)
+        print(f"已加载倒排索引（{len(lexical)} 个分块），默认使用混合检索。")
+    else:
+        lexical = None
+        print("未找到倒排索引，只提供向量检索。")
+    web.run_app(
+        create_app(
+            backend,
+            lexical,
+            max_batch_size=int(os.getenv("QUERY_BATCH_SIZE", str(QUERY_BATCH_SIZE))),
+            max_wait_ms=float(
+                os.getenv("QUERY_BATCH_WAIT_MS", str(QUERY_BATCH_WAIT_MS))
+            ),
+            cache_size=int(os.getenv("QUERY_CACHE_SIZE", str(QUERY_CACHE_SIZE))),
+            mmr_lambda=(
+                float(os.environ["MMR_LAMBDA"]) if os.getenv("MMR_LAMBDA") else None
+            ),
+            max_per_source=int(os.getenv("MAX_PER_SOURCE", "0")) or None,
+        ),
+        host=args.host,
+        port=args.port,
+    )
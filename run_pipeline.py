@@ -0,0 +1,575 @@
+import os
+import argparse
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from kb_catalog import (
+    FileCatalog,
+    hash_file,
+    stat_fingerprint,
+    STAGE_UPLOAD,
+    STAGE_DOWNLOAD,
+    STAGE_UNZIP,
+    STAGE_STRUCTURE,
+    STAGE_CHUNK,
+    STAGE_VECTOR,
+    STAGE_GRAPH,
+)
+from llm_utils import AdaptiveConcurrency, RateLimiter
+from graph_cache import GraphExtractionCache
+from chunk_store import ChunkStore, CHUNK_FILE_SUFFIX
+from lexical_index import default_index_dir, update_lexical_index
+
+# --- 路径配置 ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+KNOWLEDGE_BASE_DIR = os.path.join(PROJECT_ROOT, "knowledge_base")
+RAW_FILES_DIR = os.path.join(KNOWLEDGE_BASE_DIR, "01_raw_files")
+RAW_MD_DIR = os.path.join(KNOWLEDGE_BASE_DIR, "02_raw_md_files")
+STRUCTURE_MD_DIR = os.path.join(KNOWLEDGE_BASE_DIR, "03_structure_md_files")
+CHUNKS_DIR = os.path.join(
+    KNOWLEDGE_BASE_DIR, "04_database", "01_langchain_split_documents_files"
+)
+VECTOR_DB_DIR = os.path.join(KNOWLEDGE_BASE_DIR, "04_database", "02_vector_chroma_db")
+
+
+def load_script(module_name):
+    """
+    按文件名导入编号脚本（如 "05_chunk_md_files_and_store_chunks"）。
+
+    脚本名以数字开头，无法直接 import，只能通过 importlib 导入；
+    导入推迟到真正需要时进行，这样只跑部分阶段时不必加载其余阶段的依赖。
+    """
+    return importlib.import_module(module_name)
+
+
+def artifact_path(base_dir, file_info, ext):
+    """
+    计算某个原始文件在指定阶段目录下的产物路径：目录结构与 01_raw_files 相同，只替换扩展名。
+    """
+    return os.path.join(base_dir, *file_info["raw_stem"].split("/")) + ext
+
+
+class PipelineContext:
+    """
+    一次流水线运行的共享状态：清单数据库、并发度，以及按需创建的大模型限流器、向量库和图数据库连接。
+    """
+
+    def __init__(self, catalog, workers):
+        self.catalog = catalog
+        self.workers = workers
+        self._vector_store = None
+        self._graph_components = None
+        self._llm_limiter = None
+        self._graph_concurrency = None
+        self._graph_cache = None
+        self._lock = threading.Lock()
+        self.chunk_store = ChunkStore(CHUNKS_DIR)
+
+    @property
+    def llm_limiter(self):
+        """
+        各阶段共享的大模型限流器，配额来自 ZHIPUAI_RPM / ZHIPUAI_TPM 环境变量。
+        """
+        with self._lock:
+            if self._llm_limiter is None:
+                self._llm_limiter = RateLimiter(
+                    int(os.getenv("ZHIPUAI_RPM", "0")) or None,
+                    int(os.getenv("ZHIPUAI_TPM", "0")) or None,
+                )
+            return self._llm_limiter
+
+    @property
+    def graph_concurrency(self):
+        """
+        各文件的图谱抽取共享的自适应并发上限，最大值来自 GRAPH_WORKERS 环境变量。
+        """
+        with self._lock:
+            if self._graph_concurrency is None:
+                self._graph_concurrency = AdaptiveConcurrency(
+                    int(os.getenv("GRAPH_WORKERS", "4"))
+                )
+            return self._graph_concurrency
+
+    @property
+    def graph_cache(self):
+        """
+        图谱抽取缓存和写入检查点 (knowledge_base/graph_extraction_cache.sqlite3)。
+        """
+        with self._lock:
+            if self._graph_cache is None:
+                self._graph_cache = GraphExtractionCache.open_default(PROJECT_ROOT)
+            return self._graph_cache
+
+    @property
+    def vector_store(self):
+        with self._lock:
+            if self._vector_store is None:
+                self._vector_store = load_script(
+                    "06_create_vector_database_from_chunks"
+                ).create_vector_store(VECTOR_DB_DIR)
+            return self._vector_store
+
+    @property
+    def graph_components(self):
+        with self._lock:
+            if self._graph_components is None:
+                self._graph_components = load_script(
+                    "07_create_knowledge_graph_from_chunks"
+                ).create_graph_components()
+            return self._graph_components
+
+
+class Stage:
+    """
+    流水线中的一个按文件执行的阶段。
+
+    每个阶段声明自己的输入和输出产物、依赖的上游阶段，以及它适用于哪些原始文件。
+    某个文件在该阶段是否“脏”，由输入指纹、清单中记录的进度和输出是否存在共同决定。
+    """
+
+    def __init__(
+        self,
+        name,
+        catalog_stage,
+        deps=(),
+        input_path=None,
+        output_path=None,
+        applies=lambda file_info: True,
+        run_one=None,
+        run_batch=None,
+        fingerprint=hash_file,
+        finalize=None,
+    ):
+        """
+        :param name: 阶段名称（用于日志和命令行参数）。
+        :param catalog_stage: 在清单进度表中使用的阶段名。
+        :param deps: 上游阶段名称列表。
+        :param input_path: 函数 file_info -> 输入产物路径；为 None 时以原始文件内容哈希作为输入指纹。
+        :param output_path: 函数 file_info -> 输出产物路径；为 None 表示输出不在文件系统中（如向量库）。
+        :param applies: 函数 file_info -> bool，判断该阶段是否适用于此文件。
+        :param run_one: 函数 (ctx, file_info) -> detail，处理单个文件，失败时抛出异常。
+        :param run_batch: 函数 (ctx, file_infos) -> {relative_path: (ok, detail)}，整批处理时使用。
+        :param fingerprint: 函数 path -> 指纹，用于计算输入产物的指纹，默认为内容哈希。
+        :param finalize: 函数 (ctx, rerun_paths) -> None，阶段结束后执行一次（没有脏文件时也执行），
+            用于清理已删除源文件的产物等整体性工作；rerun_paths 为本次成功处理的文件。
+        """
+        self.name = name
+        self.catalog_stage = catalog_stage
+        self.deps = tuple(deps)
+        self.input_path = input_path
+        self.output_path = output_path
+        self.applies = applies
+        self.run_one = run_one
+        self.run_batch = run_batch
+        self.fingerprint = fingerprint
+        self.finalize = finalize
+
+    def input_fingerprint(self, file_info):
+        """
+        计算该阶段输入的指纹；输入产物尚不存在时返回 None。
+        """
+        if self.input_path is None:
+            return file_info["content_hash"]
+        path = self.input_path(file_info)
+        if not os.path.exists(path):
+            return None
+        return self.fingerprint(path)
+
+    def is_dirty(self, catalog, file_info, fingerprint):
+        if self.output_path and not os.path.exists(self.output_path(file_info)):
+            return True
+        progress = catalog.get_progress(file_info["relative_path"], self.catalog_stage)
+        if not progress or progress["state"] != "done":
+            return True
+        return progress["fingerprint"] != fingerprint
+
+    def run(self, ctx, file_infos):
+        """
+        执行该阶段：整批阶段直接交给 run_batch，否则用线程池并行处理各个文件。
+
+        :return: {relative_path: (ok, detail)}
+        """
+        if self.run_batch is not None:
+            return self.run_batch(ctx, file_infos)
+
+        def run_safely(file_info):
+            try:
+                return True, self.run_one(ctx, file_info)
+            except Exception as e:
+                print(
+                    f"  - [错误] {self.name} 处理 {file_info['relative_path']} 失败: {e}"
+                )
+                return False, str(e)
+
+        with ThreadPoolExecutor(max_workers=ctx.workers) as executor:
+            results = list(executor.map(run_safely, file_infos))
+        return {
+            file_info["relative_path"]: result
+            for file_info, result in zip(file_infos, results)
+        }
+
+
+def _is_markdown(file_info):
+    return file_info["file_name"].endswith(".md")
+
+
+# ----------------------------------------------------------------------
+# 各阶段的执行函数
+# ----------------------------------------------------------------------
+def _run_copy(ctx, file_info):
+    load_script("01_use_mineru_process_raw_files").copy_markdown_file(
+        file_info, RAW_FILES_DIR, RAW_MD_DIR
+    )
+    return "copied"
+
+
+def _run_mineru(ctx, file_infos):
+    """
+    上传到 MinerU 并等待解析结果下载完成。已上传且内容未变化的文件只轮询，不重复上传。
+    """
+    upload_script = load_script("01_use_mineru_process_raw_files")
+    download_script = load_script("02_download_mineru_files")
+
+    api_token = os.getenv("MINERU_API_TOKEN")
+    api_url = os.getenv("MINERU_API_URL")
+    poll_url_base = os.getenv(
+        "MINERU_POLL_URL", "https://mineru.net/api/v4/extract-results/batch"
+    )
+    if not api_token or not api_url:
+        message = "未设置 MINERU_API_TOKEN 或 MINERU_API_URL"
+        print(f"  - [错误] {message}")
+        return {info["relative_path"]: (False, message) for info in file_infos}
+
+    header = upload_script.build_header(api_token)
+    pending = []
+    to_upload = []
+    for file_info in file_infos:
+        progress = ctx.catalog.get_progress(file_info["relative_path"], STAGE_UPLOAD)
+        already_uploaded = (
+            file_info["batch_id"]
+            and progress
+            and progress["state"] == "done"
+            and progress["fingerprint"] == file_info["content_hash"]
+        )
+        if already_uploaded:
+            pending.append(file_info)
+        else:
+            to_upload.append(file_info)
+
+    if to_upload:
+        uploaded = upload_script.upload_files_batched(
+            to_upload,
+            api_url,
+            header,
+            batch_size=int(os.getenv("MINERU_UPLOAD_BATCH_SIZE", "50")),
+            upload_workers=int(os.getenv("MINERU_UPLOAD_WORKERS", "8")),
+            on_uploaded=lambda info, batch_id: ctx.catalog.set_batch_id(
+                info["relative_path"], batch_id
+            ),
+        )
+        pending.extend(ctx.catalog.get_file(path) for path in uploaded)
+
+    if pending:
+        download_script.wait_and_download_files(
+            ctx.catalog,
+            pending,
+            poll_url_base,
+            api_token,
+            RAW_FILES_DIR,
+            RAW_MD_DIR,
+            download_workers=int(os.getenv("MINERU_DOWNLOAD_WORKERS", "4")),
+        )
+
+    results = {}
+    for file_info in file_infos:
+        zip_path = artifact_path(RAW_MD_DIR, file_info, ".zip")
+        if os.path.exists(zip_path):
+            results[file_info["relative_path"]] = (
+                True,
+                ctx.catalog.to_relative(zip_path),
+            )
+        else:
+            results[file_info["relative_path"]] = (False, "MinerU 未返回结果")
+    return results
+
+
+def _run_unzip(ctx, file_info):
+    md_path = load_script("03_unzip_mineru_files_and_rename_md_file").extract_zip_file(
+        artifact_path(RAW_MD_DIR, file_info, ".zip")
+    )
+    if not md_path:
+        raise FileNotFoundError("zip 中未找到 full.md")
+    return os.path.basename(md_path)
+
+
+def _run_structure(ctx, file_info):
+    ok, last_error = load_script(
+        "04_use_llm_structure_markdown_files"
+    ).structure_md_file(
+        artifact_path(RAW_MD_DIR, file_info, ".md"),
+        artifact_path(STRUCTURE_MD_DIR, file_info, ".md"),
+        limiter=ctx.llm_limiter,
+    )
+    if not ok:
+        raise RuntimeError(last_error)
+    return None
+
+
+def _run_chunk(ctx, file_info):
+    chunks = load_script("05_chunk_md_files_and_store_chunks").chunk_md_file(
+        artifact_path(STRUCTURE_MD_DIR, file_info, ".md"),
+        ctx.chunk_store,
+        file_info["raw_stem"],
+    )
+    # 没有分块时写入的是只有头部的分块文件，仍记为成功，源文件不变时不再重复分块
+    return f"{len(chunks)} chunks"
+
+
+def _run_vector(ctx, file_info):
+    added = load_script(
+        "06_create_vector_database_from_chunks"
+    ).add_source_to_vector_store(
+        ctx.vector_store, ctx.chunk_store, file_info["raw_stem"]
+    )
+    return f"{added} vectors"
+
+
+def _finalize_chunk(ctx, rerun_paths):
+    """
+    删除原始文件已从清单中移除的分块文件，并在分块有变化时增量更新检索服务使用的 BM25 倒排索引。
+    """
+    live_stems = {info["raw_stem"] for info in ctx.catalog.iter_files()}
+    for source_key in list(ctx.chunk_store.iter_sources()):
+        if source_key not in live_stems and ctx.chunk_store.delete_source(source_key):
+            print(f"  - 已删除过期的分块文件: {ctx.chunk_store.path_for(source_key)}")
+
+    # 索引记录了各分块文件的 stat 指纹，分块未变化时只做一次比对，有变化时只重新索引变化的源文件；
+    # 也覆盖了处理失败时被删除的分块文件，以及上次运行未完成的重建
+    index_dir = default_index_dir(PROJECT_ROOT)
+    indexed = update_lexical_index(ctx.chunk_store, index_dir)
+    if indexed is not None:
+        print(f"  - 倒排索引已更新，重新索引了 {indexed} 个分块: {index_dir}")
+
+
+def _vector_fingerprint(chunk_file_path):
+    # 指纹包含向量元数据版本，元数据字段变化后分块未变的文件也会重新同步
+    return load_script("06_create_vector_database_from_chunks").vector_fingerprint(
+        chunk_file_path
+    )
+
+
+def _finalize_vector(ctx, rerun_paths):
+    """
+    删除源文件已不在分块存储中的向量。
+    """
+    removed = load_script("06_create_vector_database_from_chunks").delete_stale_sources(
+        ctx.vector_store, ctx.chunk_store.iter_sources()
+    )
+    if removed:
+        print(f"  - 删除了 {removed} 个源文件已不存在的向量。")
+
+
+def _run_graph(ctx, file_info):
+    total = ctx.chunk_store.count(file_info["raw_stem"])
+    writer, llm_transformer = ctx.graph_components
+    failed_indices = load_script(
+        "07_create_knowledge_graph_from_chunks"
+    ).add_chunks_to_graph(
+        writer,
+        llm_transformer,
+        ctx.chunk_store.iter_documents(file_info["raw_stem"]),
+        total=total,
+        workers=ctx.graph_concurrency.max_limit,
+        limiter=ctx.llm_limiter,
+        concurrency=ctx.graph_concurrency,
+        cache=ctx.graph_cache,
+    )
+    if failed_indices:
+        raise RuntimeError(f"{len(failed_indices)} 个文档块写入图谱失败")
+    return f"{total} chunks"
+
+
+# ----------------------------------------------------------------------
+# 流水线定义：原始文件 → MinerU zip → md → 结构化 md → 分块存储 → 向量 / 图谱
+# ----------------------------------------------------------------------
+STAGES = [
+    Stage(
+        "copy",
+        STAGE_UPLOAD,
+        output_path=lambda info: artifact_path(RAW_MD_DIR, info, ".md"),
+        applies=_is_markdown,
+        run_one=_run_copy,
+    ),
+    Stage(
+        "mineru",
+        STAGE_DOWNLOAD,
+        output_path=lambda info: artifact_path(RAW_MD_DIR, info, ".zip"),
+        applies=lambda info: not _is_markdown(info),
+        run_batch=_run_mineru,
+    ),
+    Stage(
+        "unzip",
+        STAGE_UNZIP,
+        deps=["mineru"],
+        input_path=lambda info: artifact_path(RAW_MD_DIR, info, ".zip"),
+        output_path=lambda info: artifact_path(RAW_MD_DIR, info, ".md"),
+        applies=lambda info: not _is_markdown(info),
+        run_one=_run_unzip,
+        # 下载的 zip 只会被整体替换，用 stat 指纹即可，免去每次哈希整个 zip
+        fingerprint=stat_fingerprint,
+    ),
+    Stage(
+        "structure",
+        STAGE_STRUCTURE,
+        deps=["copy", "unzip"],
+        input_path=lambda info: artifact_path(RAW_MD_DIR, info, ".md"),
+        output_path=lambda info: artifact_path(STRUCTURE_MD_DIR, info, ".md"),
+        run_one=_run_structure,
+    ),
+    Stage(
+        "chunk",
+        STAGE_CHUNK,
+        deps=["structure"],
+        input_path=lambda info: artifact_path(STRUCTURE_MD_DIR, info, ".md"),
+        output_path=lambda info: artifact_path(CHUNKS_DIR, info, CHUNK_FILE_SUFFIX),
+        run_one=_run_chunk,
+        finalize=_finalize_chunk,
+    ),
+    Stage(
+        "vector",
+        STAGE_VECTOR,
+        deps=["chunk"],
+        input_path=lambda info: artifact_path(CHUNKS_DIR, info, CHUNK_FILE_SUFFIX),
+        run_one=_run_vector,
+        fingerprint=_vector_fingerprint,
+        finalize=_finalize_vector,
+    ),
+    Stage(
+        "graph",
+        STAGE_GRAPH,
+        deps=["chunk"],
+        input_path=lambda info: artifact_path(CHUNKS_DIR, info, CHUNK_FILE_SUFFIX),
+        run_one=_run_graph,
+    ),
+]
+
+
+def run_pipeline(stage_names=None, workers=4, dry_run=False):
+    """
+    增量运行整条流水线：先扫描原始文件，再按依赖顺序逐个阶段只处理“脏”文件。
+
+    一个文件在某阶段被视为脏，当且仅当：上游阶段在本次运行中重新执行过、
+    输出产物不存在、清单中没有成功记录，或输入指纹与记录不一致。
+    某阶段处理失败的文件不会进入其下游阶段。
+
+    :param stage_names: 只运行这些阶段（仍会按依赖顺序执行）；None 表示全部阶段。
+    :param workers: 每个阶段内并行处理的文件数。
+    :param dry_run: 只打印执行计划，不实际运行。
+    """
+    with FileCatalog.open_default(PROJECT_ROOT) as catalog:
+        # --- 1. 增量扫描原始文件 ---
+        print(f"正在扫描目录: {RAW_FILES_DIR}")
+        stats = catalog.scan(RAW_FILES_DIR)
+        print(
+            f"扫描完成！新增 {stats['added']} 个，变化 {stats['changed']} 个，"
+            f"未变化 {stats['unchanged']} 个，删除 {stats['removed']} 个。"
+        )
+
+        files = catalog.iter_files()
+        ctx = PipelineContext(catalog, workers)
+        # 本次运行中各阶段重新执行过的文件、以及失败或无法执行的文件
+        rerun = {stage.name: set() for stage in STAGES}
+        blocked = set()
+
+        # --- 2. 按依赖顺序执行各阶段 ---
+        for stage in STAGES:
+            if stage_names and stage.name not in stage_names:
+                continue
+
+            dirty = []
+            fingerprints = {}
+            for file_info in files:
+                relative_path = file_info["relative_path"]
+                if not stage.applies(file_info) or relative_path in blocked:
+                    continue
+
+                fingerprint = stage.input_fingerprint(file_info)
+                upstream_rerun = any(relative_path in rerun[dep] for dep in stage.deps)
+                if fingerprint is None and not (dry_run and upstream_rerun):
+                    # 输入产物不存在，说明上游尚未完成
+                    blocked.add(relative_path)
+                    continue
+                if upstream_rerun or stage.is_dirty(catalog, file_info, fingerprint):
+                    dirty.append(file_info)
+                    fingerprints[relative_path] = fingerprint
+
+            print(f"\n--- 阶段 [{stage.name}]: {len(dirty)} 个文件需要处理 ---")
+            if dry_run:
+                for file_info in dirty:
+                    print(f"  - {file_info['relative_path']}")
+                rerun[stage.name].update(info["relative_path"] for info in dirty)
+                continue
+
+            if dirty:
+                results = stage.run(ctx, dirty)
+                for file_info in dirty:
+                    relative_path = file_info["relative_path"]
+                    ok, detail = results.get(relative_path, (False, "未执行"))
+                    if ok:
+                        # 产物在本阶段才生成时（如 mineru 阶段），指纹在执行后才可计算
+                        fingerprint = fingerprints[
+                            relative_path
+                        ] or stage.input_fingerprint(file_info)
+                        catalog.record_progress(
+                            relative_path,
+                            stage.catalog_stage,
+                            fingerprint=fingerprint,
+                            detail=detail,
+                        )
+                        rerun[stage.name].add(relative_path)
+                    else:
+                        catalog.record_progress(
+                            relative_path,
+                            stage.catalog_stage,
+                            state="failed",
+                            fingerprint=fingerprints[relative_path],
+                            detail=detail,
+                        )
+                        blocked.add(relative_path)
+
+                done = len(rerun[stage.name])
+                print(
+                    f"阶段 [{stage.name}] 完成：成功 {done} 个，失败 {len(dirty) - done} 个。"
+                )
+
+            if stage.finalize is not None:
+                stage.finalize(ctx, rerun[stage.name])
+
+        if blocked:
+            print(f"\n有 {len(blocked)} 个文件因上游未完成或处理失败而未走完流水线。")
+        print("\n流水线运行完成。")
+
+
+if __name__ == "__main__":
+    # --- 加载环境变量 ---
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="增量运行知识库构建流水线")
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=[stage.name for stage in STAGES],
+        help="只运行指定的阶段（默认运行全部阶段）",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="每个阶段内并行处理的文件数"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="只打印需要重新处理的文件，不实际执行"
+    )
+    args = parser.parse_args()
+
+    run_pipeline(stage_names=args.stages, workers=args.workers, dry_run=args.dry_run)
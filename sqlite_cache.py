@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import argparse
+import threading
+
+_COUNTERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class SQLiteCache:
+    """
+    基于 SQLite 的持久化缓存基类，llm_cache、embedding_cache 和 graph_cache 共用。
+
+    负责打开 WAL 模式的连接、跨线程共享连接时的加锁、命中/未命中统计（本进程计数保存在
+    实例上，累计值保存在 counters 表中），以及按模型清除条目。子类通过 SCHEMA 定义自己的表，
+    ENTRY_TABLE 指定保存缓存条目（含 model 列）的表，DEFAULT_NAME 为 knowledge_base 下的默认文件名。
+    """
+
+    SCHEMA = ""
+    ENTRY_TABLE = None
+    DEFAULT_NAME = None
+
+    def __init__(self, db_path, timeout=5.0):
+        """
+        :param db_path: SQLite 数据库文件路径。
+        :param timeout: 等待其他连接释放写锁的秒数。
+        """
+        self.db_path = db_path
+        # 本进程内的命中统计，累计值保存在 counters 表中
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # 缓存通常在线程池中并发读写，因此允许跨线程共享连接，并用锁串行化访问
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # counters 表先建，子类的 SCHEMA 可以在触发器中引用它
+        self._conn.executescript(_COUNTERS_SCHEMA + self.SCHEMA)
+
+    @classmethod
+    def open_default(cls, project_root, kb_dir="knowledge_base", **kwargs):
+        """
+        打开项目默认位置的缓存 (knowledge_base/<DEFAULT_NAME>)。
+        """
+        return cls(os.path.join(project_root, kb_dir, cls.DEFAULT_NAME), **kwargs)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _increment(self, name, amount=1):
+        if amount:
+            self._conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (name, amount),
+            )
+
+    def _record_lookups(self, hit_count, miss_count):
+        """
+        累加命中/未命中次数，需在持有锁的事务中调用。
+        """
+        self.hits += hit_count
+        self.misses += miss_count
+        self._increment("hits", hit_count)
+        self._increment("misses", miss_count)
+
+    def _after_invalidate(self, model):
+        """
+        invalidate 在同一事务中调用的钩子，子类可在此清理数据库之外的数据。
+        """
+
+    def invalidate(self, model=None):
+        """
+        清除缓存条目。
+
+        :param model: 只清除该模型的条目；为 None 时清空全部缓存。
+        :return: 删除的条目数。
+        """
+        with self._lock, self._conn:
+            if model is None:
+                cursor = self._conn.execute(f"DELETE FROM {self.ENTRY_TABLE}")
+            else:
+                cursor = self._conn.execute(
+                    f"DELETE FROM {self.ENTRY_TABLE} WHERE model = ?", (model,)
+                )
+            self._after_invalidate(model)
+            return cursor.rowcount
+
+    def stats(self):
+        """
+        返回缓存的条目数，以及本进程和累计的命中/未命中次数；子类在此基础上补充各自的统计项。
+        """
+        with self._lock:
+            entries = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self.ENTRY_TABLE}"
+            ).fetchone()[0]
+            counters = dict(
+                self._conn.execute("SELECT name, value FROM counters").fetchall()
+            )
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "total_hits": counters.get("hits", 0),
+                "total_misses": counters.get("misses", 0),
+            }
+
+
+def format_lookups(stats):
+    """
+    将 stats() 中的命中/未命中次数格式化为摘要，供各缓存的 format_stats 拼接。
+    """
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = f"{stats['hits'] / lookups:.0%}" if lookups else "-"
+    return (
+        f"本次命中 {stats['hits']} 次，未命中 {stats['misses']} 次（命中率 {hit_rate}）；"
+        f"累计命中 {stats['total_hits']} 次，未命中 {stats['total_misses']} 次。"
+    )
+
+
+def build_cli_parser(description):
+    """
+    创建缓存命令行工具的参数解析器，包含通用的 stats 和 clear 子命令。
+
+    :return: (parser, subparsers)，调用方可继续添加自己的子命令。
+    """
+    parser = argparse.ArgumentParser(description=description)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="查看缓存统计信息")
+    clear_parser = subparsers.add_parser("clear", help="清除缓存条目")
+    clear_parser.add_argument("--model", help="只清除该模型的缓存，默认清空全部")
+    return parser, subparsers
+
+
+def run_cli_command(cache, args):
+    """
+    执行通用的 clear 子命令（stats 无需额外操作）。
+    """
+    if args.command == "clear":
+        removed = cache.invalidate(args.model)
+        print(f"已清除 {removed} 条缓存。")
@@ -0,0 +1,625 @@
+import os
+import json
+import mmap
+import time
+import argparse
+import collections
+
+import numpy as np
+
+from chunk_store import get_custom_metadata, header_path
+
+# NumPy 检索索引的目录，与 Chroma 向量库并列存放
+INDEX_DIRNAME = "03_vector_numpy_index"
+VECTORS_FILENAME = "vectors.npy"
+DOCUMENTS_FILENAME = "documents.jsonl"
+META_FILENAME = "index.json"
+
+# 文件格式版本，写在 index.json 中
+FORMAT_VERSION = 2
+
+# 导出时向量的排列顺序：同一文件类型、政策目录、源文件的向量在矩阵中连续存放，
+# 限定在这些范围内的检索只需扫描矩阵的一段
+PARTITION_KEYS = ("file_type", "top_folder", "source_key")
+
+# 缓存的过滤条件掩码数
+MASK_CACHE_SIZE = 256
+
+# 一次矩阵乘法处理的查询数和向量数，控制得分矩阵以及 float16 向量转为 float32 的临时内存占用
+QUERY_BLOCK_SIZE = 256
+ROW_BLOCK_SIZE = 8192
+
+# MMR 去冗余：相关性与多样性的权重（1 为只看相关性），以及相对于 k 多取的候选倍数
+MMR_LAMBDA = 0.5
+MMR_FETCH_FACTOR = 4
+
+
+def default_index_dir(project_root, kb_dir="knowledge_base"):
+    """
+    项目默认的 NumPy 检索索引目录 (knowledge_base/04_database/03_vector_numpy_index)。
+    """
+    return os.path.join(project_root, kb_dir, "04_database", INDEX_DIRNAME)
+
+
+def normalize_rows(matrix):
+    """
+    将矩阵的每一行归一化为单位向量（全零行保持不变），归一化后点积即余弦相似度。
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _match_condition(values, operator, operand):
+    """
+    逐个计算单个字段值的条件，返回布尔数组（用于没有建立倒排的字段）。
+    """
+    if operator == "$eq":
+        return np.array([value == operand for value in values], dtype=bool)
+    if operator == "$ne":
+        return np.array([value != operand for value in values], dtype=bool)
+    if operator == "$in":
+        operand = set(operand)
+        return np.array([value in operand for value in values], dtype=bool)
+    if operator == "$nin":
+        operand = set(operand)
+        return np.array([value not in operand for value in values], dtype=bool)
+    if operator == "$prefix":
+        return np.array(
+            [isinstance(value, str) and value.startswith(operand) for value in values],
+            dtype=bool,
+        )
+    raise ValueError(f"不支持的过滤运算符: {operator}")
+
+
+class MetadataIndex:
+    """
+    元数据的倒排索引，把过滤条件直接转换为行号，作为检索前的预过滤。
+
+    为每个字符串类型的字段建立 值 -> 行号数组 的映射，等值、$in、$nin、$ne
+    以及 $prefix（前缀匹配，如按标题路径过滤）只需查表，不必逐行比较；
+    其余字段（如数值）退回逐行比较。相同条件的掩码只计算一次。
+    """
+
+    def __init__(self, metadatas):
+        """
+        :param metadatas: 元数据字典列表，下标即行号。
+        """
+        self.metadatas = metadatas
+        postings = collections.defaultdict(lambda: collections.defaultdict(list))
+        for row, metadata in enumerate(metadatas):
+            for key, value in (metadata or {}).items():
+                if isinstance(value, str):
+                    postings[key][value].append(row)
+        self._postings = {
+            key: {value: np.asarray(rows) for value, rows in values.items()}
+            for key, values in postings.items()
+        }
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.metadatas)
+
+    def values(self, key):
+        """
+        返回字段的全部取值及其行数，如 {"original": 120, "construe": 480}。
+        """
+        return {value: len(rows) for value, rows in self._postings.get(key, {}).items()}
+
+    def _rows_mask(self, key, values):
+        mask = np.zeros(len(self), dtype=bool)
+        postings = self._postings.get(key, {})
+        for value in values:
+            rows = postings.get(value)
+            if rows is not None:
+                mask[rows] = True
+        return mask
+
+    def _condition_mask(self, key, condition):
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        mask = np.ones(len(self), dtype=bool)
+        for operator, operand in condition.items():
+            if operator == "$eq" and isinstance(operand, str):
+                mask &= self._rows_mask(key, [operand])
+            elif operator == "$in" and all(isinstance(v, str) for v in operand):
+                mask &= self._rows_mask(key, operand)
+            elif operator == "$ne" and isinstance(operand, str):
+                mask &= ~self._rows_mask(key, [operand])
+            elif operator == "$nin" and all(isinstance(v, str) for v in operand):
+                mask &= ~self._rows_mask(key, operand)
+            elif operator == "$prefix":
+                mask &= self._rows_mask(
+                    key,
+                    [v for v in self._postings.get(key, {}) if v.startswith(operand)],
+                )
+            else:
+                values = [(metadata or {}).get(key) for metadata in self.metadatas]
+                mask &= _match_condition(values, operator, operand)
+        return mask
+
+    def _build_mask(self, where):
+        mask = np.ones(len(self), dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._build_mask(clause)
+            elif key == "$or":
+                any_mask = np.zeros(len(self), dtype=bool)
+                for clause in condition:
+                    any_mask |= self._build_mask(clause)
+                mask &= any_mask
+            else:
+                mask &= self._condition_mask(key, condition)
+        return mask
+
+    def mask(self, where):
+        """
+        按 Chroma 风格的 where 条件计算布尔掩码；where 为空时返回 None。
+
+        支持字段等值、$eq/$ne/$in/$nin/$prefix，以及 $and/$or 组合，例如
+        {"$and": [{"file_type": "original"}, {"header_path": {"$prefix": "一、"}}]}。
+        """
+        if not where:
+            return None
+        cache_key = json.dumps(where, ensure_ascii=False, sort_keys=True)
+        mask = self._cache.get(cache_key)
+        if mask is None:
+            mask = self._build_mask(where)
+            if len(self._cache) >= MASK_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[cache_key] = mask
+        return mask
+
+
+def top_k(scores, k):
+    """
+    对得分矩阵的每一行取前 k 个下标（按得分降序），先用 argpartition 再只对 k 个候选排序。
+
+    :param scores: (查询数, 向量数) 的得分矩阵。
+    :param k: 每个查询返回的结果数。
+    :return: (下标矩阵, 得分矩阵)，形状均为 (查询数, k)。
+    """
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    return (
+        np.take_along_axis(candidates, order, axis=1),
+        np.take_along_axis(candidate_scores, order, axis=1),
+    )
+
+
+def mmr_select(
+    query_vector,
+    candidate_vectors,
+    k,
+    lambda_mult=MMR_LAMBDA,
+    groups=None,
+    max_per_group=None,
+):
+    """
+    最大边际相关性 (MMR) 选择：每一步选出 lambda * 相关性 - (1 - lambda) * 与已选结果的最大相似度
+    最高的候选，使结果既相关又彼此不重复。
+
+    候选之间的相似度矩阵用一次矩阵乘法算出，之后每一步只对整列向量做 np.maximum 更新，
+    没有逐对的 Python 循环。
+
+    :param query_vector: 查询向量。
+    :param candidate_vectors: (候选数, 维度) 的候选向量，不要求已归一化。
+    :param k: 选出的结果数。
+    :param lambda_mult: 相关性的权重，取值 0~1。
+    :param groups: 可选，每个候选所属的分组（如源文件标识），与 max_per_group 一起使用。
+    :param max_per_group: 每个分组最多选出的结果数，为 None 时不限制。
+    :return: 选中候选的下标列表，按选中顺序排列。
+    """
+    candidates = normalize_rows(candidate_vectors)
+    if not len(candidates) or k <= 0:
+        return []
+    query = normalize_rows(np.atleast_2d(query_vector))[0]
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    available = np.ones(len(candidates), dtype=bool)
+    redundancy = np.zeros(len(candidates), dtype=np.float32)
+    if groups is not None and max_per_group is not None:
+        _, group_codes = np.unique(
+            np.asarray([str(group) for group in groups]), return_inverse=True
+        )
+        group_counts = np.zeros(group_codes.max() + 1, dtype=np.int64)
+    else:
+        group_codes = None
+
+    selected = []
+    while len(selected) < k and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        index = int(np.argmax(scores))
+        selected.append(index)
+        available[index] = False
+        redundancy = (
+            similarity[index]
+            if len(selected) == 1
+            else np.maximum(redundancy, similarity[index])
+        )
+        if group_codes is not None:
+            code = group_codes[index]
+            group_counts[code] += 1
+            if group_counts[code] >= max_per_group:
+                available &= group_codes != code
+    return selected
+
+
+class NumpyVectorIndex:
+    """
+    基于内存映射矩阵的向量检索后端，可替代 Chroma 的读路径。
+
+    向量归一化后保存为 float32 或 float16 的 .npy 矩阵，打开索引时只做内存映射；
+    元数据和 ID 保存在 index.json 中，分块正文保存在 documents.jsonl 中并按偏移读取。
+    检索时把一批查询向量与整个矩阵做一次矩阵乘法，用 argpartition 取 top-k。
+    元数据过滤通过 MetadataIndex 转换为行号后作为预过滤，只在选中的行上计算得分；
+    矩阵按 PARTITION_KEYS 排序存放，同一分区的向量在物理上连续。
+
+    对外提供与 LangChain Chroma 相同的 similarity_search 系列方法，
+    但 similarity_search_with_score 返回的是余弦相似度（越大越相关），而不是距离。
+    """
+
+    def __init__(self, index_dir, embedding_function=None):
+        """
+        :param index_dir: 索引目录（由 export_from_chroma 生成）。
+        :param embedding_function: 计算查询向量的 Embeddings，只按向量检索时可为 None。
+        :raises FileNotFoundError: 索引不存在时抛出。
+        """
+        self.index_dir = index_dir
+        self.embeddings = embedding_function
+        with open(os.path.join(index_dir, META_FILENAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.model = meta["model"]
+        self.ids = meta["ids"]
+        self.metadatas = meta["metadatas"]
+        self._offsets = meta["offsets"]
+        self.vectors = np.load(os.path.join(index_dir, VECTORS_FILENAME), mmap_mode="r")
+        self._documents_file = open(os.path.join(index_dir, DOCUMENTS_FILENAME), "rb")
+        self._documents = (
+            mmap.mmap(self._documents_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._offsets[-1]
+            else b""
+        )
+        self.metadata_index = MetadataIndex(self.metadatas)
+
+    def close(self):
+        if isinstance(self._documents, mmap.mmap):
+            self._documents.close()
+        self._documents_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_text(self, index):
+        """
+        按行号读取分块正文。
+        """
+        return self._documents[self._offsets[index] : self._offsets[index + 1]].decode(
+            "utf-8"
+        )
+
+    def get_mask(self, where):
+        """
+        返回过滤条件对应的布尔掩码（带缓存）；where 为空时返回 None。
+        """
+        return self.metadata_index.mask(where)
+
+    def search_by_vectors(self, query_vectors, k=4, where=None, mask=None):
+        """
+        批量向量检索。
+
+        :param query_vectors: (查询数, 维度) 的查询向量，不要求已归一化。
+        :param k: 每个查询返回的结果数。
+        :param where: Chroma 风格的元数据过滤条件。
+        :param mask: 直接指定的布尔掩码，与 where 同时给出时取交集。
+        :return: 每个查询一个 [(行号, 余弦相似度)] 列表，按相似度降序。
+        """
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        where_mask = self.get_mask(where)
+        if where_mask is not None and mask is not None:
+            mask = where_mask & mask
+        elif where_mask is not None:
+            mask = where_mask
+
+        rows, row_offset = None, 0
+        matrix = self.vectors
+        if mask is not None:
+            # 预过滤：只在选中的行上计算。导出时按分区排序，按文件类型、政策目录、
+            # 源文件过滤时选中的行是连续的一段，直接取内存映射的切片，不复制数据
+            selected = np.flatnonzero(mask)
+            if len(selected) and selected[-1] - selected[0] + 1 == len(selected):
+                row_offset = int(selected[0])
+                matrix = self.vectors[row_offset : row_offset + len(selected)]
+            else:
+                rows = selected
+                matrix = self.vectors[rows]
+        if not len(matrix):
+            return [[] for _ in range(len(queries))]
+
+        # 按行分块计算得分：float16 存储的矩阵每次只把一块转为 float32，
+        # 不会为每次查询复制整个矩阵；各块的前 k 个结果再与已有的候选合并
+        best_indices = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for row_start in range(0, len(matrix), ROW_BLOCK_SIZE):
+            vectors = np.asarray(
+                matrix[row_start : row_start + ROW_BLOCK_SIZE], dtype=np.float32
+            )
+            block_indices, block_scores = [], []
+            for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+                indices, top_scores = top_k(
+                    queries[start : start + QUERY_BLOCK_SIZE] @ vectors.T, k
+                )
+                block_indices.append(indices + row_start)
+                block_scores.append(top_scores)
+            candidates = np.hstack([best_indices, np.vstack(block_indices)])
+            picks, best_scores = top_k(
+                np.hstack([best_scores, np.vstack(block_scores)]), k
+            )
+            best_indices = np.take_along_axis(candidates, picks, axis=1)
+
+        best_indices = (
+            rows[best_indices] if rows is not None else best_indices + row_offset
+        )
+        return [
+            list(zip(row_indices.tolist(), row_scores.tolist()))
+            for row_indices, row_scores in zip(best_indices, best_scores)
+        ]
+
+    def mmr_search_by_vector(
+        self,
+        query_vector,
+        k=4,
+        fetch_k=None,
+        lambda_mult=MMR_LAMBDA,
+        where=None,
+        max_per_source=None,
+    ):
+        """
+        先按相似度取 fetch_k 个候选，再用 MMR 从中选出 k 个互不重复的结果。
+
+        :param fetch_k: 候选数，默认 k * MMR_FETCH_FACTOR。
+        :param max_per_source: 同一源文件最多返回的结果数，为 None 时不限制。
+        :return: [(行号, 余弦相似度)] 列表，按 MMR 选中顺序排列。
+        """
+        hits = self.search_by_vectors(
+            [query_vector], fetch_k or k * MMR_FETCH_FACTOR, where
+        )[0]
+        rows = [row for row, _ in hits]
+        picks = mmr_select(
+            query_vector,
+            self.vectors[rows] if rows else np.empty((0, self.vectors.shape[1])),
+            k,
+            lambda_mult,
+            groups=[(self.metadatas[row] or {}).get("source_key") for row in rows],
+            max_per_group=max_per_source,
+        )
+        return [hits[pick] for pick in picks]
+
+    def _to_documents(self, hits):
+        from langchain_core.documents import Document
+
+        return [
+            (
+                Document(
+                    id=self.ids[index],
+                    page_content=self.get_text(index),
+                    metadata=dict(self.metadatas[index] or {}),
+                ),
+                score,
+            )
+            for index, score in hits
+        ]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        return self._to_documents(self.search_by_vectors([embedding], k, filter)[0])
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        return [
+            doc
+            for doc, _ in self.similarity_search_by_vector_with_score(
+                embedding, k, filter
+            )
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None):
+        embedding = self.embeddings.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k, filter)
+
+    def similarity_search(self, query, k=4, filter=None):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def max_marginal_relevance_search_by_vector(
+        self, embedding, k=4, fetch_k=20, lambda_mult=MMR_LAMBDA, filter=None
+    ):
+        hits = self.mmr_search_by_vector(embedding, k, fetch_k, lambda_mult, filter)
+        return [doc for doc, _ in self._to_documents(hits)]
+
+    def max_marginal_relevance_search(
+        self, query, k=4, fetch_k=20, lambda_mult=MMR_LAMBDA, filter=None
+    ):
+        embedding = self.embeddings.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(
+            embedding, k, fetch_k, lambda_mult, filter
+        )
+
+
+def _partition_sort_key(metadata):
+    return tuple(str(metadata.get(key) or "") for key in PARTITION_KEYS) + (
+        metadata.get("chunk_start") or 0,
+    )
+
+
+def export_from_chroma(vector_store, index_dir, dtype="float32", page_size=1000):
+    """
+    将 Chroma 集合中的全部向量、元数据和正文导出为 NumpyVectorIndex 的格式。
+
+    先读取全部元数据，按源文件标识补齐文件类型、政策目录和标题路径等过滤字段
+    （旧版本写入的向量可能缺少这些字段），再按 PARTITION_KEYS 排序后分页读取向量写入矩阵。
+    各文件先写临时文件再原子替换，index.json 最后写入，导出中断时旧索引仍然可用。
+
+    :param vector_store: LangChain Chroma 实例。
+    :param index_dir: 索引输出目录。
+    :param dtype: 向量矩阵的存储精度，"float32" 或 "float16"。
+    :param page_size: 每次从 Chroma 读取的条数。
+    :return: 导出的向量数。
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    listing = vector_store.get(include=["metadatas"])
+    metadatas = {}
+    for vector_id, metadata in zip(listing["ids"], listing["metadatas"]):
+        metadata = dict(metadata or {})
+        if metadata.get("source_key"):
+            metadata.update(get_custom_metadata(metadata["source_key"]))
+        metadata.setdefault("header_path", header_path(metadata))
+        metadatas[vector_id] = metadata
+    ordered_ids = sorted(metadatas, key=lambda i: _partition_sort_key(metadatas[i]))
+
+    vectors_path = os.path.join(index_dir, VECTORS_FILENAME)
+    documents_path = os.path.join(index_dir, DOCUMENTS_FILENAME)
+    offsets = [0]
+    matrix = None
+    with open(documents_path + ".part", "wb") as documents_file:
+        for start in range(0, len(ordered_ids), page_size):
+            page_ids = ordered_ids[start : start + page_size]
+            page = vector_store.get(ids=page_ids, include=["embeddings", "documents"])
+            # Chroma 按 ID 读取时不保证返回顺序，按 ID 重新排列
+            position = {vector_id: i for i, vector_id in enumerate(page["ids"])}
+            order = [position[vector_id] for vector_id in page_ids]
+            embeddings = normalize_rows(np.asarray(page["embeddings"])[order])
+            if matrix is None:
+                # 维度在读到第一页后才确定；直接写成 .npy 的内存映射，不必在内存中拼接整个矩阵
+                matrix = np.lib.format.open_memmap(
+                    vectors_path + ".part",
+                    mode="w+",
+                    dtype=dtype,
+                    shape=(len(ordered_ids), embeddings.shape[1]),
+                )
+            matrix[start : start + len(page_ids)] = embeddings
+            for i in order:
+                encoded = (page["documents"][i] or "").encode("utf-8")
+                documents_file.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+
+    if matrix is None:
+        matrix = np.lib.format.open_memmap(
+            vectors_path + ".part", mode="w+", dtype=dtype, shape=(0, 0)
+        )
+    matrix.flush()
+    del matrix
+    os.replace(vectors_path + ".part", vectors_path)
+    os.replace(documents_path + ".part", documents_path)
+
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "model": getattr(vector_store.embeddings, "model", None),
+        "dtype": dtype,
+        "partition_keys": list(PARTITION_KEYS),
+        "count": len(ordered_ids),
+        "ids": ordered_ids,
+        "metadatas": [metadatas[vector_id] for vector_id in ordered_ids],
+        "offsets": offsets,
+    }
+    meta_path = os.path.join(index_dir, META_FILENAME)
+    with open(meta_path + ".part", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(meta_path + ".part", meta_path)
+    return len(ordered_ids)
+
+
+def open_default(project_root, embedding_function=None):
+    """
+    打开项目默认位置的 NumPy 检索索引；未指定 embedding_function 时使用带缓存的智谱向量模型。
+    """
+    index_dir = default_index_dir(project_root)
+    if embedding_function is None:
+        from langchain_community.embeddings import ZhipuAIEmbeddings
+        from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+        with open(os.path.join(index_dir, META_FILENAME), "r", encoding="utf-8") as f:
+            model = json.load(f)["model"] or "embedding-3"
+        embedding_function = CachedEmbeddings(
+            ZhipuAIEmbeddings(model=model), EmbeddingCache.open_default(project_root)
+        )
+    return NumpyVectorIndex(index_dir, embedding_function)
+
+
+def benchmark(index, num_queries=1000, k=10):
+    """
+    用随机查询向量测量批量检索耗时，返回秒数。
+    """
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((num_queries, index.vectors.shape[1]))
+    started_at = time.perf_counter()
+    index.search_by_vectors(queries, k)
+    return time.perf_counter() - started_at
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出或查询 NumPy 向量检索索引。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="从 Chroma 向量库导出索引")
+    export_parser.add_argument(
+        "--dtype", choices=["float32", "float16"], default="float32"
+    )
+    query_parser = subparsers.add_parser("query", help="执行一次检索")
+    query_parser.add_argument("query", help="查询文本")
+    query_parser.add_argument("--k", type=int, default=3)
+    query_parser.add_argument("--file-type", choices=["original", "construe"])
+    query_parser.add_argument(
+        "--mmr-lambda", type=float, help="启用 MMR 去冗余并指定相关性权重 (0~1)"
+    )
+    query_parser.add_argument(
+        "--max-per-source", type=int, help="同一源文件最多返回的结果数（需启用 MMR）"
+    )
+    bench_parser = subparsers.add_parser("bench", help="用随机查询向量测量批量检索耗时")
+    bench_parser.add_argument("--queries", type=int, default=1000)
+    bench_parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    if args.command == "export":
+        import importlib
+
+        importlib.import_module(
+            "06_create_vector_database_from_chunks"
+        ).export_numpy_index(args.dtype)
+    elif args.command == "bench":
+        with NumpyVectorIndex(default_index_dir(PROJECT_ROOT)) as index:
+            elapsed = benchmark(index, args.queries, args.k)
+            print(
+                f"{len(index)} 个向量，{args.queries} 个查询 (k={args.k})，"
+                f"用时 {elapsed * 1000:.1f} 毫秒。"
+            )
+    else:
+        with open_default(PROJECT_ROOT) as index:
+            where = {"file_type": args.file_type} if args.file_type else None
+            if args.mmr_lambda is None:
+                results = index.similarity_search_with_score(args.query, args.k, where)
+            else:
+                results = index._to_documents(
+                    index.mmr_search_by_vector(
+                        index.embeddings.embed_query(args.query),
+                        args.k,
+                        lambda_mult=args.mmr_lambda,
+                        where=where,
+                        max_per_source=args.max_per_source,
+                    )
+                )
+            for doc, score in results:
+                print(f"\n--- {score:.4f} {doc.metadata} ---")
+                print(doc.page_content[:300])